@@ -1,11 +1,53 @@
 import os
+import sys
+import struct
+import numpy as np
 import pandas as pd
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import glob
 import json
+import hashlib
+import threading
+import time
+import queue
+import re
+import weakref
+import csv
+import pickle
+import gzip
+import io
+import argparse
+import shlex
+import unicodedata
+from difflib import SequenceMatcher
+from collections import ChainMap, OrderedDict
+from collections.abc import MutableMapping
+from typing import NamedTuple, Optional
+
+# Dependencia opcional: con pyarrow la caché columnar usa Arrow IPC (feather); si no, pickle de pandas
+try:
+    import pyarrow  # noqa: F401
+    FORMATO_CACHE = 'feather'
+except ImportError:
+    FORMATO_CACHE = 'pickle'
+
+# Dependencias opcionales de exportación: zstandard (compresión zstd) y xlsxwriter (Excel en memoria constante)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
 
 # Cargar variables de entorno
 load_dotenv()
@@ -25,31 +67,336 @@ DB = os.getenv('DB_NAME', 'tiendita_auxiliar')
 BASE_ORIGINAL = "D:/Proyectos/SQL/Mineria_Datos/tiendita_proyecto/tiendita_csv"        
 BASE_AUXILIAR = "D:/Proyectos/SQL/Mineria_Datos/tiendita_proyecto/tiendita_auxiliar_csv"    
 
+# Caché columnar de los CSV auxiliares (se valida por tamaño, fecha y hash del contenido)
+CACHE_COLUMNAR = os.getenv('CACHE_COLUMNAR', '1') == '1'
+DIR_CACHE = os.path.join(BASE_AUXILIAR, "_cache")
+
+# Journal de operaciones: las ediciones se agregan a un log por tabla en vez de reescribir el CSV
+JOURNAL_HABILITADO = os.getenv('JOURNAL', '1') == '1'
+DIR_JOURNAL = os.path.join(BASE_AUXILIAR, "_journal")
+# Cantidad de operaciones a partir de la cual el journal se compacta en el CSV base
+JOURNAL_MAX_OPERACIONES = int(os.getenv('JOURNAL_MAX_OPERACIONES', '500'))
+
+# Persistencia en segundo plano de las ediciones (cola acotada; 0 = guardar en primer plano).
+# Las ediciones del menú se acumulan en una transacción y se encolan al confirmarla (opción 15):
+# la cola recibe un trabajo por confirmación, no uno por edición
+PERSISTENCIA_SEGUNDO_PLANO = os.getenv('PERSISTENCIA_SEGUNDO_PLANO', '1') == '1'
+COLA_PERSISTENCIA_MAX = int(os.getenv('COLA_PERSISTENCIA_MAX', '64'))
+
+# Secuencias de IDs por tabla (siguiente valor de cada columna ID) guardadas junto a los CSV auxiliares
+DIR_SECUENCIAS = os.path.join(BASE_AUXILIAR, "_secuencias")
+# Consultar la secuencia de PostgreSQL (serial/identity) al inicializar cada secuencia
+SECUENCIAS_POSTGRES = os.getenv('SECUENCIAS_POSTGRES', '1') == '1'
+
+# Motor de filtros del menú: resultados cacheados por tabla
+FILTROS_CACHE_MAX = int(os.getenv('FILTROS_CACHE_MAX', '64'))
+
+# Índice de trigramas de la búsqueda global: persistirlo junto a la caché columnar
+INDICE_BUSQUEDA_PERSISTENTE = os.getenv('INDICE_BUSQUEDA_PERSISTENTE', '1' if CACHE_COLUMNAR else '0') == '1'
+
+# Visor paginado de resultados: filas por página y ancho máximo de cada columna
+FILAS_POR_PAGINA = int(os.getenv('FILAS_POR_PAGINA', '20'))
+ANCHO_MAX_COLUMNA = int(os.getenv('ANCHO_MAX_COLUMNA', '30'))
+
+# Exportaciones en streaming: filas por lote
+EXPORT_CHUNK_FILAS = int(os.getenv('EXPORT_CHUNK_FILAS', '50000'))
+# Límite de filas por hoja de Excel (incluye el encabezado)
+EXCEL_MAX_FILAS = 1048576
+
+# Deduplicación difusa al limpiar tablas (desactivada salvo DEDUP_DIFUSO=1: fusiona filas que no son idénticas):
+# ventana de comparación por bloque y umbral de similitud
+DEDUP_DIFUSO = os.getenv('DEDUP_DIFUSO', '0') == '1'
+DEDUP_VENTANA = int(os.getenv('DEDUP_VENTANA', '5'))
+DEDUP_UMBRAL = float(os.getenv('DEDUP_UMBRAL', '0.85'))
+
+# Verificación de integridad referencial antes de cada sincronización (desactivada salvo VERIFICAR_INTEGRIDAD_SYNC=1:
+# carga las tablas sincronizadas y sus padres; resultados cacheados por tabla)
+VERIFICAR_INTEGRIDAD_SYNC = os.getenv('VERIFICAR_INTEGRIDAD_SYNC', '0') == '1'
+
+# Descarga desde PostgreSQL a los CSV auxiliares: filas por bloque del cursor del servidor
+DESCARGA_CHUNK_FILAS = int(os.getenv('DESCARGA_CHUNK_FILAS', '50000'))
+
+# Reconciliación CSV/PostgreSQL por hash: rangos de clave por nivel, ancho de las hojas y claves informadas
+RECONCILIAR_RANGOS = int(os.getenv('RECONCILIAR_RANGOS', '64'))
+RECONCILIAR_HOJA = int(os.getenv('RECONCILIAR_HOJA', '256'))
+RECONCILIAR_MUESTRA = 20
+
+# Tipos de PostgreSQL que se cargan tal cual desde el staging (texto)
+TIPOS_TEXTO_POSTGRES = ('text', 'character', '"char"', 'name')
+# Tipos enteros: se convierten pasando por numeric para aceptar valores como '1.0'
+TIPOS_ENTEROS_POSTGRES = ('smallint', 'integer', 'bigint')
+
+# COPY en streaming: filas por bloque y formato ('csv', 'binary' o 'auto')
+COPY_CHUNK_FILAS = int(os.getenv('COPY_CHUNK_FILAS', '50000'))
+COPY_FORMATO = os.getenv('COPY_FORMATO', 'csv').lower()
+# Tamaño de lectura que usa copy_expert sobre el flujo (bytes/caracteres)
+COPY_TAMANO_LECTURA = 1024 * 1024
+
+# Sincronización incremental: estado (hash por fila) guardado junto a los CSV auxiliares
+SYNC_INCREMENTAL = os.getenv('SYNC_INCREMENTAL', '1') == '1'
+DIR_ESTADO_SYNC = os.path.join(BASE_AUXILIAR, "_estado_sync")
+
+# Orden de las tablas considerando dependencias y FK conocidas (se completan con las del catálogo)
+ORDEN_TABLAS = [
+    'provincias', 'localidades', 'condicion_iva', 'rubros', 
+    'proveedores', 'sucursales', 'clientes', 'productos', 
+    'facturas_encabezado', 'facturas_detalle', 'ventas'
+]
+DEPENDENCIAS_TABLAS = {
+    'localidades': ['provincias'],
+    'sucursales': ['localidades'],
+    'clientes': ['localidades'],
+    'productos': ['proveedores', 'rubros'],
+    'facturas_encabezado': ['clientes', 'condicion_iva', 'sucursales'],
+    'facturas_detalle': ['facturas_encabezado', 'productos'],
+    'ventas': ['facturas_encabezado'],
+}
+# Tamaño del pool de conexiones a PostgreSQL
+POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+POOL_MAX = int(os.getenv('DB_POOL_MAX', '8'))
+# Segundos sin uso tras los que una conexión del pool se verifica (SELECT 1) antes de prestarla
+POOL_VERIFICAR_INACTIVA = float(os.getenv('DB_POOL_VERIFICAR_SEG', '30'))
+
+# Filtrado referencial de la segunda pasada: tabla -> (fragmento de la columna FK, tabla padre, descripción)
+FILTROS_REFERENCIALES = {
+    'facturas_encabezado': ('cliente', 'clientes', 'clientes'),
+    'facturas_detalle': ('factura', 'facturas_encabezado', 'facturas'),
+}
+# Cantidad de claves de ejemplo que se informan por relación con huérfanas
+MUESTRA_HUERFANAS = 5
+
+# Cantidad de tablas que se sincronizan en paralelo (1 = secuencial), limitada por DB_POOL_MAX
+SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', '4'))
+
 # Variable global para referencia de tablas
 tablas_referencia = None
-# Variable global para conexión persistente
-postgres_conn = None
+# Índices de claves por tabla (conjunto + arreglo ordenado) para resolver FK sin recorrer las tablas
+indices_claves = {}
+_indices_lock = threading.Lock()
+# Índices por columna y caché de resultados de filtros, por tabla (se descartan si cambia el DataFrame)
+_motor_filtros = {}
+_motor_filtros_lock = threading.Lock()
+# Índices de trigramas de la búsqueda global, por tabla
+_indices_busqueda = {}
+_indices_busqueda_lock = threading.Lock()
+# Anchos de columna ya calculados por el visor paginado, por tabla (solo crecen)
+_anchos_columnas = {}
+# Resultados de la verificación de integridad por relación, con la firma de las tablas involucradas
+_cache_integridad = None
+_integridad_lock = threading.Lock()
+# Pool de conexiones compartido (sincronización, ediciones y tests de conexión)
+postgres_pool = None
+_pool_lock = threading.Lock()
+_pool_semaforo = threading.BoundedSemaphore(POOL_MAX)
+# Caché del catálogo de PostgreSQL (tablas, columnas, tipos, PK y FK)
+catalogo_postgres = None
+_catalogo_lock = threading.Lock()
+# Persistencia en segundo plano: guardados pendientes por tabla (se fusionan) y su cola de avisos
+_persistencia_pendiente = {}
+_persistencia_lock = threading.Lock()
+_persistencia_cola = None
+_persistencia_hilo = None
+_persistencia_ultimo_error = None
+# Operaciones acumuladas en el journal de cada tabla (desde la última compactación)
+_operaciones_journal = {}
 
 # =============================================================================
 # FUNCIONES DE MANEJO DE ARCHIVOS CSV
 # =============================================================================
 
-def cargar_tablas_desde_auxiliar():
-    """Carga las tablas desde la carpeta AUXILIAR sin modificar los datos"""
-    dataframes = {}
+def _hash_archivo(ruta):
+    """Hash del contenido de un archivo leído por bloques"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def _rutas_cache(nombre):
+    """Rutas de los datos columnares y de los metadatos de la caché de una tabla"""
+    return (os.path.join(DIR_CACHE, f"{nombre}.{FORMATO_CACHE}"),
+            os.path.join(DIR_CACHE, f"{nombre}.meta.json"))
+
+def _leer_meta_cache(nombre):
+    """Lee los metadatos de la caché de una tabla, o None si no hay caché utilizable"""
+    ruta_datos, ruta_meta = _rutas_cache(nombre)
+    if not (os.path.exists(ruta_datos) and os.path.exists(ruta_meta)):
+        return None
+    try:
+        with open(ruta_meta, encoding='utf-8') as f:
+            meta = json.load(f)
+        return meta if meta.get('formato') == FORMATO_CACHE else None
+    except Exception:
+        return None
+
+def _escribir_json_atomico(ruta, datos):
+    """Escribe un JSON a un archivo temporal y lo reemplaza de forma atómica"""
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+def _escribir_cache(nombre, df, meta):
+    """Guarda el DataFrame en formato columnar junto con su firma (tamaño, mtime y hash del CSV)"""
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    ruta_datos, ruta_meta = _rutas_cache(nombre)
+    temporal = f"{ruta_datos}.tmp"
+    if FORMATO_CACHE == 'feather':
+        df.to_feather(temporal)
+    else:
+        df.to_pickle(temporal)
+    os.replace(temporal, ruta_datos)
+    _escribir_json_atomico(ruta_meta, meta)
+
+def cargar_tabla_con_cache(ruta):
+    """Carga un CSV auxiliar usando la caché columnar si sigue vigente; si no, lo parsea y la regenera"""
+    nombre = os.path.basename(ruta).replace(".csv", "")
+    estado = os.stat(ruta)
+    meta = _leer_meta_cache(nombre) if CACHE_COLUMNAR else None
     
-    # Cargar directamente desde auxiliar (asume que existe)
-    for ruta in glob.glob(os.path.join(BASE_AUXILIAR, "*.csv")):
-        nombre = os.path.basename(ruta).replace(".csv", "")
-        # Excluir el archivo de log
-        if nombre != "log_cambios":
+    if meta and meta['tamano'] == estado.st_size:
+        vigente = meta['mtime_ns'] == estado.st_mtime_ns
+        if not vigente and meta['hash'] == _hash_archivo(ruta):
+            # Mismo contenido con otra fecha (copia, checkout...): se actualiza solo la firma
+            meta['mtime_ns'] = estado.st_mtime_ns
+            _escribir_json_atomico(_rutas_cache(nombre)[1], meta)
+            vigente = True
+        if vigente:
             try:
-                # Cargar sin modificar - mantener todos los datos originales
-                dataframes[nombre] = pd.read_csv(ruta, keep_default_na=False)
+                ruta_datos = _rutas_cache(nombre)[0]
+                return pd.read_feather(ruta_datos) if FORMATO_CACHE == 'feather' else pd.read_pickle(ruta_datos)
             except Exception as e:
-                print(f"❌ Error cargando {nombre}: {e}")
+                print(f"⚠️  Caché de {nombre} ilegible, se relee el CSV: {e}")
+    
+    # Cargar sin modificar - mantener todos los datos originales
+    df = pd.read_csv(ruta, keep_default_na=False)
     
-    return dataframes
+    if CACHE_COLUMNAR:
+        try:
+            _escribir_cache(nombre, df, {
+                'formato': FORMATO_CACHE, 'tamano': estado.st_size, 'mtime_ns': estado.st_mtime_ns,
+                'hash': _hash_archivo(ruta), 'filas': len(df), 'columnas': df.columns.tolist()
+            })
+        except Exception as e:
+            print(f"⚠️  No se pudo escribir la caché de {nombre}: {e}")
+    return df
+
+def cargar_tabla(ruta):
+    """Carga una tabla auxiliar: base desde la caché columnar más las operaciones pendientes del journal"""
+    nombre = os.path.basename(ruta).replace(".csv", "")
+    return reproducir_journal(cargar_tabla_con_cache(ruta), nombre)
+
+def _contar_filas_csv(ruta):
+    """Cuenta las filas de datos de un CSV contando saltos de línea por bloques (sin parsear)"""
+    saltos = 0
+    ultimo = b''
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            saltos += bloque.count(b'\n')
+            ultimo = bloque
+    if ultimo and not ultimo.endswith(b'\n'):
+        saltos += 1
+    return max(saltos - 1, 0)
+
+class RegistroTablas(MutableMapping):
+    """Registro perezoso de tablas: lista nombres y conteos con metadatos baratos y carga cada DataFrame al usarlo"""
+
+    def __init__(self, base=None):
+        self.base = base or BASE_AUXILIAR
+        self._rutas = {}
+        self._cargadas = {}
+        self._versiones = {}
+        for ruta in glob.glob(os.path.join(self.base, "*.csv")):
+            nombre = os.path.basename(ruta).replace(".csv", "")
+            # Excluir el archivo de log
+            if nombre != "log_cambios":
+                self._rutas[nombre] = ruta
+
+    def __getitem__(self, nombre):
+        if nombre not in self._cargadas:
+            if nombre not in self._rutas:
+                raise KeyError(nombre)
+            self._cargadas[nombre] = cargar_tabla(self._rutas[nombre])
+        return self._cargadas[nombre]
+
+    def __setitem__(self, nombre, df):
+        self.reemplazar(nombre, df)
+
+    def reemplazar(self, nombre, df, indice_vigente=False):
+        """Fija el DataFrame de una tabla; indice_vigente=True si su índice de claves ya se actualizó en el lugar"""
+        if self._cargadas.get(nombre) is df:
+            return
+        self._rutas.setdefault(nombre, os.path.join(self.base, f"{nombre}.csv"))
+        self._cargadas[nombre] = df
+        self._versiones[nombre] = self._versiones.get(nombre, 0) + 1
+        if not indice_vigente:
+            invalidar_indice_claves(nombre)
+
+    def __delitem__(self, nombre):
+        del self._rutas[nombre]
+        self._cargadas.pop(nombre, None)
+        self._versiones[nombre] = self._versiones.get(nombre, 0) + 1
+        invalidar_indice_claves(nombre)
+
+    def __contains__(self, nombre):
+        return nombre in self._rutas
+
+    def __iter__(self):
+        return iter(list(self._rutas))
+
+    def __len__(self):
+        return len(self._rutas)
+
+    def cargadas(self):
+        """Nombres de las tablas materializadas en esta sesión"""
+        return list(self._cargadas)
+
+    def recargar(self, nombre):
+        """Olvida la versión en memoria de la tabla (su CSV cambió por fuera): se vuelve a leer al usarla"""
+        self._rutas.setdefault(nombre, os.path.join(self.base, f"{nombre}.csv"))
+        self._cargadas.pop(nombre, None)
+        self._versiones[nombre] = self._versiones.get(nombre, 0) + 1
+        invalidar_indice_claves(nombre)
+
+    def version(self, nombre):
+        """Cantidad de veces que se reemplazó la tabla en esta sesión (0 = sigue igual que en disco)"""
+        return self._versiones.get(nombre, 0)
+
+    def columnas(self, nombre):
+        """Columnas de la tabla leyendo solo la cabecera del CSV (o del DataFrame si ya está cargado)"""
+        if nombre in self._cargadas:
+            return self._cargadas[nombre].columns.tolist()
+        with open(self._rutas[nombre], encoding='utf-8', newline='') as f:
+            return next(csv.reader(f), [])
+
+    def contar_filas(self, nombre):
+        """Cantidad de registros sin cargar la tabla: usa la caché (columnar o de conteo) si sigue vigente"""
+        if nombre in self._cargadas:
+            return len(self._cargadas[nombre])
+        
+        ruta = self._rutas[nombre]
+        estado = os.stat(ruta)
+        ajuste = _ajuste_filas_journal(nombre)
+        for meta in (_leer_meta_cache(nombre), _leer_conteo_cache(nombre)):
+            if meta and meta['tamano'] == estado.st_size and meta['mtime_ns'] == estado.st_mtime_ns:
+                return meta['filas'] + ajuste
+        
+        filas = _contar_filas_csv(ruta)
+        try:
+            os.makedirs(DIR_CACHE, exist_ok=True)
+            _escribir_json_atomico(os.path.join(DIR_CACHE, f"{nombre}.conteo.json"),
+                                   {'tamano': estado.st_size, 'mtime_ns': estado.st_mtime_ns, 'filas': filas})
+        except Exception:
+            pass
+        return filas + ajuste
+
+def _leer_conteo_cache(nombre):
+    """Lee el conteo de filas cacheado de una tabla (sin caché columnar), o None"""
+    try:
+        with open(os.path.join(DIR_CACHE, f"{nombre}.conteo.json"), encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
 
 def guardar_tabla_individual(df, nombre_tabla):
     """Guarda una tabla individual en la carpeta auxiliar sin limpiar automáticamente"""
@@ -59,58 +406,249 @@ def guardar_tabla_individual(df, nombre_tabla):
         
         # Guardar el archivo SIN limpiar automáticamente
         df.to_csv(ruta_salida, index=False, encoding='utf-8')
+        # El CSV ya contiene todo: el journal (si había) queda incorporado
+        descartar_journal(nombre_tabla)
         print(f"💾 Guardado: {nombre_tabla} ({len(df)} registros)")
         
     except Exception as e:
         print(f"❌ Error guardando {nombre_tabla}: {e}")
 
-def conectar_postgres_persistente():
-    """Conecta a PostgreSQL y mantiene la conexión abierta"""
-    global postgres_conn
-    try:
-        if postgres_conn is None or postgres_conn.closed:
-            postgres_conn = psycopg2.connect(
+class _ConexionTiendita(psycopg2.extensions.connection):
+    """Conexión de psycopg2 que recuerda cuándo volvió al pool y si su último uso terminó con error"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.devuelta = time.monotonic()
+        self.fallida = False
+
+def obtener_pool_postgres():
+    """Devuelve el pool de conexiones a PostgreSQL, creándolo la primera vez"""
+    global postgres_pool
+    with _pool_lock:
+        if postgres_pool is None or postgres_pool.closed:
+            postgres_pool = ThreadedConnectionPool(
+                POOL_MIN, POOL_MAX,
                 dbname=DB,
                 user=USER,
                 password=PASSWORD,
                 host=HOST,
-                port=PORT
+                port=PORT,
+                connection_factory=_ConexionTiendita
             )
-            print("🔌 Conexión PostgreSQL establecida")
-        return postgres_conn
+            print(f"🔌 Pool PostgreSQL creado ({POOL_MIN}-{POOL_MAX} conexiones)")
+        return postgres_pool
+
+def _conexion_sana(conn):
+    """Health check: verifica que la conexión siga viva (detecta reinicios del servidor)"""
+    if conn.closed:
+        return False
+    # Recién usada y sin errores: se presta sin ida y vuelta al servidor
+    if not getattr(conn, 'fallida', True) and time.monotonic() - conn.devuelta < POOL_VERIFICAR_INACTIVA:
+        return True
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        conn.rollback()
+        conn.fallida = False
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+def tomar_conexion():
+    """Toma una conexión sana del pool (espera si están todas en uso); None si no hay servidor"""
+    _pool_semaforo.acquire()
+    try:
+        pool = obtener_pool_postgres()
+        # Las conexiones muertas se descartan y el pool abre otras nuevas
+        for _ in range(POOL_MAX + 1):
+            conn = pool.getconn()
+            if _conexion_sana(conn):
+                return conn
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("no se obtuvo una conexión sana del pool")
     except Exception as e:
+        _pool_semaforo.release()
         print(f"❌ Error conectando a PostgreSQL: {e}")
         return None
 
+def devolver_conexion(conn):
+    """Devuelve una conexión al pool descartando cualquier transacción abierta"""
+    try:
+        if not conn.closed:
+            estado = conn.get_transaction_status()
+            # Una transacción con error (o una conexión en estado desconocido) se verifica al volver a prestarla
+            conn.fallida = estado in (psycopg2.extensions.TRANSACTION_STATUS_INERROR,
+                                      psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN)
+            if estado != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            conn.devuelta = time.monotonic()
+    except Exception:
+        conn.fallida = True
+    try:
+        postgres_pool.putconn(conn, close=conn.closed)
+    except Exception:
+        pass
+    finally:
+        _pool_semaforo.release()
+
+@contextmanager
+def sesion_postgres():
+    """Context manager: presta una conexión del pool (o None si no hay servidor) y la devuelve al salir"""
+    conn = tomar_conexion()
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            devolver_conexion(conn)
+
 def cerrar_conexion_postgres():
-    """Cierra la conexión a PostgreSQL"""
-    global postgres_conn
-    if postgres_conn and not postgres_conn.closed:
-        postgres_conn.close()
-        print("🔌 Conexión PostgreSQL cerrada")
-        postgres_conn = None
-
-def guardar_y_sincronizar(df, nombre_tabla):
-    """Guarda automáticamente en CSV y sincroniza con PostgreSQL usando conexión persistente"""
-    # 1. Guardar en CSV auxiliar
-    guardar_tabla_individual(df, nombre_tabla)
+    """Cierra todas las conexiones del pool de PostgreSQL"""
+    global postgres_pool
+    with _pool_lock:
+        if postgres_pool and not postgres_pool.closed:
+            postgres_pool.closeall()
+            print("🔌 Pool PostgreSQL cerrado")
+        postgres_pool = None
 
-    # 2. Intentar sincronizar con PostgreSQL usando conexión persistente
-    conn = conectar_postgres_persistente()
-    if conn:
-        try:
-            print(f"🔄 Sincronizando '{nombre_tabla}' con PostgreSQL...")
-            if actualizar_tabla_postgres(conn, df, nombre_tabla):
-                conn.commit()
-                print(f"✅ '{nombre_tabla}' sincronizada correctamente en PostgreSQL.")
-            else:
+def guardar_y_sincronizar(df, nombre_tabla, operaciones=None):
+    """Guarda y sincroniza la tabla; con persistencia en segundo plano solo encola el guardado y vuelve enseguida"""
+    if PERSISTENCIA_SEGUNDO_PLANO:
+        encolar_persistencia(df, nombre_tabla, operaciones)
+    else:
+        _guardar_y_sincronizar_ahora(df, nombre_tabla, operaciones)
+
+def persistir_tabla(df, nombre_tabla, operaciones=None):
+    """Guarda solo el cambio en el journal si se indican las operaciones; si no, el CSV auxiliar completo"""
+    if JOURNAL_HABILITADO and operaciones:
+        guardar_en_journal(df, nombre_tabla, operaciones)
+    else:
+        guardar_tabla_individual(df, nombre_tabla)
+
+def _guardar_y_sincronizar_ahora(df, nombre_tabla, operaciones=None):
+    """Guarda automáticamente (journal si se indican las operaciones, si no CSV completo) y sincroniza con PostgreSQL"""
+    # 1. Guardar: solo el cambio en el journal, o el CSV auxiliar completo
+    persistir_tabla(df, nombre_tabla, operaciones)
+
+    # 2. Intentar sincronizar con PostgreSQL con una conexión sana del pool
+    with sesion_postgres() as conn:
+        if conn:
+            try:
+                print(f"🔄 Sincronizando '{nombre_tabla}' con PostgreSQL...")
+                reporte = {}
+                if actualizar_tabla_postgres(conn, df, nombre_tabla, reporte=reporte):
+                    confirmar_sincronizacion(conn, nombre_tabla, reporte.get('estado_sync'))
+                    print(f"✅ '{nombre_tabla}' sincronizada correctamente en PostgreSQL.")
+                    if 'eliminaciones_bloqueadas' in reporte:
+                        _avisar_eliminaciones_bloqueadas(nombre_tabla, reporte['eliminaciones_bloqueadas'][2])
+                else:
+                    conn.rollback()
+                    print(f"❌ Error sincronizando '{nombre_tabla}' en PostgreSQL")
+            except Exception as e:
                 conn.rollback()
-                print(f"❌ Error sincronizando '{nombre_tabla}' en PostgreSQL")
+                print(f"❌ Error sincronizando '{nombre_tabla}' en PostgreSQL: {e}")
+        else:
+            print("⚠️ No se pudo conectar a PostgreSQL. Se guardó solo el CSV auxiliar.")
+
+def _iniciar_persistencia():
+    """Arranca (una sola vez) el hilo que persiste y sincroniza en segundo plano"""
+    global _persistencia_cola, _persistencia_hilo
+    with _persistencia_lock:
+        if _persistencia_hilo is None or not _persistencia_hilo.is_alive():
+            _persistencia_cola = queue.Queue(maxsize=COLA_PERSISTENCIA_MAX)
+            _persistencia_hilo = threading.Thread(target=_trabajador_persistencia, name="persistencia", daemon=True)
+            _persistencia_hilo.start()
+
+def _trabajador_persistencia():
+    """Toma tablas de la cola y guarda/sincroniza el último estado pendiente de cada una"""
+    global _persistencia_ultimo_error
+    while True:
+        nombre_tabla = _persistencia_cola.get()
+        try:
+            if nombre_tabla is None:
+                return
+            with _persistencia_lock:
+                pendiente = _persistencia_pendiente.pop(nombre_tabla, None)
+            if pendiente and pendiente['hijas']:
+                hijas = {hija: (entrada['df'], _operaciones_pendientes(entrada))
+                         for hija, entrada in pendiente['hijas'].items()}
+                _guardar_cascada_ahora(pendiente['df'], nombre_tabla, _operaciones_pendientes(pendiente),
+                                       hijas, pendiente['tablas'])
+            elif pendiente:
+                # Todas las ediciones acumuladas de la tabla: una escritura y una sincronización
+                _guardar_y_sincronizar_ahora(pendiente['df'], nombre_tabla, _operaciones_pendientes(pendiente))
         except Exception as e:
-            conn.rollback()
-            print(f"❌ Error sincronizando '{nombre_tabla}' en PostgreSQL: {e}")
-    else:
-        print("⚠️ No se pudo conectar a PostgreSQL. Se guardó solo el CSV auxiliar.")
+            _persistencia_ultimo_error = f"{nombre_tabla}: {e}"
+            print(f"❌ Error en guardado en segundo plano de {nombre_tabla}: {e}")
+        finally:
+            _persistencia_cola.task_done()
+
+def _operaciones_pendientes(pendiente):
+    """Operaciones a escribir en el journal de un guardado pendiente (None = reescribir el CSV completo)"""
+    return None if pendiente['completo'] else pendiente['operaciones']
+
+def _fusionar_guardado(pendiente, df, operaciones):
+    """Acumula un guardado sobre uno pendiente: queda el último DataFrame y se suman las operaciones"""
+    pendiente['df'] = df
+    pendiente['completo'] = pendiente['completo'] or not operaciones
+    pendiente['operaciones'].extend(operaciones or [])
+
+def encolar_persistencia(df, nombre_tabla, operaciones=None, hijas=None, tablas=None):
+    """
+    Encola el guardado de una tabla, fusionándolo con uno pendiente de la misma tabla si lo hay.
+    Con hijas ({tabla: (df, operaciones)}) la tabla y sus hijas remapeadas se guardan y sincronizan
+    en un mismo trabajo, la padre antes que las hijas.
+    """
+    _iniciar_persistencia()
+    with _persistencia_lock:
+        pendiente = _persistencia_pendiente.get(nombre_tabla)
+        nuevo = pendiente is None
+        if nuevo:
+            pendiente = _persistencia_pendiente[nombre_tabla] = {
+                'df': df, 'operaciones': [], 'completo': False, 'hijas': {}, 'tablas': None
+            }
+        # Si ya hay un guardado en cola: se reemplaza el DataFrame y se acumulan las operaciones
+        _fusionar_guardado(pendiente, df, operaciones)
+        for hija, (df_hija, operaciones_hija) in (hijas or {}).items():
+            # Un guardado suelto de la hija aún en cola pasa a este trabajo: no debe sincronizarse antes que la padre
+            previo = _persistencia_pendiente.pop(hija, None)
+            for nieta, entrada in (previo['hijas'] if previo else {}).items():
+                if pendiente['hijas'].setdefault(nieta, entrada) is not entrada:
+                    pendiente['hijas'][nieta]['completo'] = True
+            entrada = pendiente['hijas'].setdefault(hija, {
+                'df': df_hija,
+                'operaciones': list(previo['operaciones']) if previo else [],
+                'completo': previo['completo'] if previo else False,
+            })
+            _fusionar_guardado(entrada, df_hija, operaciones_hija)
+        if hijas:
+            pendiente['tablas'] = tablas
+    if nuevo:
+        # Cola acotada: si está llena, el menú espera (contrapresión) en vez de acumular memoria
+        _persistencia_cola.put(nombre_tabla)
+
+def estado_persistencia():
+    """Devuelve (guardados pendientes, último error) de la persistencia en segundo plano"""
+    en_curso = _persistencia_cola.unfinished_tasks if _persistencia_cola is not None else 0
+    return max(en_curso, len(_persistencia_pendiente)), _persistencia_ultimo_error
+
+def vaciar_persistencia():
+    """Espera a que terminen todos los guardados y sincronizaciones en segundo plano"""
+    if _persistencia_cola is None:
+        return
+    pendientes, _ = estado_persistencia()
+    if pendientes:
+        print(f"⏳ Esperando {pendientes} guardado(s) en segundo plano...")
+    _persistencia_cola.join()
+
+def detener_persistencia():
+    """Vacía la cola y detiene el hilo de persistencia"""
+    global _persistencia_hilo
+    vaciar_persistencia()
+    if _persistencia_hilo is not None and _persistencia_hilo.is_alive():
+        _persistencia_cola.put(None)
+        _persistencia_hilo.join()
+    _persistencia_hilo = None
 
 def registrar_cambio(nombre_tabla, cambios):
     """Registras cambios en el archivo log"""
@@ -120,6 +658,248 @@ def registrar_cambio(nombre_tabla, cambios):
         for linea in cambios:
             log.write(f"   - {linea}\n")
 
+# =============================================================================
+# JOURNAL DE OPERACIONES (ESCRITURA INCREMENTAL DE LAS EDICIONES)
+# =============================================================================
+
+def aplicar_operacion(df, op):
+    """Aplica una operación de edición (las mismas que guarda el journal) y devuelve un DataFrame nuevo"""
+    tipo = op['op']
+    
+    if tipo == 'insertar':
+        return pd.concat([df, pd.DataFrame(op['registros'])], ignore_index=True)
+    if tipo == 'eliminar_filas':
+        return df.drop(df.index[op['posiciones']]).reset_index(drop=True)
+    if tipo == 'insertar_filas':
+        # Inversa de eliminar_filas: cada fila vuelve a su posición original (posiciones ascendentes)
+        posiciones = np.asarray(op['posiciones'], dtype=np.int64)
+        total = len(df) + len(posiciones)
+        orden = np.empty(total, dtype=np.int64)
+        orden[np.setdiff1d(np.arange(total), posiciones, assume_unique=True)] = np.arange(len(df))
+        orden[posiciones] = len(df) + np.arange(len(posiciones))
+        return pd.concat([df, pd.DataFrame(op['registros'])], ignore_index=True).iloc[orden].reset_index(drop=True)
+    if tipo == 'reindexar':
+        return reindexar_ids(df, op['columna'])
+    if tipo == 'agregar_columna':
+        # Copia liviana: el DataFrame recibido no se modifica (puede estar encolado para guardarse)
+        df = df.copy(deep=False)
+        df[op['columna']] = op['valor']
+        return df
+    if tipo == 'remapear_columna':
+        df = df.copy(deep=False)
+        df[op['columna']] = remapear_valores(df[op['columna']], op['de'], op['a'])
+        return df
+    if tipo == 'restaurar_columna':
+        # Vuelve a poner la columna guardada (mismo largo que el DataFrame) en su lugar original
+        df = df.copy(deep=False)
+        valores = pd.Series(op['valores']).set_axis(df.index)
+        if op['columna'] in df.columns:
+            df[op['columna']] = valores
+        else:
+            df.insert(min(op.get('posicion', len(df.columns)), len(df.columns)), op['columna'], valores)
+        return df
+    if tipo == 'restaurar_tipos':
+        df = df.copy(deep=False)
+        for columna, tipo_columna in op['tipos'].items():
+            if columna in df.columns and df[columna].dtype != tipo_columna:
+                df[columna] = df[columna].astype(tipo_columna)
+        return df
+    if tipo == 'limpiar':
+        return limpiar_y_convertir_ids(df)
+    if tipo == 'renombrar_columna':
+        return df.rename(columns={op['de']: op['a']})
+    if tipo == 'eliminar_columna':
+        return df.drop(columns=[op['columna']])
+    if tipo == 'cambiar_tipo':
+        columna = op['columna']
+        df = df.copy(deep=False)
+        if op['tipo'] == 'int':
+            df[columna] = pd.to_numeric(df[columna], errors='coerce').fillna(0).astype(int)
+        elif op['tipo'] == 'float':
+            df[columna] = pd.to_numeric(df[columna], errors='coerce').fillna(0.0).astype(float)
+        elif op['tipo'] == 'str':
+            df[columna] = df[columna].astype(str)
+        else:
+            raise ValueError(f"Tipo no válido: {op['tipo']}")
+        return df
+    
+    raise ValueError(f"Operación desconocida: {tipo}")
+
+def _columna_guardada(df, columna):
+    """Copia de una sola columna (sin retener el resto del DataFrame) para poder restaurarla"""
+    return {'op': 'restaurar_columna', 'columna': columna, 'valores': df[columna].copy(),
+            'posicion': df.columns.get_loc(columna)}
+
+def inversas_de(df_antes, df_despues, op):
+    """
+    Operaciones que llevan df_despues de vuelta a df_antes tras aplicar op. Solo guardan lo que cambia:
+    las filas eliminadas o la columna modificada, nunca una copia del DataFrame completo.
+    """
+    tipo = op['op']
+    if tipo == 'insertar':
+        inversas = [{'op': 'eliminar_filas', 'posiciones': list(range(len(df_antes), len(df_despues)))}]
+    elif tipo == 'insertar_filas':
+        inversas = [{'op': 'eliminar_filas', 'posiciones': list(op['posiciones'])}]
+    elif tipo == 'eliminar_filas':
+        posiciones = sorted(set(int(p) for p in op['posiciones']))
+        inversas = [{'op': 'insertar_filas', 'posiciones': posiciones,
+                     'registros': df_antes.iloc[posiciones].reset_index(drop=True)}]
+    elif tipo == 'reindexar':
+        columna = op['columna']
+        sin_cambios = columna not in df_antes.columns or df_antes[columna].equals(df_despues[columna])
+        inversas = [] if sin_cambios else [_columna_guardada(df_antes, columna)]
+    elif tipo == 'agregar_columna':
+        inversas = [{'op': 'eliminar_columna', 'columna': op['columna']}]
+    elif tipo == 'renombrar_columna':
+        inversas = [{'op': 'renombrar_columna', 'de': op['a'], 'a': op['de']}]
+    elif tipo in ('eliminar_columna', 'cambiar_tipo', 'remapear_columna', 'restaurar_columna'):
+        inversas = [_columna_guardada(df_antes, op['columna'])] if op['columna'] in df_antes.columns \
+            else [{'op': 'eliminar_columna', 'columna': op['columna']}]
+    else:
+        raise ValueError(f"Operación sin inversa: {tipo}")
+    
+    # Insertar filas con nulos puede cambiar el tipo de otras columnas (int -> float): se restaura al final
+    tipos = {columna: df_antes[columna].dtype for columna in df_antes.columns
+             if columna in df_despues.columns and df_despues[columna].dtype != df_antes[columna].dtype}
+    if tipos:
+        inversas.append({'op': 'restaurar_tipos', 'tipos': tipos})
+    return inversas
+
+def inversas_por_diferencia(df_antes, df_despues, supervivientes):
+    """
+    Inversas de un reemplazo completo (como la limpieza) que conservó, en orden, las filas 'supervivientes'
+    de df_antes con las mismas columnas: las columnas que cambiaron se comparan y guardan de a una.
+    """
+    inversas = []
+    for columna in df_antes.columns:
+        anterior = df_antes[columna].take(supervivientes).reset_index(drop=True)
+        if not anterior.equals(df_despues[columna]):
+            inversas.append({'op': 'restaurar_columna', 'columna': columna, 'valores': anterior,
+                             'posicion': df_antes.columns.get_loc(columna)})
+    eliminadas = np.setdiff1d(np.arange(len(df_antes)), supervivientes)
+    if len(eliminadas):
+        inversas.append({'op': 'insertar_filas', 'posiciones': eliminadas.tolist(),
+                         'registros': df_antes.iloc[eliminadas].reset_index(drop=True)})
+    return inversas
+
+def _valor_json(valor):
+    """Convierte valores de numpy/pandas a tipos serializables en JSON"""
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        return valor.isoformat()
+    return str(valor)
+
+def _ruta_journal(nombre_tabla):
+    """Ruta del journal de operaciones de una tabla"""
+    return os.path.join(DIR_JOURNAL, f"{nombre_tabla}.jsonl")
+
+def _firma_base(nombre_tabla):
+    """Firma (tamaño y mtime) del CSV base sobre el que se acumula el journal"""
+    ruta = os.path.join(BASE_AUXILIAR, f"{nombre_tabla}.csv")
+    if not os.path.exists(ruta):
+        return None
+    estado = os.stat(ruta)
+    return {'tamano': estado.st_size, 'mtime_ns': estado.st_mtime_ns}
+
+def leer_journal(nombre_tabla):
+    """Lee las operaciones pendientes del journal; las ignora si el CSV base cambió por fuera"""
+    ruta = _ruta_journal(nombre_tabla)
+    if not os.path.exists(ruta):
+        return []
+    
+    with open(ruta, encoding='utf-8') as f:
+        registros = [json.loads(linea) for linea in f if linea.strip()]
+    if not registros:
+        return []
+    
+    cabecera, operaciones = registros[0], registros[1:]
+    base = _firma_base(nombre_tabla)
+    if cabecera.get('op') != 'base' or base is None or cabecera['tamano'] != base['tamano'] or cabecera['mtime_ns'] != base['mtime_ns']:
+        apartado = f"{ruta}.{datetime.now().strftime('%Y%m%d_%H%M%S')}.descartado"
+        os.replace(ruta, apartado)
+        print(f"⚠️  El CSV de {nombre_tabla} cambió fuera del programa: journal apartado en {apartado}")
+        return []
+    return operaciones
+
+def reproducir_journal(df, nombre_tabla):
+    """Aplica sobre la tabla base las operaciones pendientes de su journal"""
+    for op in leer_journal(nombre_tabla):
+        df = aplicar_operacion(df, op)
+    return df
+
+def _ajuste_filas_journal(nombre_tabla):
+    """Diferencia de filas que aporta el journal (para contar registros sin cargar la tabla)"""
+    ajuste = 0
+    for op in leer_journal(nombre_tabla):
+        if op['op'] == 'insertar':
+            ajuste += len(op['registros'])
+        elif op['op'] == 'eliminar_filas':
+            ajuste -= len(op['posiciones'])
+    return ajuste
+
+def guardar_en_journal(df, nombre_tabla, operaciones):
+    """Agrega las operaciones al journal de la tabla con un único fsync; compacta si el journal creció demasiado"""
+    try:
+        os.makedirs(DIR_JOURNAL, exist_ok=True)
+        ruta = _ruta_journal(nombre_tabla)
+        
+        # Sin CSV base todavía no hay sobre qué acumular: se guarda completo
+        base = _firma_base(nombre_tabla)
+        if base is None:
+            guardar_tabla_individual(df, nombre_tabla)
+            return
+        
+        lineas = []
+        if not os.path.exists(ruta):
+            lineas.append(json.dumps({'op': 'base', **base}))
+        lineas.extend(json.dumps(op, ensure_ascii=False, default=_valor_json) for op in operaciones)
+        
+        with open(ruta, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lineas) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        
+        pendientes = _operaciones_journal.get(nombre_tabla)
+        if pendientes is None:
+            pendientes = len(leer_journal(nombre_tabla))
+        else:
+            pendientes += len(operaciones)
+        _operaciones_journal[nombre_tabla] = pendientes
+        print(f"📝 Journal: {nombre_tabla} (+{len(operaciones)} operaciones, {pendientes} pendientes de compactar)")
+        
+        if pendientes >= JOURNAL_MAX_OPERACIONES:
+            compactar_tabla(df, nombre_tabla)
+    except Exception as e:
+        print(f"❌ Error escribiendo el journal de {nombre_tabla}: {e}")
+
+def descartar_journal(nombre_tabla):
+    """Borra el journal de una tabla (su contenido ya está en el CSV base)"""
+    _operaciones_journal.pop(nombre_tabla, None)
+    ruta = _ruta_journal(nombre_tabla)
+    if os.path.exists(ruta):
+        os.remove(ruta)
+
+def tiene_journal(nombre_tabla):
+    """Indica si la tabla tiene operaciones pendientes de compactar"""
+    return os.path.exists(_ruta_journal(nombre_tabla))
+
+def compactar_tabla(df, nombre_tabla):
+    """Incorpora el journal al CSV base reescribiéndolo una sola vez"""
+    print(f"🗜️  Compactando journal de {nombre_tabla}...")
+    guardar_tabla_individual(df, nombre_tabla)
+
+def compactar_journals(nombres):
+    """Compacta los journals pendientes de las tablas indicadas a partir de lo guardado en disco"""
+    vaciar_persistencia()
+    compactadas = 0
+    for nombre_tabla in list(nombres):
+        if tiene_journal(nombre_tabla):
+            # Se parte del disco (base + journal), no de la memoria, que puede tener ediciones descartadas
+            compactar_tabla(cargar_tabla(os.path.join(BASE_AUXILIAR, f"{nombre_tabla}.csv")), nombre_tabla)
+            compactadas += 1
+    return compactadas
+
 # =============================================================================
 # FUNCIONES PARA DETECCIÓN Y GESTIÓN DE IDs AUTOINCREMENTABLES
 # =============================================================================
@@ -209,8 +989,195 @@ def obtener_vista_usuario(df):
     columnas_visibles = obtener_columnas_visibles(df)
     return df[columnas_visibles] if columnas_visibles else df
 
-def limpiar_y_convertir_ids(df):
-    """Limpia y convierte las columnas ID a numéricas, eliminando duplicados - SOLO CUANDO SE SOLICITA"""
+# =============================================================================
+# DEDUPLICACIÓN DIFUSA (BLOQUES POR EMAIL, TELÉFONO Y SOUNDEX DEL NOMBRE)
+# =============================================================================
+
+_CODIGOS_SOUNDEX = {letra: digito for digito, letras in
+                    {'1': 'bfpv', '2': 'cgjkqsxz', '3': 'dt', '4': 'l', '5': 'mn', '6': 'r'}.items()
+                    for letra in letras}
+
+def _normalizar_texto(texto):
+    """Minúsculas, sin acentos y con espacios simples"""
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(texto.lower().split())
+
+def _soundex(palabra):
+    """Código soundex de una palabra (letra inicial + 3 dígitos)"""
+    palabra = ''.join(c for c in palabra if c.isalpha())
+    if not palabra:
+        return ''
+    codigo, anterior = palabra[0].upper(), _CODIGOS_SOUNDEX.get(palabra[0], '')
+    for letra in palabra[1:]:
+        digito = _CODIGOS_SOUNDEX.get(letra, '')
+        if digito and digito != anterior:
+            codigo += digito
+        if letra not in 'hw':
+            anterior = digito
+    return (codigo + '000')[:4]
+
+def _columnas_con(df, fragmentos):
+    """Columnas cuyo nombre contiene alguno de los fragmentos"""
+    return [col for col in df.columns if any(f in str(col).lower() for f in fragmentos)]
+
+def _claves_bloqueo(df):
+    """Claves normalizadas por fila: email, dígitos del teléfono, nombre completo y su soundex"""
+    vacio = pd.Series('', index=df.index, dtype=object)
+    
+    def texto(columnas):
+        if not columnas:
+            return vacio
+        partes = [df[col].astype(str).where(df[col].notna(), '') for col in columnas]
+        return partes[0].str.cat(partes[1:], sep=' ') if len(partes) > 1 else partes[0]
+    
+    # Email sin mayúsculas ni etiqueta '+...' en la parte local
+    email = texto(_columnas_con(df, ('email', 'mail', 'correo'))[:1]).str.strip().str.lower()
+    email = email.str.replace(r'\+[^@]*@', '@', regex=True).where(email.str.contains('@'), '')
+    # Teléfono: últimos 10 dígitos (ignora prefijos de país y separadores)
+    telefono = texto(_columnas_con(df, ('telefono', 'celular', 'phone'))[:1]).str.replace(r'\D', '', regex=True).str[-10:]
+    telefono = telefono.where(telefono.str.len() >= 6, '')
+    # Nombre completo normalizado; el soundex se calcula una vez por nombre distinto
+    columnas_nombre = _columnas_con(df, ('nombre', 'apellido', 'razon_social'))
+    nombre = texto(columnas_nombre)
+    codigos, distintos = pd.factorize(nombre)
+    normalizados = [_normalizar_texto(n) for n in distintos]
+    sonidos = np.array([' '.join(sorted(_soundex(t) for t in n.split())) for n in normalizados] + [''], dtype=object)
+    normalizados = np.array(normalizados + [''], dtype=object)
+    
+    return {
+        'email': email.to_numpy(dtype=object),
+        'telefono': telefono.to_numpy(dtype=object),
+        'nombre': normalizados[codigos],
+        'soundex': sonidos[codigos],
+        'hay_nombre': bool(columnas_nombre),
+    }
+
+def _pares_por_bloque(claves, ventana, secundaria):
+    """Pares candidatos: filas con la misma clave a distancia <= ventana en el orden (clave, secundaria)"""
+    # Se ordenan códigos enteros en lugar de textos
+    codigos = pd.factorize(claves)[0]
+    validas = np.flatnonzero(claves != '')
+    if len(validas) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    orden = validas[np.lexsort((secundaria[validas], codigos[validas]))]
+    ordenadas = codigos[orden]
+    pares = []
+    for distancia in range(1, min(ventana, len(orden) - 1) + 1):
+        mismo = ordenadas[:-distancia] == ordenadas[distancia:]
+        pares.append(np.column_stack([orden[:-distancia][mismo], orden[distancia:][mismo]]))
+    return np.concatenate(pares)
+
+def _parecidos(a, b, umbral):
+    """Indica si dos textos superan el umbral de similitud (usa primero las cotas rápidas de difflib)"""
+    if not a or not b:
+        return False
+    comparador = SequenceMatcher(None, a, b)
+    return (comparador.real_quick_ratio() >= umbral and comparador.quick_ratio() >= umbral
+            and comparador.ratio() >= umbral)
+
+def _prefiltro_parecidos(textos, a, b):
+    """Filtro vectorizado antes de difflib: largo parecido y mismo comienzo o mismo final"""
+    serie = pd.Series(textos, dtype=object)
+    largo, inicio, final = serie.str.len().to_numpy(), serie.str[:2].to_numpy(), serie.str[-2:].to_numpy()
+    return (np.abs(largo[a] - largo[b]) <= 2) & ((inicio[a] == inicio[b]) | (final[a] == final[b]))
+
+def _digitos_diferentes(telefonos, i, j):
+    """Cantidad de dígitos distintos entre pares de teléfonos (vectorizado; -1 si falta alguno)"""
+    matriz = np.frombuffer(''.join(t.rjust(10, '_') for t in telefonos).encode('ascii'), dtype=np.uint8)
+    matriz = matriz.reshape(len(telefonos), 10)
+    diferencias = (matriz[i] != matriz[j]).sum(axis=1)
+    return np.where((telefonos[i] == '') | (telefonos[j] == ''), -1, diferencias)
+
+def _componentes(cantidad, pares):
+    """Componentes conexas de los pares por propagación de la etiqueta mínima (cada fila -> menor posición del grupo)"""
+    etiquetas = np.arange(cantidad)
+    if len(pares) == 0:
+        return etiquetas
+    while True:
+        nuevas = etiquetas.copy()
+        np.minimum.at(nuevas, pares[:, 0], etiquetas[pares[:, 1]])
+        np.minimum.at(nuevas, pares[:, 1], etiquetas[pares[:, 0]])
+        # Salto de punteros: cada fila apunta directamente a la raíz de su etiqueta
+        while True:
+            saltadas = nuevas[nuevas]
+            if np.array_equal(saltadas, nuevas):
+                break
+            nuevas = saltadas
+        if np.array_equal(nuevas, etiquetas):
+            return etiquetas
+        etiquetas = nuevas
+
+def detectar_duplicados(df, ventana=None, umbral=None):
+    """
+    Agrupa registros que son la misma entidad con otro ID. Solo compara dentro de bloques
+    (email normalizado, dígitos del teléfono, soundex del nombre), así el costo es casi lineal.
+    Retorna: etiqueta por fila (posición del primer registro de su grupo)
+    """
+    ventana = ventana or DEDUP_VENTANA
+    umbral = umbral or DEDUP_UMBRAL
+    claves = _claves_bloqueo(df)
+    email, telefono, nombre, sonido = claves['email'], claves['telefono'], claves['nombre'], claves['soundex']
+    local, _, dominio = (pd.Series(email, dtype=object).str.partition('@')[c].to_numpy(dtype=object) for c in range(3))
+    
+    orden_nombre = pd.factorize(nombre, sort=True)[0]
+    pares = np.concatenate([_pares_por_bloque(bloque, ventana, orden_nombre) for bloque in (email, telefono, sonido)])
+    if len(pares) == 0:
+        return np.arange(len(df))
+    # Pares sin repetir (el mismo par puede salir de varios bloques)
+    codigos_pares = np.unique(pares.min(axis=1) * len(df) + pares.max(axis=1))
+    i, j = codigos_pares // len(df), codigos_pares % len(df)
+    pares = np.column_stack([i, j])
+    
+    mismo_email = (email[i] != '') & (email[i] == email[j])
+    mismo_telefono = (telefono[i] != '') & (telefono[i] == telefono[j])
+    fuerte = mismo_email | mismo_telefono
+    
+    if not claves['hay_nombre']:
+        coinciden = fuerte
+    else:
+        mismo_sonido = (sonido[i] != '') & (sonido[i] == sonido[j])
+        sin_nombre = (nombre[i] == '') | (nombre[j] == '')
+        coinciden = fuerte & (mismo_sonido | sin_nombre)
+        # Clave fuerte con nombres que suenan distinto: se acepta si el nombre es casi igual (errores de tipeo)
+        revisar = np.flatnonzero(fuerte & ~coinciden)
+        revisar = revisar[_prefiltro_parecidos(nombre, i[revisar], j[revisar])]
+        for k in revisar:
+            coinciden[k] = _parecidos(nombre[i[k]], nombre[j[k]], umbral)
+        # Mismo nombre fonético sin clave fuerte: hace falta un teléfono con un solo dígito distinto
+        # o un email del mismo dominio con la parte local casi igual
+        difusos = np.flatnonzero(mismo_sonido & ~fuerte)
+        coinciden[difusos] = _digitos_diferentes(telefono, i[difusos], j[difusos]) == 1
+        mismo_dominio = (dominio[i[difusos]] != '') & (dominio[i[difusos]] == dominio[j[difusos]])
+        mismo_dominio &= _prefiltro_parecidos(local, i[difusos], j[difusos])
+        for k in difusos[mismo_dominio & ~coinciden[difusos]]:
+            coinciden[k] = _parecidos(local[i[k]], local[j[k]], umbral)
+    
+    return _componentes(len(df), pares[coinciden])
+
+def grupos_duplicados(etiquetas):
+    """Grupos de posiciones (de 2 o más filas) a partir de las etiquetas de detectar_duplicados"""
+    orden = np.argsort(etiquetas, kind='stable')
+    cortes = np.flatnonzero(np.diff(etiquetas[orden])) + 1
+    return [grupo for grupo in np.split(orden, cortes) if len(grupo) > 1]
+
+def fusionar_duplicados(df, etiquetas):
+    """Deja un registro por grupo (el primero) completando sus nulos con los de los duplicados"""
+    if np.array_equal(etiquetas, np.arange(len(df))):
+        return df
+    fusionado = df.groupby(etiquetas, sort=True).first()
+    fusionado = fusionado.reindex(columns=df.columns)
+    for columna in df.columns:
+        if fusionado[columna].dtype != df[columna].dtype and not fusionado[columna].isna().any():
+            fusionado[columna] = fusionado[columna].astype(df[columna].dtype)
+    return fusionado.reset_index(drop=True)
+
+def limpiar_y_convertir_ids(df, devolver_grupos=False):
+    """
+    Limpia y convierte las columnas ID a numéricas, eliminando duplicados - SOLO CUANDO SE SOLICITA.
+    Con devolver_grupos=True retorna (df_limpio, grupos, mapeo, supervivientes): cada grupo son los IDs
+    originales fusionados, el mapeo (MapeoIds, o None sin columna ID) lleva cada ID original a su ID nuevo
+    y supervivientes son las posiciones de df que quedaron, en orden.
+    """
     df_limpio = df.copy()
     columna_id_principal = detectar_columna_id(df_limpio)
     columnas_ocultas = obtener_columnas_ocultas(df_limpio)
@@ -221,86 +1188,1747 @@ def limpiar_y_convertir_ids(df):
             df_limpio[columna] = pd.to_numeric(df_limpio[columna], errors='coerce')
     
     # Eliminar filas con IDs duplicados, manteniendo la primera ocurrencia
+    supervivientes = np.arange(len(df_limpio))
     if columna_id_principal and columna_id_principal in df_limpio.columns:
-        df_limpio = df_limpio.drop_duplicates(subset=[columna_id_principal], keep='first')
+        supervivientes = np.flatnonzero(~df_limpio[columna_id_principal].duplicated(keep='first').to_numpy())
+        df_limpio = df_limpio.iloc[supervivientes].reset_index(drop=True)
+    
+    tiene_id = columna_id_principal is not None and columna_id_principal in df_limpio.columns
+    ids_originales = df_limpio[columna_id_principal].to_numpy() if tiene_id else None
+    # Fila (ya sin duplicados exactos) -> posición final; cambia solo si se fusionan registros
+    destino = np.arange(len(df_limpio))
+    
+    # Fusionar la misma entidad cargada con distintos IDs (email, teléfono o nombre parecidos)
+    grupos = []
+    if DEDUP_DIFUSO and len(df_limpio) > 1:
+        # Se compara sobre el texto original: la conversión de arriba deja en NaN columnas como "apellido"
+        etiquetas = detectar_duplicados(df.iloc[supervivientes].reset_index(drop=True))
+        destino = np.searchsorted(np.unique(etiquetas), etiquetas)
+        supervivientes = supervivientes[np.unique(etiquetas)]
+        for grupo in grupos_duplicados(etiquetas):
+            if columna_id_principal and columna_id_principal in df_limpio.columns:
+                grupos.append(df_limpio[columna_id_principal].iloc[grupo].tolist())
+            else:
+                grupos.append(grupo.tolist())
+        df_limpio = fusionar_duplicados(df_limpio, etiquetas)
     
     # Reindexar IDs después de limpiar duplicados
     if columna_id_principal and columna_id_principal in df_limpio.columns:
         df_limpio = reindexar_ids(df_limpio, columna_id_principal)
     
-    return df_limpio
+    if not devolver_grupos:
+        return df_limpio
+    # Los IDs descartados por repetidos apuntan al mismo valor que el conservado, así que quedan cubiertos
+    mapeo = MapeoIds(ids_originales, destino + 1) if tiene_id else None
+    return df_limpio, grupos, mapeo, supervivientes
 
 def limpiar_tabla_manual(df, nombre_tabla):
-    """Función para limpiar manualmente una tabla (opción del menú)"""
+    """Función para limpiar manualmente una tabla (opción del menú); retorna (df_limpio, mapeo de IDs, supervivientes)"""
     print(f"🧹 Limpiando tabla {nombre_tabla}...")
-    df_limpio = limpiar_y_convertir_ids(df)
+    df_limpio, grupos, mapeo, supervivientes = limpiar_y_convertir_ids(df, devolver_grupos=True)
     cambios = len(df) - len(df_limpio)
     if cambios > 0:
         print(f"✅ Se limpiaron {cambios} registros duplicados/erróneos")
     else:
         print("✅ No se encontraron registros duplicados/erróneos")
-    return df_limpio
+    if grupos:
+        print(f"🔗 Registros fusionados por parecido ({len(grupos)} grupos):")
+        for grupo in grupos[:10]:
+            print(f"  - IDs {grupo}")
+    return df_limpio, mapeo, supervivientes
+
+# =============================================================================
+# SECUENCIAS DE IDs
+# =============================================================================
+
+def _ruta_secuencias(nombre_tabla):
+    """Ruta del archivo con las secuencias de IDs de una tabla"""
+    return os.path.join(DIR_SECUENCIAS, f"{nombre_tabla}.json")
+
+def _siguiente_en_postgres(nombre_tabla, columna):
+    """Siguiente valor de la secuencia de PostgreSQL asociada a la columna (None si no hay)"""
+    if not SECUENCIAS_POSTGRES:
+        return None
+    try:
+        with sesion_postgres() as conn:
+            if conn is None:
+                return None
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", (nombre_tabla, columna))
+            secuencia = cursor.fetchone()[0]
+            if secuencia is None:
+                conn.rollback()
+                return None
+            # Se lee la secuencia sin consumir valores (nextval la avanzaría)
+            cursor.execute(sql.SQL("SELECT last_value, is_called FROM {}").format(
+                sql.SQL('.').join(sql.Identifier(parte.strip('"')) for parte in secuencia.split('.'))
+            ))
+            ultimo, usado = cursor.fetchone()
+            conn.rollback()
+            return int(ultimo) + 1 if usado else int(ultimo)
+    except psycopg2.Error:
+        return None
+
+class AsignadorIds:
+    """Secuencias de IDs por tabla y columna: se inicializan una vez y luego entregan IDs en O(1)"""
+    
+    def __init__(self):
+        self._siguientes = {}
+        self._lock = threading.Lock()
+    
+    def _leer_archivo(self, nombre_tabla):
+        """Lee las secuencias guardadas de la tabla ({columna: siguiente})"""
+        try:
+            with open(_ruta_secuencias(nombre_tabla), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _guardar(self, nombre_tabla):
+        """Persiste las secuencias de la tabla junto a los CSV auxiliares"""
+        datos = self._leer_archivo(nombre_tabla)
+        datos.update({columna: valor for (tabla, columna), valor in self._siguientes.items() if tabla == nombre_tabla})
+        try:
+            os.makedirs(DIR_SECUENCIAS, exist_ok=True)
+            _escribir_json_atomico(_ruta_secuencias(nombre_tabla), datos)
+        except OSError as e:
+            print(f"⚠️  No se pudo guardar la secuencia de {nombre_tabla}: {e}")
+    
+    def _inicializar(self, nombre_tabla, columna, df, en_postgres=None):
+        """Siguiente ID inicial: el mayor entre el máximo de la columna, lo guardado y la secuencia de PostgreSQL"""
+        candidatos = [obtener_siguiente_id(df, columna) if df is not None else 1]
+        guardado = self._leer_archivo(nombre_tabla).get(columna)
+        if guardado is not None:
+            candidatos.append(int(guardado))
+        if en_postgres is not None:
+            candidatos.append(en_postgres)
+        return max(candidatos)
+    
+    def _consultar_postgres(self, clave):
+        """Secuencia de PostgreSQL si la local aún no se inicializó; se llama sin el lock (usa el pool y la red)"""
+        with self._lock:
+            if clave in self._siguientes:
+                return None
+        return _siguiente_en_postgres(*clave)
+    
+    def _actual(self, clave, df, en_postgres):
+        """Próximo ID de la secuencia, inicializándola si hace falta (con el lock ya tomado)"""
+        if clave not in self._siguientes:
+            self._siguientes[clave] = self._inicializar(clave[0], clave[1], df, en_postgres)
+        return self._siguientes[clave]
+    
+    def consultar(self, nombre_tabla, columna, df=None):
+        """Devuelve el próximo ID sin consumirlo"""
+        clave = (nombre_tabla, columna)
+        en_postgres = self._consultar_postgres(clave)
+        with self._lock:
+            return self._actual(clave, df, en_postgres)
+    
+    def reservar(self, nombre_tabla, columna, cantidad=1, df=None):
+        """Reserva un bloque contiguo de IDs y devuelve el primero (el bloque es primero..primero+cantidad-1)"""
+        clave = (nombre_tabla, columna)
+        en_postgres = self._consultar_postgres(clave)
+        with self._lock:
+            primero = self._actual(clave, df, en_postgres)
+            self._siguientes[clave] = primero + cantidad
+            self._guardar(nombre_tabla)
+        return primero
+    
+    def avanzar(self, nombre_tabla, columna, siguiente, df=None):
+        """Reserva todos los IDs menores a siguiente (la secuencia nunca retrocede)"""
+        clave = (nombre_tabla, columna)
+        en_postgres = self._consultar_postgres(clave)
+        with self._lock:
+            if siguiente > self._actual(clave, df, en_postgres):
+                self._siguientes[clave] = int(siguiente)
+                self._guardar(nombre_tabla)
+    
+    def siguiente(self, nombre_tabla, columna, df=None):
+        """Entrega un ID nuevo"""
+        return self.reservar(nombre_tabla, columna, 1, df)
+    
+    def olvidar(self, nombre_tabla):
+        """Descarta las secuencias en memoria de la tabla: se vuelven a inicializar en el próximo uso"""
+        with self._lock:
+            for clave in [clave for clave in self._siguientes if clave[0] == nombre_tabla]:
+                del self._siguientes[clave]
+
+# Asignador compartido por el menú y las importaciones
+secuencias_ids = AsignadorIds()
+
+# =============================================================================
+# ÍNDICES DE CLAVES PARA CLAVES FORÁNEAS
+# =============================================================================
 
-def generar_ids_automaticos(df_original, nuevo_registro):
-    """Genera IDs automáticos para las columnas ocultas de forma ordenada"""
+def _claves_enteras(valores):
+    """Convierte una columna de IDs a enteros descartando vacíos y valores no numéricos"""
+    numericos = pd.to_numeric(pd.Series(valores), errors='coerce').dropna()
+    numericos = numericos[numericos == np.floor(numericos)]
+    return numericos.astype(np.int64).to_numpy()
+
+def _clave_entera(valor):
+    """Convierte un valor suelto a clave entera, o None si no es un ID válido"""
+    try:
+        if valor is None or pd.isna(valor) or str(valor).strip() == '':
+            return None
+        numero = float(valor)
+    except (ValueError, TypeError):
+        return None
+    return int(numero) if numero == int(numero) else None
+
+class IndiceClaves:
+    """Índice de las claves de una tabla: rango contiguo, o conjunto hash + arreglo ordenado"""
+    
+    def __init__(self, valores=()):
+        self.reconstruir(valores)
+    
+    def reconstruir(self, valores):
+        """Construye el índice desde una columna de IDs (una sola pasada vectorizada)"""
+        ordenadas = np.unique(_claves_enteras(valores))
+        if len(ordenadas) and ordenadas[-1] - ordenadas[0] + 1 == len(ordenadas):
+            # Caso habitual (IDs 1..n reindexados): alcanza con los extremos
+            self.reiniciar_rango(int(ordenadas[0]), int(ordenadas[-1]))
+        else:
+            self._rango = None
+            self._conjunto = set(ordenadas.tolist())
+            self._ordenadas = ordenadas
+    
+    def reiniciar_rango(self, inicio, fin):
+        """Deja el índice como el rango contiguo inicio..fin (vacío si fin < inicio)"""
+        self._rango = (inicio, fin) if fin >= inicio else None
+        self._conjunto = None if fin >= inicio else set()
+        self._ordenadas = None if fin >= inicio else np.array([], dtype=np.int64)
+    
+    def _materializar(self):
+        """Pasa de la representación por rango al conjunto explícito"""
+        if self._rango is not None:
+            inicio, fin = self._rango
+            self._ordenadas = np.arange(inicio, fin + 1, dtype=np.int64)
+            self._conjunto = set(range(inicio, fin + 1))
+            self._rango = None
+    
+    def __len__(self):
+        if self._rango is not None:
+            return self._rango[1] - self._rango[0] + 1
+        return len(self._conjunto)
+    
+    def __contains__(self, valor):
+        clave = _clave_entera(valor)
+        if clave is None:
+            return False
+        if self._rango is not None:
+            return self._rango[0] <= clave <= self._rango[1]
+        return clave in self._conjunto
+    
+    def contiene_varios(self, valores):
+        """Máscara booleana de existencia para muchas claves a la vez (búsqueda binaria vectorizada)"""
+        numericos = pd.to_numeric(pd.Series(valores), errors='coerce').to_numpy(dtype=float)
+        validos = ~np.isnan(numericos) & (numericos == np.floor(numericos))
+        claves = np.where(validos, numericos, 0).astype(np.int64)
+        if self._rango is not None:
+            return validos & (claves >= self._rango[0]) & (claves <= self._rango[1])
+        ordenadas = self._arreglo_ordenado()
+        if len(ordenadas) == 0:
+            return np.zeros(len(claves), dtype=bool)
+        posiciones = np.minimum(np.searchsorted(ordenadas, claves), len(ordenadas) - 1)
+        return validos & (ordenadas[posiciones] == claves)
+    
+    def _arreglo_ordenado(self):
+        """Arreglo ordenado de claves (se regenera desde el conjunto solo si cambió)"""
+        if self._ordenadas is None:
+            self._ordenadas = np.array(sorted(self._conjunto), dtype=np.int64)
+        return self._ordenadas
+    
+    def primera(self):
+        """Menor clave existente (FK por defecto), o None si la tabla está vacía"""
+        if self._rango is not None:
+            return self._rango[0]
+        ordenadas = self._arreglo_ordenado()
+        return int(ordenadas[0]) if len(ordenadas) else None
+    
+    def agregar_varios(self, valores):
+        """Registra muchas claves nuevas de una vez (un bloque contiguo extiende el rango)"""
+        nuevas = np.unique(_claves_enteras(valores))
+        if len(nuevas) == 0:
+            return
+        if self._rango is not None:
+            inicio, fin = self._rango
+            if inicio <= nuevas[0] and nuevas[-1] <= fin:
+                return
+            if (nuevas[0] == fin + 1 and nuevas[-1] - nuevas[0] + 1 == len(nuevas)):
+                self._rango = (inicio, int(nuevas[-1]))
+                return
+            self._materializar()
+        self._conjunto.update(nuevas.tolist())
+        self._ordenadas = None
+    
+    def eliminar_varios(self, valores):
+        """Quita muchas claves de una vez (borrar el final del rango lo acorta sin materializarlo)"""
+        quitadas = np.unique(_claves_enteras(valores))
+        if len(quitadas) == 0:
+            return
+        if self._rango is not None:
+            inicio, fin = self._rango
+            quitadas = quitadas[(quitadas >= inicio) & (quitadas <= fin)]
+            if len(quitadas) == 0:
+                return
+            if quitadas[-1] == fin and quitadas[-1] - quitadas[0] + 1 == len(quitadas):
+                self.reiniciar_rango(inicio, int(quitadas[0]) - 1)
+                return
+            self._materializar()
+        self._conjunto.difference_update(quitadas.tolist())
+        self._ordenadas = None
+
+# Altas y bajas: el índice de claves se actualiza con sus claves
+_OPERACIONES_DE_FILAS = ('insertar', 'insertar_filas', 'eliminar_filas')
+# Operaciones que no tocan la columna ID ni cambian qué filas hay: el índice de claves sigue valiendo
+_OPERACIONES_POR_COLUMNA = ('agregar_columna', 'remapear_columna', 'restaurar_columna', 'eliminar_columna', 'cambiar_tipo')
+
+def _conserva_claves(op, columna_id):
+    """True si la operación deja intactas las filas y la columna ID"""
+    if op['op'] in _OPERACIONES_POR_COLUMNA:
+        return op['columna'] != columna_id
+    if op['op'] == 'renombrar_columna':
+        return columna_id not in (op['de'], op['a'])
+    return op['op'] == 'restaurar_tipos'
+
+def mantener_indice_claves(nombre_tabla, df_antes, df_despues, operaciones):
+    """
+    Actualiza en el lugar el índice de claves de la tabla según las operaciones aplicadas
+    (altas y bajas agregan o quitan sus claves). Retorna False si hay que reconstruirlo.
+    """
+    with _indices_lock:
+        indice = indices_claves.get(nombre_tabla)
+    if indice is None:
+        return True
+    columna_id = detectar_columna_id(df_antes)
+    if columna_id is None or columna_id not in df_despues.columns:
+        return False
+    de_filas = [op for op in operaciones if op['op'] in _OPERACIONES_DE_FILAS]
+    # Con más de un alta o baja las posiciones de las siguientes dependen de estados intermedios
+    if len(de_filas) > 1 or not all(_conserva_claves(op, columna_id)
+                                    for op in operaciones if op['op'] not in _OPERACIONES_DE_FILAS):
+        return False
+    for op in de_filas:
+        if op['op'] == 'eliminar_filas':
+            quitadas = df_antes[columna_id].iloc[list(op['posiciones'])]
+            # Una clave repetida que sigue en otra fila no se quita del índice
+            indice.eliminar_varios(quitadas[~quitadas.isin(df_despues[columna_id])])
+        else:
+            registros = pd.DataFrame(op['registros'])
+            if columna_id in registros.columns:
+                indice.agregar_varios(registros[columna_id])
+    return True
+
+def fijar_tabla(tablas, nombre_tabla, df, df_antes=None, operaciones=None):
+    """Guarda df en el registro de tablas, manteniendo el índice de claves si se conocen las operaciones"""
+    vigente = df_antes is not None and mantener_indice_claves(nombre_tabla, df_antes, df, operaciones)
+    if hasattr(tablas, 'reemplazar'):
+        tablas.reemplazar(nombre_tabla, df, indice_vigente=vigente)
+    else:
+        tablas[nombre_tabla] = df
+        if not vigente:
+            invalidar_indice_claves(nombre_tabla)
+
+def invalidar_indice_claves(nombre_tabla=None):
+    """Descarta el índice de claves de una tabla (o todos) para que se reconstruya al usarlo"""
+    with _indices_lock:
+        if nombre_tabla is None:
+            indices_claves.clear()
+        else:
+            indices_claves.pop(nombre_tabla, None)
+
+def obtener_indice_claves(nombre_tabla, tablas=None, columna=None):
+    """Índice de claves de la tabla, construido una vez desde su columna ID y reutilizado luego"""
+    tablas = tablas if tablas is not None else tablas_referencia
+    with _indices_lock:
+        if nombre_tabla in indices_claves:
+            return indices_claves[nombre_tabla]
+    if not tablas or nombre_tabla not in tablas:
+        return None
+    df = tablas[nombre_tabla]
+    if columna is None or columna not in df.columns:
+        columna = detectar_columna_id(df)
+    if columna is None:
+        return None
+    indice = IndiceClaves(df[columna])
+    with _indices_lock:
+        return indices_claves.setdefault(nombre_tabla, indice)
+
+def buscar_tabla_referenciada(columna, tablas):
+    """Tabla a la que apunta una FK 'id_xxx': por nombre (xxx, xxxs, xxxes) o por su columna ID principal"""
+    if not tablas:
+        return None
+    base = columna[3:]
+    for candidata in (base, f"{base}s", f"{base}es"):
+        if candidata in tablas:
+            return candidata
+    for nombre in tablas:
+        columnas = tablas.columnas(nombre) if hasattr(tablas, 'columnas') else list(tablas[nombre].columns)
+        if columnas and columnas[0] == columna:
+            return nombre
+    return None
+
+def actualizar_indice_tras_reindexar(nombre_tabla, columna_id, cantidad):
+    """Tras reindexar en la limpieza (IDs 1..n) deja al día el índice de claves; la secuencia no retrocede"""
+    secuencias_ids.avanzar(nombre_tabla, columna_id, cantidad + 1)
+    with _indices_lock:
+        indice = indices_claves.get(nombre_tabla)
+    if indice is not None:
+        indice.reiniciar_rango(1, cantidad)
+
+def _id_diferido(nombre_tabla, columna, df, reservas):
+    """Próximo ID sin consumir la secuencia: queda anotado en reservas y se reserva al guardar"""
+    clave = (nombre_tabla, columna)
+    siguiente = max(secuencias_ids.consultar(nombre_tabla, columna, df), reservas.get(clave, 0))
+    reservas[clave] = siguiente + 1
+    return siguiente
+
+def generar_ids_automaticos(df_original, nuevo_registro, nombre_tabla=None, reservas=None):
+    """Genera IDs automáticos para las columnas ocultas de forma ordenada (con reservas, sin consumir la secuencia)"""
     global tablas_referencia
     
-    # Usar el DataFrame original sin limpiar automáticamente
-    df_trabajo = df_original.copy()
+    # Se lee el DataFrame sin copiarlo ni limpiarlo
+    df_trabajo = df_original
     columnas_ocultas = obtener_columnas_ocultas(df_trabajo)
+    # Detectar una sola vez la columna ID principal
+    columna_id_principal = detectar_columna_id(df_trabajo)
     
     for columna in columnas_ocultas:
         # Si la columna no está en el nuevo registro o está vacía
         if columna not in nuevo_registro or nuevo_registro[columna] is None or nuevo_registro[columna] == '':
             
-            # Detectar si es la columna ID principal
-            columna_id_principal = detectar_columna_id(df_trabajo)
-            
             if columna == columna_id_principal:
-                # Para la columna ID principal, usar el siguiente ID disponible
-                siguiente_id = obtener_siguiente_id(df_trabajo, columna)
+                # Para la columna ID principal, usar el siguiente ID de la secuencia de la tabla
+                if nombre_tabla and reservas is not None:
+                    siguiente_id = _id_diferido(nombre_tabla, columna, df_trabajo, reservas)
+                elif nombre_tabla:
+                    siguiente_id = secuencias_ids.siguiente(nombre_tabla, columna, df_trabajo)
+                else:
+                    siguiente_id = obtener_siguiente_id(df_trabajo, columna)
                 nuevo_registro[columna] = siguiente_id
             
-            # Para claves foráneas (id_otra_tabla)
+            # Para claves foráneas (id_otra_tabla): primera clave de la tabla referenciada, vía su índice
             elif columna.startswith('id_'):
-                tabla_referenciada = columna[3:]  # Remover 'id_' del inicio
-                
-                # Usar la referencia global a las tablas
-                if tablas_referencia and tabla_referenciada in tablas_referencia:
-                    df_referencia = tablas_referencia[tabla_referenciada]
-                    
-                    # Buscar la columna ID principal de la tabla referenciada
-                    columna_id_referencia = detectar_columna_id(df_referencia)
-                    
-                    if columna_id_referencia and len(df_referencia) > 0:
-                        # Tomar el primer ID disponible de la tabla referenciada
-                        try:
-                            # Buscar primer valor numérico válido
-                            primer_id = 1
-                            for val in df_referencia[columna_id_referencia]:
-                                try:
-                                    if pd.notna(val) and str(val).strip() != '':
-                                        primer_id = int(float(val))
-                                        break
-                                except (ValueError, TypeError):
-                                    continue
-                            
-                            nuevo_registro[columna] = primer_id
-                        except Exception as e:
-                            nuevo_registro[columna] = 1
-                    else:
-                        nuevo_registro[columna] = 1
-                else:
-                    nuevo_registro[columna] = 1
+                tabla_referenciada = buscar_tabla_referenciada(columna, tablas_referencia)
+                indice = obtener_indice_claves(tabla_referenciada, tablas_referencia, columna) if tabla_referenciada else None
+                primer_id = indice.primera() if indice is not None else None
+                nuevo_registro[columna] = primer_id if primer_id is not None else 1
             
             # Para otros tipos de IDs
             else:
-                # Para otras columnas ID, usar el siguiente ID disponible
-                siguiente_valor = obtener_siguiente_id(df_trabajo, columna)
+                # Para otras columnas ID, usar el siguiente valor de su propia secuencia
+                if nombre_tabla and reservas is not None:
+                    siguiente_valor = _id_diferido(nombre_tabla, columna, df_trabajo, reservas)
+                elif nombre_tabla:
+                    siguiente_valor = secuencias_ids.siguiente(nombre_tabla, columna, df_trabajo)
+                else:
+                    siguiente_valor = obtener_siguiente_id(df_trabajo, columna)
                 nuevo_registro[columna] = siguiente_valor
+        
+        # FK cargada por el usuario: verificar que exista en la tabla referenciada
+        elif columna.startswith('id_') and columna != columna_id_principal:
+            tabla_referenciada = buscar_tabla_referenciada(columna, tablas_referencia)
+            indice = obtener_indice_claves(tabla_referenciada, tablas_referencia, columna) if tabla_referenciada else None
+            if indice is not None and nuevo_registro[columna] not in indice:
+                print(f"⚠️  {columna}={nuevo_registro[columna]} no existe en '{tabla_referenciada}'")
     
     return nuevo_registro
 
+# =============================================================================
+# REINDEXACIÓN EN CASCADA (TABLAS QUE REFERENCIAN EL ID)
+# =============================================================================
+
+class MapeoIds:
+    """Mapeo de IDs viejos a nuevos: se construye una vez y se aplica en bloque a cualquier columna que los referencie"""
+
+    def __init__(self, viejos, nuevos):
+        viejos = pd.to_numeric(pd.Series(viejos), errors='coerce').to_numpy(dtype=float)
+        nuevos = np.asarray(nuevos, dtype=float)
+        validos = ~np.isnan(viejos)
+        viejos, nuevos = viejos[validos], nuevos[validos]
+        self.cambios = int(np.count_nonzero(viejos != nuevos))
+        self._denso = None
+        if len(viejos) and (viejos == np.floor(viejos)).all() and viejos.min() >= 0 \
+                and viejos.max() <= 4 * len(viejos) + 1024:
+            # IDs compactos: arreglo de búsqueda directa indexado por el ID viejo (-1 = no existe)
+            self._denso = np.full(int(viejos.max()) + 1, -1, dtype=np.int64)
+            self._denso[viejos.astype(np.int64)] = nuevos.astype(np.int64)
+        else:
+            orden = np.argsort(viejos, kind='stable')
+            self._viejos, self._nuevos = viejos[orden], nuevos[orden]
+
+    @classmethod
+    def por_posicion(cls, ids_viejos):
+        """Mapeo de una reindexación: el ID de la fila i pasa a ser i + 1"""
+        return cls(ids_viejos, np.arange(1, len(ids_viejos) + 1))
+
+    def traducir(self, valores):
+        """IDs nuevos de los valores dados; NaN si el valor es nulo o ya no existe"""
+        valores = pd.to_numeric(pd.Series(valores), errors='coerce').to_numpy(dtype=float)
+        resultado = np.full(len(valores), np.nan)
+        if self._denso is not None:
+            dentro = (valores >= 0) & (valores < len(self._denso)) & (valores == np.floor(valores))
+            encontrados = self._denso[valores[dentro].astype(np.int64)].astype(float)
+            encontrados[encontrados < 0] = np.nan
+            resultado[dentro] = encontrados
+        elif len(self._viejos):
+            posiciones = np.minimum(np.searchsorted(self._viejos, valores), len(self._viejos) - 1)
+            hallados = self._viejos[posiciones] == valores
+            resultado[hallados] = self._nuevos[posiciones[hallados]]
+        return resultado
+
+def remapear_valores(serie, de, a):
+    """Reemplaza en bloque cada valor de 'de' por el de 'a' en la misma posición (None deja la celda en nulo)"""
+    if not len(de):
+        return serie
+    valores = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float)
+    posiciones = pd.Index(np.asarray(de, dtype=float)).get_indexer(valores)
+    destino = np.array([np.nan if valor is None else valor for valor in a], dtype=float)
+    resultado = np.where(posiciones >= 0, destino[posiciones], valores)
+    if np.isnan(resultado).any():
+        return pd.Series(pd.array(resultado, dtype='Int64'), index=serie.index)
+    return pd.Series(resultado.astype(np.int64), index=serie.index)
+
+def tablas_que_referencian(tablas, nombre_tabla, columna_id):
+    """Tablas que tienen una FK con el nombre de la columna ID de la tabla indicada (solo lee cabeceras)"""
+    if not tablas or buscar_tabla_referenciada(columna_id, tablas) != nombre_tabla:
+        return []
+    hijas = []
+    for nombre in tablas:
+        columnas = tablas.columnas(nombre) if hasattr(tablas, 'columnas') else list(tablas[nombre].columns)
+        if nombre != nombre_tabla and columna_id in columnas:
+            hijas.append(nombre)
+    return hijas
+
+def preparar_cascada(tablas, nombre_tabla, columna_id, mapeo):
+    """
+    Calcula, sin modificar nada, la operación 'remapear_columna' de cada tabla que referencia la columna ID.
+    Retorna {tabla: ([operación], huérfanas)}: huérfanas son las filas que apuntan a IDs que ya no existen.
+    """
+    cascada = {}
+    if mapeo is None:
+        return cascada
+    for hija in tablas_que_referencian(tablas, nombre_tabla, columna_id):
+        serie = pd.to_numeric(tablas[hija][columna_id], errors='coerce')
+        # El mapeo se resuelve sobre los valores distintos; la tabla hija se recorre una sola vez al aplicarlo
+        unicos = pd.unique(serie.dropna().to_numpy(dtype=float))
+        traducidos = mapeo.traducir(unicos)
+        cambian = ~(traducidos == unicos)
+        if not cambian.any():
+            continue
+        perdidos = unicos[np.isnan(traducidos)]
+        huerfanas = int(serie.isin(perdidos).sum()) if len(perdidos) else 0
+        operacion = {
+            'op': 'remapear_columna',
+            'columna': columna_id,
+            'de': [int(v) if float(v).is_integer() else float(v) for v in unicos[cambian]],
+            'a': [None if np.isnan(v) else int(v) for v in traducidos[cambian]],
+        }
+        cascada[hija] = ([operacion], huerfanas)
+    return cascada
+
+def aplicar_con_cascada(df, nombre_tabla, operaciones, tablas, inversas=None):
+    """
+    Aplica las operaciones a la tabla y prepara la cascada de cada reindexación de su columna ID y de
+    cada eliminación de filas (las referencias a los IDs eliminados quedan huérfanas).
+    Si se pasa la lista inversas, se le agregan las inversas de cada operación (para deshacer).
+    """
+    cascada = {}
+    for op in operaciones:
+        if op['op'] == 'reindexar' and op['columna'] in df.columns:
+            mapeo = MapeoIds.por_posicion(df[op['columna']])
+            if mapeo.cambios:
+                cascada = combinar_cascadas(cascada, preparar_cascada(tablas, nombre_tabla, op['columna'], mapeo))
+        nuevo = aplicar_operacion(df, op)
+        columna_id = detectar_columna_id(df) if op['op'] == 'eliminar_filas' else None
+        if columna_id in df.columns and tablas_que_referencian(tablas, nombre_tabla, columna_id):
+            # Los IDs que siguen existiendo se traducen a sí mismos; los eliminados, a nulo
+            mapeo = MapeoIds(nuevo[columna_id], pd.to_numeric(nuevo[columna_id], errors='coerce'))
+            cascada = combinar_cascadas(cascada, preparar_cascada(tablas, nombre_tabla, columna_id, mapeo))
+        if inversas is not None:
+            inversas.append(inversas_de(df, nuevo, op))
+        df = nuevo
+    return df, cascada
+
+def combinar_cascadas(primera, segunda):
+    """Encadena dos cascadas: las operaciones de una misma tabla hija se aplican en orden"""
+    combinada = dict(primera)
+    for hija, (ops, huerfanas) in segunda.items():
+        previas, previas_huerfanas = combinada.get(hija, ([], 0))
+        combinada[hija] = (previas + ops, previas_huerfanas + huerfanas)
+    return combinada
+
+def huerfanas_cascada(cascada):
+    """Filas de cada tabla hija que quedarían apuntando a IDs inexistentes"""
+    return {hija: huerfanas for hija, (_, huerfanas) in cascada.items() if huerfanas}
+
+def confirmar_huerfanas(cascada):
+    """Informa las referencias a IDs que ya no existen y pide confirmación para dejarlas en nulo"""
+    huerfanas = huerfanas_cascada(cascada)
+    if not huerfanas:
+        return True
+    print("⚠️  Hay registros que apuntan a IDs que ya no existen:")
+    for hija, cantidad in huerfanas.items():
+        print(f"  - {hija}: {cantidad} registros")
+    return input("¿Dejar esas referencias en nulo y continuar? (s/n): ").strip().lower() == 's'
+
+def aplicar_cascada(tablas, cascada):
+    """Aplica las operaciones de la cascada a cada tabla hija; retorna {tabla: operaciones}"""
+    aplicadas = {}
+    for hija, (ops, _) in cascada.items():
+        df = tablas[hija]
+        for op in ops:
+            df = aplicar_operacion(df, op)
+        fijar_tabla(tablas, hija, df, tablas[hija], ops)
+        aplicadas[hija] = ops
+    return aplicadas
+
+def guardar_con_cascada(tablas, nombre_tabla, df, operaciones, aplicadas):
+    """Guarda la tabla y sus tablas hijas ya remapeadas, y las sincroniza juntas en una sola pasada"""
+    tablas[nombre_tabla] = df
+    hijas = {hija: (tablas[hija], ops) for hija, ops in aplicadas.items()}
+    for hija, ops in aplicadas.items():
+        registrar_cambio(hija, [f"{ops[0]['columna']} actualizado por cambios de IDs en '{nombre_tabla}'"])
+    print(f"🔗 Referencias actualizadas en: {', '.join(aplicadas)}")
+    if PERSISTENCIA_SEGUNDO_PLANO:
+        encolar_persistencia(df, nombre_tabla, operaciones, hijas=hijas, tablas=tablas)
+    else:
+        _guardar_cascada_ahora(df, nombre_tabla, operaciones, hijas, tablas)
+
+def _guardar_cascada_ahora(df, nombre_tabla, operaciones, hijas, tablas):
+    """Persiste la tabla y sus hijas ({tabla: (df, operaciones)}) y las sincroniza en orden de dependencias"""
+    persistir_tabla(df, nombre_tabla, operaciones)
+    for hija, (df_hija, ops) in hijas.items():
+        persistir_tabla(df_hija, hija, ops)
+    # Se sincroniza lo que se guardó, no ediciones posteriores del registro todavía sin confirmar
+    guardadas = {nombre_tabla: df, **{hija: df_hija for hija, (df_hija, _) in hijas.items()}}
+    sincronizar_postgresql(ChainMap(guardadas, tablas), solo=set(guardadas))
+
+# =============================================================================
+# INTEGRIDAD REFERENCIAL (ANTI-JOINS ENTRE TABLAS)
+# =============================================================================
+
+class Relacion(NamedTuple):
+    """FK de una tabla hija hacia la tabla que tiene esa columna como ID"""
+    hija: str
+    columna: str
+    padre: str
+
+def descubrir_relaciones(tablas):
+    """Relaciones FK según la convención 'id_xxx' (la misma que usa generar_ids_automaticos); solo lee cabeceras"""
+    relaciones = []
+    for nombre in tablas:
+        columnas = tablas.columnas(nombre) if hasattr(tablas, 'columnas') else list(tablas[nombre].columns)
+        for columna in columnas:
+            if not columna.startswith('id_'):
+                continue
+            padre = buscar_tabla_referenciada(columna, tablas)
+            if padre is not None and padre != nombre:
+                relaciones.append(Relacion(nombre, columna, padre))
+    return relaciones
+
+def _firma_tabla(tablas, nombre):
+    """Firma del estado de una tabla: CSV y journal en disco más sus reemplazos en memoria durante la sesión"""
+    firma = []
+    for ruta in (os.path.join(BASE_AUXILIAR, f"{nombre}.csv"), _ruta_journal(nombre)):
+        if os.path.exists(ruta):
+            estado = os.stat(ruta)
+            firma += [estado.st_size, estado.st_mtime_ns]
+        else:
+            firma += [None, None]
+    firma.append(tablas.version(nombre) if hasattr(tablas, 'version') else id(tablas[nombre]))
+    return firma
+
+def _ruta_cache_integridad():
+    """Ruta de los resultados de integridad persistidos junto a la caché columnar"""
+    # v2: las FK vacías cuentan como nulas (los resultados anteriores las daban por huérfanas)
+    return os.path.join(DIR_CACHE, "integridad_v2.json")
+
+def _obtener_cache_integridad():
+    """Resultados de integridad por relación (se leen del disco una vez por proceso)"""
+    global _cache_integridad
+    if _cache_integridad is None:
+        try:
+            with open(_ruta_cache_integridad(), encoding='utf-8') as f:
+                _cache_integridad = json.load(f)
+        except (OSError, ValueError):
+            _cache_integridad = {}
+    return _cache_integridad
+
+def _guardar_cache_integridad(cache):
+    """Persiste solo los resultados de tablas que no cambiaron en memoria (su firma de disco sigue valiendo)"""
+    persistibles = {clave: entrada for clave, entrada in cache.items()
+                    if all(firma[-1] == 0 for firma in entrada['firma'])}
+    try:
+        os.makedirs(DIR_CACHE, exist_ok=True)
+        _escribir_json_atomico(_ruta_cache_integridad(), persistibles)
+    except Exception:
+        pass
+
+def contar_huerfanas(valores, indice):
+    """Anti-join vectorizado: filas con FK no nula ni vacía que no existe entre las claves del índice"""
+    serie = valores if isinstance(valores, pd.Series) else pd.Series(np.asarray(valores))
+    nulos = serie.isna()
+    if not pd.api.types.is_numeric_dtype(serie):
+        # El CSV se lee con keep_default_na=False: las referencias puestas en nulo vuelven como ''
+        nulos |= serie.astype(str).str.strip() == ''
+    nulos = nulos.to_numpy()
+    faltan = ~indice.contiene_varios(valores) & ~nulos
+    ejemplos = pd.unique(np.asarray(valores)[faltan])[:MUESTRA_HUERFANAS]
+    return {
+        'filas': len(faltan),
+        'nulos': int(nulos.sum()),
+        'huerfanas': int(faltan.sum()),
+        'ejemplos': [_valor_json(valor) if not isinstance(valor, (int, float, str)) else valor for valor in ejemplos],
+    }
+
+def verificar_integridad(tablas, solo=None, usar_cache=True, hijas=None):
+    """
+    Verifica todas las FK en una pasada: cada tabla padre arma su índice de claves una vez y cada
+    columna FK se recorre una vez. Las relaciones cuyas tablas no cambiaron salen de la caché.
+    Con solo se limitan a las relaciones que involucran esas tablas; con hijas, a las FK de esas
+    tablas (solo se cargan ellas y sus padres). Retorna {Relacion: resultado}.
+    """
+    relaciones = descubrir_relaciones(tablas)
+    if solo is not None:
+        relaciones = [r for r in relaciones if r.hija in solo or r.padre in solo]
+    if hijas is not None:
+        relaciones = [r for r in relaciones if r.hija in hijas]
+
+    resultados = {}
+    firmas = {}
+    with _integridad_lock:
+        cache = _obtener_cache_integridad()
+        calculadas = 0
+        for relacion in relaciones:
+            for nombre in (relacion.hija, relacion.padre):
+                if nombre not in firmas:
+                    firmas[nombre] = _firma_tabla(tablas, nombre)
+            firma = [firmas[relacion.hija], firmas[relacion.padre]]
+            clave = f"{relacion.hija}.{relacion.columna}->{relacion.padre}"
+            entrada = cache.get(clave)
+            if usar_cache and entrada and entrada['firma'] == firma:
+                resultados[relacion] = entrada['resultado']
+                continue
+
+            indice = obtener_indice_claves(relacion.padre, tablas, relacion.columna)
+            if indice is None:
+                continue
+            resultados[relacion] = contar_huerfanas(tablas[relacion.hija][relacion.columna], indice)
+            cache[clave] = {'firma': firma, 'resultado': resultados[relacion]}
+            calculadas += 1
+        if calculadas:
+            _guardar_cache_integridad(cache)
+    return resultados
+
+def mostrar_integridad(resultados, solo_problemas=False):
+    """Imprime las huérfanas por relación; retorna el total de filas huérfanas"""
+    total = sum(resultado['huerfanas'] for resultado in resultados.values())
+    if solo_problemas and not total:
+        return 0
+    print("\n🔎 INTEGRIDAD REFERENCIAL")
+    print("="*50)
+    for relacion, resultado in resultados.items():
+        if solo_problemas and not resultado['huerfanas']:
+            continue
+        icono = "❌" if resultado['huerfanas'] else "✅"
+        linea = f"{icono} {relacion.hija}.{relacion.columna} -> {relacion.padre}: {resultado['huerfanas']} huérfanas"
+        if resultado['nulos']:
+            linea += f", {resultado['nulos']} nulas"
+        if resultado['ejemplos']:
+            linea += f" (ej.: {', '.join(str(valor) for valor in resultado['ejemplos'])})"
+        print(linea)
+    print(f"\n📊 {len(resultados)} relaciones verificadas, {total} filas huérfanas")
+    return total
+
+# =============================================================================
+# MOTOR DE FILTROS
+# =============================================================================
+
+# Sintaxis del filtro: operador opcional seguido del valor ('>100', '==25', '>2023-01-01' o texto)
+_PATRON_FILTRO = re.compile(r'^\s*(==|!=|>=|<=|=|>|<)\s*(.*?)\s*$')
+_PATRON_FECHA = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+class Predicado(NamedTuple):
+    """Filtro ya interpretado: tipo de comparación, operador y valor tipado"""
+    tipo: str
+    operador: str
+    valor: object
+
+def _texto_numerico(serie):
+    """True si la columna de texto tiene números en todas sus celdas no vacías (CSV leído sin tipos)"""
+    textos = serie.astype(object).where(serie.notna(), '').astype(str).str.strip()
+    con_valor = textos != ''
+    if not con_valor.any():
+        return False
+    return bool(pd.to_numeric(textos[con_valor], errors='coerce').notna().all())
+
+def compilar_filtro(serie, filtro):
+    """Interpreta el texto del filtro según el tipo de la columna y devuelve un Predicado"""
+    coincidencia = _PATRON_FILTRO.match(filtro)
+    if not coincidencia:
+        return Predicado('contiene', 'contiene', filtro.strip().strip('\'"'))
+    
+    operador = '==' if coincidencia.group(1) == '=' else coincidencia.group(1)
+    valor = coincidencia.group(2).strip('\'"')
+    if valor == '':
+        raise ValueError("falta el valor a comparar")
+    
+    if pd.api.types.is_numeric_dtype(serie):
+        try:
+            return Predicado('numero', operador, float(valor))
+        except ValueError:
+            raise ValueError(f"'{valor}' no es un número")
+    try:
+        numero = float(valor)
+    except ValueError:
+        numero = None
+    if numero is not None and _texto_numerico(serie):
+        # Con keep_default_na=False una columna numérica con celdas vacías se carga como texto
+        return Predicado('numero', operador, numero)
+    if pd.api.types.is_datetime64_any_dtype(serie) or _PATRON_FECHA.match(valor):
+        try:
+            return Predicado('fecha', operador, np.datetime64(pd.Timestamp(valor), 'ns'))
+        except ValueError:
+            raise ValueError(f"'{valor}' no es una fecha válida")
+    return Predicado('texto', operador, valor)
+
+class IndiceColumna:
+    """Índice ordenado de una columna (o códigos de categoría para búsquedas de texto)"""
+    
+    def __init__(self, serie, tipo):
+        self.tipo = tipo
+        if tipo == 'contiene':
+            # Cada valor distinto se compara una sola vez; las filas se obtienen por su código
+            codigos, categorias = pd.factorize(serie.astype(str), sort=False)
+            self.categorias = pd.Series(categorias, dtype=object)
+            self.orden = np.argsort(codigos, kind='stable')
+            self.limites = np.searchsorted(codigos[self.orden], np.arange(len(categorias) + 1))
+            return
+        
+        if tipo == 'numero':
+            claves = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float)
+            validas = ~np.isnan(claves)
+        elif tipo == 'fecha':
+            claves = pd.to_datetime(serie, errors='coerce', format='ISO8601').to_numpy(dtype='datetime64[ns]')
+            validas = ~np.isnat(claves)
+        else:
+            claves = serie.astype(object).to_numpy()
+            validas = serie.notna().to_numpy()
+            claves = np.where(validas, claves.astype(str), '').astype(object)
+        posiciones = np.flatnonzero(validas)
+        self.orden = posiciones[np.argsort(claves[posiciones], kind='stable')]
+        self.ordenadas = claves[self.orden]
+    
+    def buscar(self, operador, valor):
+        """Posiciones (en orden de fila) que cumplen la condición, por búsqueda binaria"""
+        if self.tipo == 'contiene':
+            coinciden = np.flatnonzero(self.categorias.str.contains(valor, case=False, regex=False).to_numpy())
+            partes = [self.orden[self.limites[c]:self.limites[c + 1]] for c in coinciden]
+            return np.sort(np.concatenate(partes)) if partes else np.array([], dtype=np.int64)
+        
+        izquierda = np.searchsorted(self.ordenadas, valor, side='left')
+        derecha = np.searchsorted(self.ordenadas, valor, side='right')
+        tramos = {
+            '==': self.orden[izquierda:derecha],
+            '!=': np.concatenate([self.orden[:izquierda], self.orden[derecha:]]),
+            '>': self.orden[derecha:],
+            '>=': self.orden[izquierda:],
+            '<': self.orden[:izquierda],
+            '<=': self.orden[:derecha],
+        }
+        return np.sort(tramos[operador])
+
+def _estado_filtros(df, nombre_tabla):
+    """Índices y resultados cacheados de la tabla; se reinician si el DataFrame ya no es el mismo"""
+    estado = _motor_filtros.get(nombre_tabla)
+    if estado is None or estado['df']() is not df:
+        estado = {'df': weakref.ref(df), 'indices': {}, 'resultados': OrderedDict()}
+        _motor_filtros[nombre_tabla] = estado
+    return estado
+
+def filtrar_posiciones(df, nombre_tabla, columna, filtro):
+    """Posiciones de las filas de df que cumplen el filtro sobre la columna (con caché de resultados)"""
+    with _motor_filtros_lock:
+        estado = _estado_filtros(df, nombre_tabla)
+        clave = (columna, filtro.strip())
+        if clave in estado['resultados']:
+            estado['resultados'].move_to_end(clave)
+            return estado['resultados'][clave]
+        
+        predicado = compilar_filtro(df[columna], filtro)
+        indice = estado['indices'].get((columna, predicado.tipo))
+        if indice is None:
+            indice = estado['indices'][(columna, predicado.tipo)] = IndiceColumna(df[columna], predicado.tipo)
+        posiciones = indice.buscar(predicado.operador, predicado.valor)
+        
+        estado['resultados'][clave] = posiciones
+        if len(estado['resultados']) > FILTROS_CACHE_MAX:
+            estado['resultados'].popitem(last=False)
+        return posiciones
+
+# =============================================================================
+# ÍNDICE DE TRIGRAMAS PARA LA BÚSQUEDA GLOBAL
+# =============================================================================
+
+def _trigramas(texto):
+    """Trigramas distintos de un texto"""
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+def _textos_busqueda(serie):
+    """Valores de una columna tal como se buscan (texto en minúsculas, vacío para nulos)"""
+    return serie.astype(str).where(serie.notna(), '').str.lower()
+
+class IndiceTrigramas:
+    """
+    Índice invertido de la búsqueda global: trigrama -> valores distintos -> filas.
+    Las filas se guardan con un id interno estable; _vivos traduce ids a posiciones actuales.
+    """
+    
+    def __init__(self, df):
+        self.columnas = tuple(df.columns)
+        self._valores = []
+        self._id_valor = {}
+        self._postings = {}
+        self._postings_extra = {}
+        self._filas_extra = {}
+        
+        # Valores distintos de todas las columnas: cada texto se indexa una sola vez
+        pares_valor, pares_fila = [], []
+        filas = np.arange(len(df), dtype=np.int64)
+        for columna in df.columns:
+            codigos, distintos = pd.factorize(_textos_busqueda(df[columna]))
+            ids_columna = np.array([self._registrar_valor(v, extra=False) for v in distintos], dtype=np.int64)
+            if len(codigos):
+                pares_valor.append(ids_columna[codigos])
+                pares_fila.append(filas)
+        
+        valores = np.concatenate(pares_valor) if pares_valor else np.array([], dtype=np.int64)
+        filas_pares = np.concatenate(pares_fila) if pares_fila else np.array([], dtype=np.int64)
+        orden = np.argsort(valores, kind='stable')
+        self._filas_por_valor = filas_pares[orden]
+        self._limites = np.searchsorted(valores[orden], np.arange(len(self._valores) + 1))
+        self._postings = {t: np.array(ids, dtype=np.int64) for t, ids in self._postings.items()}
+        self._serie_valores = None
+        self._vivos = filas
+        self._proximo_id = len(df)
+    
+    def _registrar_valor(self, valor, extra=True):
+        """Id de un texto; si es nuevo se agregan sus trigramas a las listas de postings"""
+        id_valor = self._id_valor.get(valor)
+        if id_valor is None:
+            id_valor = self._id_valor[valor] = len(self._valores)
+            self._valores.append(valor)
+            destino = self._postings_extra if extra else self._postings
+            for trigrama in _trigramas(valor):
+                destino.setdefault(trigrama, []).append(id_valor)
+            self._serie_valores = None
+        return id_valor
+    
+    def __len__(self):
+        return len(self._vivos)
+    
+    def _candidatos(self, termino):
+        """Ids de valores que podrían contener el término (intersección de postings de sus trigramas)"""
+        trigramas = _trigramas(termino)
+        if not trigramas:
+            return np.arange(len(self._valores))
+        listas = []
+        for trigrama in trigramas:
+            base = self._postings.get(trigrama, np.array([], dtype=np.int64))
+            extra = self._postings_extra.get(trigrama)
+            listas.append(np.concatenate([base, np.array(extra, dtype=np.int64)]) if extra else base)
+        listas.sort(key=len)
+        candidatos = listas[0]
+        for lista in listas[1:]:
+            if len(candidatos) == 0:
+                break
+            candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+        return candidatos
+    
+    def buscar(self, termino):
+        """Posiciones de las filas con alguna celda que contiene el término ('texto*' busca por prefijo)"""
+        termino = termino.lower()
+        prefijo = termino.endswith('*')
+        termino = termino.rstrip('*')
+        if not termino:
+            return np.array([], dtype=np.int64)
+        
+        candidatos = self._candidatos(termino)
+        if self._serie_valores is None:
+            self._serie_valores = pd.Series(self._valores, dtype=object)
+        textos = self._serie_valores.iloc[candidatos]
+        verificados = textos.str.startswith(termino) if prefijo else textos.str.contains(termino, regex=False)
+        coinciden = candidatos[verificados.to_numpy(dtype=bool)]
+        
+        partes = [self._filas_por_valor[self._limites[v]:self._limites[v + 1]]
+                  for v in coinciden if v < len(self._limites) - 1]
+        partes.extend(np.array(self._filas_extra[v], dtype=np.int64) for v in coinciden if v in self._filas_extra)
+        if not partes:
+            return np.array([], dtype=np.int64)
+        ids = np.unique(np.concatenate(partes))
+        posiciones = np.searchsorted(self._vivos, ids)
+        vigentes = (posiciones < len(self._vivos)) & (self._vivos[np.minimum(posiciones, len(self._vivos) - 1)] == ids)
+        return posiciones[vigentes]
+    
+    def agregar_filas(self, df_nuevas):
+        """Indexa filas agregadas al final de la tabla"""
+        ids = np.arange(self._proximo_id, self._proximo_id + len(df_nuevas), dtype=np.int64)
+        self._proximo_id += len(df_nuevas)
+        for columna in self.columnas:
+            if columna not in df_nuevas.columns:
+                continue
+            for id_fila, valor in zip(ids, _textos_busqueda(df_nuevas[columna])):
+                self._filas_extra.setdefault(self._registrar_valor(valor), []).append(int(id_fila))
+        self._vivos = np.concatenate([self._vivos, ids])
+    
+    def eliminar_posiciones(self, posiciones):
+        """Quita filas por posición (las siguientes se desplazan como en el DataFrame)"""
+        self._vivos = np.delete(self._vivos, posiciones)
+
+def _firma_busqueda(df):
+    """Firma del contenido visible de la tabla para validar un índice persistido"""
+    return [list(map(str, df.columns)), len(df), int(pd.util.hash_pandas_object(df, index=False).sum())]
+
+def _ruta_indice_busqueda(nombre_tabla):
+    """Ruta del índice de búsqueda persistido junto a la caché columnar"""
+    return os.path.join(DIR_CACHE, f"{nombre_tabla}.busqueda.pkl")
+
+def _cargar_indice_busqueda(df, nombre_tabla):
+    """Lee el índice persistido si fue construido sobre el mismo contenido"""
+    try:
+        with open(_ruta_indice_busqueda(nombre_tabla), 'rb') as f:
+            firma, indice = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+    return indice if firma == _firma_busqueda(df) else None
+
+def _guardar_indice_busqueda(df, nombre_tabla, indice):
+    """Persiste el índice de búsqueda (escritura atómica)"""
+    try:
+        os.makedirs(DIR_CACHE, exist_ok=True)
+        ruta = _ruta_indice_busqueda(nombre_tabla)
+        with open(f"{ruta}.tmp", 'wb') as f:
+            pickle.dump((_firma_busqueda(df), indice), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{ruta}.tmp", ruta)
+    except Exception as e:
+        print(f"⚠️  No se pudo guardar el índice de búsqueda de {nombre_tabla}: {e}")
+
+def obtener_indice_busqueda(df, nombre_tabla):
+    """Índice de trigramas de las columnas visibles; se construye (o se lee del disco) en la primera búsqueda"""
+    with _indices_busqueda_lock:
+        indice = _indices_busqueda.get(nombre_tabla)
+        if indice is not None and indice.columnas == tuple(df.columns) and len(indice) == len(df):
+            return indice
+        
+        indice = _cargar_indice_busqueda(df, nombre_tabla) if INDICE_BUSQUEDA_PERSISTENTE else None
+        if indice is None:
+            print(f"🗂️  Indexando '{nombre_tabla}' para búsquedas...")
+            indice = IndiceTrigramas(df)
+            if INDICE_BUSQUEDA_PERSISTENTE:
+                _guardar_indice_busqueda(df, nombre_tabla, indice)
+        _indices_busqueda[nombre_tabla] = indice
+        return indice
+
+def buscar_posiciones(df, nombre_tabla, termino):
+    """Posiciones de las filas de df con alguna columna que contiene el término"""
+    return obtener_indice_busqueda(df, nombre_tabla).buscar(termino)
+
+def actualizar_indice_busqueda(nombre_tabla, agregadas=None, eliminadas=None):
+    """Mantiene al día el índice de búsqueda de la tabla (si ya existe) tras agregar o eliminar filas"""
+    with _indices_busqueda_lock:
+        indice = _indices_busqueda.get(nombre_tabla)
+        if indice is None:
+            return
+        if eliminadas is not None:
+            indice.eliminar_posiciones(eliminadas)
+        if agregadas is not None and len(agregadas):
+            indice.agregar_filas(agregadas)
+
+def invalidar_indice_busqueda(nombre_tabla=None):
+    """Descarta el índice de búsqueda de una tabla (o todos) para reconstruirlo en la próxima búsqueda"""
+    with _indices_busqueda_lock:
+        if nombre_tabla is None:
+            _indices_busqueda.clear()
+        else:
+            _indices_busqueda.pop(nombre_tabla, None)
+
+# =============================================================================
+# VISOR PAGINADO DE RESULTADOS
+# =============================================================================
+
+def _texto_celda(valor):
+    """Texto de una celda para el visor (nulos como NaN, recortado al ancho máximo)"""
+    texto = 'NaN' if valor is None or (not isinstance(valor, str) and pd.isna(valor)) else str(valor)
+    texto = texto.replace('\n', ' ')
+    return texto if len(texto) <= ANCHO_MAX_COLUMNA else texto[:ANCHO_MAX_COLUMNA - 1] + '…'
+
+class VisorPaginado:
+    """Muestra por páginas las filas de un DataFrame indicadas por posición, sin renderizar el resto"""
+    
+    def __init__(self, df, posiciones=None, nombre_tabla=None, filas_por_pagina=None):
+        self.df = df
+        self.posiciones = posiciones
+        self.total = len(df) if posiciones is None else len(posiciones)
+        self.filas_por_pagina = max(1, filas_por_pagina or FILAS_POR_PAGINA)
+        self.paginas = max(1, -(-self.total // self.filas_por_pagina))
+        # Los anchos se reutilizan entre páginas y entre consultas de la misma tabla
+        self.anchos = _anchos_columnas.setdefault(nombre_tabla, {}) if nombre_tabla else {}
+        self.ancho_posicion = len(str(max(len(df) - 1, 0)))
+    
+    def _posiciones_pagina(self, pagina):
+        """Posiciones de las filas de la página (1..paginas)"""
+        inicio = (pagina - 1) * self.filas_por_pagina
+        fin = min(inicio + self.filas_por_pagina, self.total)
+        if self.posiciones is None:
+            return np.arange(inicio, fin)
+        return np.asarray(self.posiciones[inicio:fin])
+    
+    def renderizar(self, pagina):
+        """Líneas de texto de una página: encabezado y filas con columnas alineadas"""
+        posiciones = self._posiciones_pagina(pagina)
+        bloque = self.df.iloc[posiciones]
+        celdas = {}
+        for columna in self.df.columns:
+            textos = [_texto_celda(valor) for valor in bloque[columna].tolist()]
+            ancho = max([self.anchos.get(columna, 0), min(len(str(columna)), ANCHO_MAX_COLUMNA)] + [len(t) for t in textos])
+            self.anchos[columna] = ancho
+            celdas[columna] = textos
+        
+        lineas = [' ' * self.ancho_posicion + '  ' + '  '.join(
+            str(columna)[:self.anchos[columna]].rjust(self.anchos[columna]) for columna in self.df.columns)]
+        for i, posicion in enumerate(posiciones):
+            lineas.append(str(posicion).ljust(self.ancho_posicion) + '  ' + '  '.join(
+                celdas[columna][i].rjust(self.anchos[columna]) for columna in self.df.columns))
+        return lineas
+    
+    def mostrar(self):
+        """Recorre las páginas: Enter/s siguiente, a anterior, número para saltar, q para salir"""
+        pagina = 1
+        while True:
+            print('\n'.join(self.renderizar(pagina)))
+            if self.paginas == 1:
+                return
+            print(f"\n📄 Página {pagina}/{self.paginas} ({self.total} registros)")
+            accion = input("Enter/s = siguiente, a = anterior, número = ir a página, q = salir: ").strip().lower()
+            if accion == 'q':
+                return
+            if accion in ('', 's'):
+                if pagina == self.paginas:
+                    return
+                pagina += 1
+            elif accion == 'a':
+                pagina = max(1, pagina - 1)
+            elif accion.isdigit() and 1 <= int(accion) <= self.paginas:
+                pagina = int(accion)
+            else:
+                print("❌ Opción no válida")
+
+# =============================================================================
+# EXPORTACIONES EN STREAMING
+# =============================================================================
+
+def _mostrar_progreso(hechas, total, etiqueta="Exportando"):
+    """Muestra el avance de una exportación en la misma línea"""
+    porcentaje = 100 if total == 0 else hechas * 100 // total
+    print(f"\r⏳ {etiqueta}: {porcentaje}% ({hechas}/{total})", end='' if hechas < total else '\n', flush=True)
+
+@contextmanager
+def abrir_salida_texto(ruta, compresion=None):
+    """Abre un archivo de texto para escribir en streaming, opcionalmente comprimido con gzip o zstd"""
+    if compresion == 'gzip':
+        with gzip.open(ruta, 'wt', encoding='utf-8', newline='') as f:
+            yield f
+    elif compresion == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("La compresión zstd requiere el paquete 'zstandard'")
+        with open(ruta, 'wb') as crudo:
+            with zstandard.ZstdCompressor().stream_writer(crudo) as comprimido:
+                with io.TextIOWrapper(comprimido, encoding='utf-8', newline='') as f:
+                    yield f
+    elif compresion is None:
+        with open(ruta, 'w', encoding='utf-8', newline='') as f:
+            yield f
+    else:
+        raise ValueError(f"Compresión no soportada: {compresion}")
+
+def ruta_exportacion(nombre_tabla, formato, compresion=None):
+    """Ruta de salida por defecto en la carpeta auxiliar según formato y compresión"""
+    extension = {'json': '.json', 'ndjson': '.jsonl', 'excel': '.xlsx'}[formato]
+    sufijo = {None: '', 'gzip': '.gz', 'zstd': '.zst'}[compresion]
+    return os.path.join(BASE_AUXILIAR, f"{nombre_tabla}{extension}{sufijo}")
+
+def exportar_json_stream(df, ruta, formato='json', compresion=None, chunk_filas=None, progreso=True):
+    """Exporta por lotes de filas a JSON-lines ('ndjson') o a un arreglo JSON ('json') sin armar todo en memoria"""
+    chunk_filas = chunk_filas or EXPORT_CHUNK_FILAS
+    total = len(df)
+    with abrir_salida_texto(ruta, compresion) as f:
+        if formato == 'json':
+            f.write('[')
+        for inicio in range(0, total, chunk_filas):
+            lineas = df.iloc[inicio:inicio + chunk_filas].to_json(orient='records', lines=True, force_ascii=False)
+            lineas = lineas.rstrip('\n')
+            if formato == 'json':
+                # Un registro por línea, separados por coma, dentro del arreglo
+                f.write(('\n' if inicio == 0 else ',\n') + lineas.replace('\n', ',\n'))
+            else:
+                f.write(lineas + '\n')
+            if progreso:
+                _mostrar_progreso(min(inicio + chunk_filas, total), total)
+        if formato == 'json':
+            f.write('\n]\n')
+    return total
+
+def _filas_para_excel(bloque):
+    """Filas de un lote como tuplas con tipos que acepta el escritor de Excel (nulos como celdas vacías)"""
+    for columna in bloque.columns:
+        if pd.api.types.is_datetime64_any_dtype(bloque[columna]):
+            bloque = bloque.assign(**{columna: bloque[columna].astype(str)})
+    return bloque.astype(object).where(bloque.notna(), None).itertuples(index=False, name=None)
+
+def exportar_excel_stream(df, ruta, chunk_filas=None, progreso=True):
+    """Exporta a Excel en modo de memoria constante (xlsxwriter, o openpyxl write-only), repartiendo en hojas si hace falta"""
+    chunk_filas = chunk_filas or EXPORT_CHUNK_FILAS
+    total = len(df)
+    encabezado = [str(columna) for columna in df.columns]
+    
+    if xlsxwriter is not None:
+        libro = xlsxwriter.Workbook(ruta, {'constant_memory': True, 'nan_inf_to_errors': True})
+        agregar_hoja = libro.add_worksheet
+        escribir_fila = lambda hoja, numero, valores: hoja.write_row(numero, 0, valores)
+    else:
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("La exportación a Excel requiere 'xlsxwriter' u 'openpyxl'")
+        libro = Workbook(write_only=True)
+        agregar_hoja = libro.create_sheet
+        escribir_fila = lambda hoja, numero, valores: hoja.append(valores)
+    hojas = []
+    
+    def nueva_hoja():
+        hoja = agregar_hoja(f"Hoja{len(hojas) + 1}")
+        escribir_fila(hoja, 0, encabezado)
+        hojas.append(hoja)
+        return hoja
+    
+    try:
+        hoja, fila_hoja = nueva_hoja(), 1
+        for inicio in range(0, total, chunk_filas):
+            for fila in _filas_para_excel(df.iloc[inicio:inicio + chunk_filas]):
+                if fila_hoja == EXCEL_MAX_FILAS:
+                    hoja, fila_hoja = nueva_hoja(), 1
+                escribir_fila(hoja, fila_hoja, fila)
+                fila_hoja += 1
+            if progreso:
+                _mostrar_progreso(min(inicio + chunk_filas, total), total)
+    finally:
+        if xlsxwriter is not None:
+            libro.close()
+        else:
+            libro.save(ruta)
+    return total
+
+# =============================================================================
+# IMPORTACIÓN MASIVA DE REGISTROS
+# =============================================================================
+
+def leer_archivo_importacion(ruta):
+    """Lee un archivo CSV, JSON-lines (o JSON) o Excel con los registros a importar"""
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension == '.csv':
+        return pd.read_csv(ruta, keep_default_na=False)
+    if extension in ('.jsonl', '.ndjson'):
+        return pd.read_json(ruta, lines=True, dtype=False)
+    if extension == '.json':
+        return pd.read_json(ruta, dtype=False)
+    if extension in ('.xlsx', '.xls'):
+        return pd.read_excel(ruta)
+    raise ValueError(f"Formato no soportado para importar: {extension}")
+
+def _normalizar_nombre_columna(nombre):
+    """Normaliza un nombre de columna para comparar (minúsculas, sin espacios ni guiones)"""
+    return str(nombre).strip().lower().replace(' ', '_').replace('-', '_')
+
+def mapear_columnas_importacion(columnas_origen, columnas_destino, mapeo=None):
+    """Arma el mapeo origen -> destino: primero el explícito y luego por nombre normalizado"""
+    mapeo = dict(mapeo or {})
+    destinos = {_normalizar_nombre_columna(col): col for col in columnas_destino}
+    usados = set(mapeo.values())
+    for columna in columnas_origen:
+        if columna in mapeo:
+            continue
+        destino = destinos.get(_normalizar_nombre_columna(columna))
+        if destino is not None and destino not in usados:
+            mapeo[columna] = destino
+            usados.add(destino)
+    return mapeo
+
+def _convertir_como_destino(serie, dtype_destino):
+    """Convierte una columna importada al tipo numérico de la tabla si todos sus valores lo permiten"""
+    if dtype_destino in ('int64', 'float64'):
+        vacios = serie.isna() | (serie.astype(str).str.strip() == '')
+        numeros = pd.to_numeric(serie.where(~vacios), errors='coerce')
+        if not (numeros.isna() & ~vacios).any():
+            if dtype_destino == 'int64' and not vacios.any():
+                return numeros.astype('int64')
+            return numeros
+    return serie
+
+def preparar_importacion(df_tabla, df_origen, nombre_tabla, mapeo=None, tablas=None):
+    """
+    Alinea los registros importados con la tabla, asigna IDs ocultos en bloque y valida las FK.
+    Los IDs se toman de la secuencia sin reservarlos: se reservan al aplicar la importación.
+    Retorna: (registros_validos, rechazados, mapeo_usado)
+    """
+    tablas = tablas if tablas is not None else tablas_referencia
+    mapeo = mapear_columnas_importacion(df_origen.columns, df_tabla.columns, mapeo)
+    nuevos = pd.DataFrame(index=range(len(df_origen)), columns=df_tabla.columns, dtype=object)
+    for origen, destino in mapeo.items():
+        nuevos[destino] = df_origen[origen].reset_index(drop=True).astype(object)
+    
+    motivos = pd.Series('', index=nuevos.index, dtype=object)
+    columna_id_principal = detectar_columna_id(df_tabla)
+    columnas_ocultas = obtener_columnas_ocultas(df_tabla)
+    vacios = {col: nuevos[col].isna() | (nuevos[col].astype(str).str.strip() == '') for col in columnas_ocultas}
+    es_fk = {col: col.startswith('id_') and col != columna_id_principal for col in columnas_ocultas}
+    
+    # 1. Validación en bloque: FK contra el índice del padre e ID principal contra los existentes
+    for columna in columnas_ocultas:
+        if es_fk[columna]:
+            tabla_referenciada = buscar_tabla_referenciada(columna, tablas)
+            indice = obtener_indice_claves(tabla_referenciada, tablas, columna) if tabla_referenciada else None
+            por_defecto = indice.primera() if indice is not None else None
+            nuevos.loc[vacios[columna], columna] = por_defecto if por_defecto is not None else 1
+            if indice is not None:
+                invalidas = ~vacios[columna] & ~indice.contiene_varios(nuevos[columna])
+                motivos[invalidas] += f"{columna} inexistente en {tabla_referenciada}; "
+        elif columna == columna_id_principal and (~vacios[columna]).any():
+            existentes = IndiceClaves(df_tabla[columna]).contiene_varios(nuevos[columna])
+            repetidos = ~vacios[columna] & (existentes | nuevos[columna].duplicated(keep='first'))
+            motivos[repetidos] += f"{columna} repetido; "
+    
+    # 2. IDs propios vacíos de los registros válidos: un bloque contiguo desde el próximo ID libre
+    #    (también mayor que los de la tabla, que puede tener importaciones aún no reservadas)
+    aceptados = motivos == ''
+    for columna in columnas_ocultas:
+        faltantes = vacios[columna] & aceptados
+        cantidad = int(faltantes.sum())
+        if not es_fk[columna] and cantidad:
+            primero = max(secuencias_ids.consultar(nombre_tabla, columna, df_tabla),
+                          obtener_siguiente_id(df_tabla, columna))
+            nuevos.loc[faltantes, columna] = np.arange(primero, primero + cantidad)
+    
+    validos = nuevos[aceptados].reset_index(drop=True)
+    for columna in validos.columns:
+        validos[columna] = _convertir_como_destino(validos[columna], str(df_tabla[columna].dtype))
+    detalle_rechazos = df_origen.reset_index(drop=True)[~aceptados].assign(motivo=motivos[~aceptados].str.rstrip('; '))
+    return validos, detalle_rechazos, mapeo
+
+def operacion_importacion(registros):
+    """Operación de journal que agrega en un solo paso todos los registros importados"""
+    registros = registros.astype(object).where(registros.notna(), None)
+    return {'op': 'insertar', 'registros': registros.to_dict('records')}
+
+def ids_importados(df_tabla, validos):
+    """Próximo ID libre de cada columna de IDs propios después de importar validos ({columna: siguiente})"""
+    columna_id_principal = detectar_columna_id(df_tabla)
+    return {columna: obtener_siguiente_id(validos, columna) for columna in obtener_columnas_ocultas(df_tabla)
+            if columna in validos.columns and (columna == columna_id_principal or not columna.startswith('id_'))}
+
+def reservar_ids_importados(nombre_tabla, df_tabla, validos):
+    """Avanza las secuencias de la tabla más allá de los IDs que usan los registros importados"""
+    for columna, siguiente in ids_importados(df_tabla, validos).items():
+        secuencias_ids.avanzar(nombre_tabla, columna, siguiente, df_tabla)
+
+def aplicar_importacion(df_tabla, nombre_tabla, validos):
+    """Agrega los registros preparados y reserva sus IDs; devuelve (dataframe, operación)"""
+    reservar_ids_importados(nombre_tabla, df_tabla, validos)
+    op = operacion_importacion(validos)
+    # Las claves nuevas entran al índice al registrar el paso (fijar_tabla), sin reconstruirlo
+    return aplicar_operacion(df_tabla, op), op
+
+# =============================================================================
+# CACHÉ DEL CATÁLOGO DE POSTGRESQL
+# =============================================================================
+
+class TablaCatalogo(NamedTuple):
+    """Metadatos de una tabla de PostgreSQL tomados del catálogo"""
+    nombre: str
+    columnas: tuple
+    tipos: dict
+    clave_primaria: Optional[str]
+    padres: frozenset
+
+def cargar_catalogo(conn):
+    """Carga en una sola consulta tablas, columnas, tipos, clave primaria y FK del esquema public"""
+    global catalogo_postgres
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.relname,
+               a.attname,
+               format_type(a.atttypid, a.atttypmod),
+               COALESCE(a.attnum = ANY(i.indkey), false),
+               COALESCE(array_length(i.indkey, 1), 0),
+               ARRAY(SELECT DISTINCT cf.relname::text
+                     FROM pg_constraint k JOIN pg_class cf ON cf.oid = k.confrelid
+                     WHERE k.conrelid = c.oid AND k.contype = 'f')
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        LEFT JOIN pg_index i ON i.indrelid = c.oid AND i.indisprimary
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+        ORDER BY c.relname, a.attnum
+    """)
+    filas = cursor.fetchall()
+    cursor.close()
+    
+    datos = {}
+    for tabla, columna, tipo, es_pk, columnas_pk, padres in filas:
+        info = datos.setdefault(tabla, {'columnas': [], 'tipos': {}, 'pk': None, 'padres': padres or []})
+        info['columnas'].append(columna)
+        info['tipos'][columna] = tipo
+        # Solo se usan claves primarias de una columna (ON CONFLICT sobre esa columna)
+        if es_pk and columnas_pk == 1:
+            info['pk'] = columna
+    
+    catalogo = {
+        tabla: TablaCatalogo(tabla, tuple(info['columnas']), info['tipos'], info['pk'], frozenset(info['padres']))
+        for tabla, info in datos.items()
+    }
+    with _catalogo_lock:
+        catalogo_postgres = catalogo
+    print(f"📚 Catálogo PostgreSQL cargado ({len(catalogo)} tablas)")
+    return catalogo
+
+def obtener_catalogo(conn):
+    """Devuelve el catálogo cacheado, cargándolo si fue invalidado"""
+    catalogo = catalogo_postgres
+    if catalogo is None:
+        catalogo = cargar_catalogo(conn)
+    return catalogo
+
+def invalidar_catalogo():
+    """Descarta el catálogo cacheado (tras DDL o a pedido); se recarga en el próximo uso"""
+    global catalogo_postgres
+    with _catalogo_lock:
+        catalogo_postgres = None
+
+def _es_error_de_esquema(error):
+    """Indica si un error de PostgreSQL se debe a un catálogo desactualizado (tabla o columna inexistente)"""
+    return isinstance(error, (psycopg2.errors.UndefinedTable, psycopg2.errors.UndefinedColumn,
+                              psycopg2.errors.DatatypeMismatch))
+
+# =============================================================================
+# FUNCIONES DE COPY EN STREAMING (SIN ARCHIVOS TEMPORALES)
+# =============================================================================
+
+# Formato binario de COPY: cabecera, marca de NULL y marca de fin
+_PGCOPY_CABECERA = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_PGCOPY_NULO = struct.pack('!i', -1)
+_PGCOPY_FIN = struct.pack('!h', -1)
+_EPOCA_POSTGRES = pd.Timestamp('2000-01-01')
+
+# Tipos de PostgreSQL que se pueden codificar en COPY binario (dtype big-endian, None = texto UTF-8)
+TIPOS_COPY_BINARIO = {
+    'smallint': '>i2', 'integer': '>i4', 'bigint': '>i8',
+    'real': '>f4', 'double precision': '>f8', 'boolean': '?', 'date': '>i4',
+    'text': None, 'character varying': None, 'character': None,
+}
+
+class _FlujoCopy:
+    """Objeto tipo archivo de solo lectura que consume un generador de bloques a medida que COPY los pide"""
+
+    def __init__(self, bloques, vacio=''):
+        self._bloques = iter(bloques)
+        self._vacio = vacio
+        self._actual = vacio
+        self._pos = 0
+
+    def read(self, size=-1):
+        partes = []
+        restante = size
+        while restante != 0:
+            if self._pos >= len(self._actual):
+                try:
+                    self._actual = next(self._bloques)
+                    self._pos = 0
+                except StopIteration:
+                    break
+                continue
+            if restante < 0:
+                trozo = self._actual[self._pos:]
+            else:
+                trozo = self._actual[self._pos:self._pos + restante]
+                restante -= len(trozo)
+            self._pos += len(trozo)
+            partes.append(trozo)
+        return self._vacio.join(partes)
+
+def _bloques_csv(df, chunk_filas=None, **opciones_csv):
+    """Genera el CSV del DataFrame por bloques de filas, sin materializarlo completo"""
+    chunk_filas = chunk_filas or COPY_CHUNK_FILAS
+    for inicio in range(0, len(df), chunk_filas):
+        yield df.iloc[inicio:inicio + chunk_filas].to_csv(header=False, **opciones_csv)
+
+def _tipo_base(tipo):
+    """Quita modificadores como (100) o [] de un tipo devuelto por format_type"""
+    return tipo.split('(')[0].strip() if tipo else tipo
+
+def _admite_copy_binario(df, tipos):
+    """Indica si todas las columnas del DataFrame tienen un tipo destino codificable en binario"""
+    return all(_tipo_base(tipos.get(col)) in TIPOS_COPY_BINARIO for col in df.columns)
+
+def _codificar_columna_binaria(serie, tipo):
+    """Codifica una columna para COPY binario: (bytes de los valores, anchos fijos o None, máscara de nulos)"""
+    dtype = TIPOS_COPY_BINARIO[_tipo_base(tipo)]
+    
+    if dtype is None:
+        # Texto: los vacíos viajan como NULL, igual que en el COPY CSV
+        valores = [None if v is None or v == '' or (isinstance(v, float) and np.isnan(v)) else str(v).encode('utf-8')
+                   for v in serie.tolist()]
+        return valores, None, np.array([v is None for v in valores], dtype=bool)
+    
+    if _tipo_base(tipo) == 'date':
+        fechas = pd.to_datetime(serie.replace('', None), errors='coerce')
+        nulos = fechas.isna().to_numpy()
+        numeros = ((fechas - _EPOCA_POSTGRES).dt.days).fillna(0).to_numpy()
+    elif dtype == '?':
+        nulos = serie.isna().to_numpy() | (serie == '').to_numpy()
+        numeros = serie.replace('', None).map(
+            lambda v: str(v).strip().lower() in ('true', 't', '1', 's', 'si') if v is not None else False
+        ).to_numpy()
+    else:
+        numeros = pd.to_numeric(serie.replace('', None), errors='raise')
+        nulos = numeros.isna().to_numpy()
+        numeros = numeros.fillna(0).to_numpy()
+        if dtype.startswith('>i') and not np.all(np.mod(numeros, 1) == 0):
+            raise ValueError(f"la columna '{serie.name}' tiene valores no enteros")
+    
+    return np.asarray(numeros).astype(dtype), np.dtype(dtype).itemsize, nulos
+
+def _codificar_bloque_binario(df, tipos):
+    """Codifica un bloque de filas en el formato binario de COPY (vectorizado si no hay texto ni nulos)"""
+    columnas = [_codificar_columna_binaria(df[col], tipos.get(col)) for col in df.columns]
+    n_filas = len(df)
+    
+    # Camino rápido: columnas de ancho fijo sin nulos -> un único array estructurado de numpy
+    if all(ancho is not None and not nulos.any() for _, ancho, nulos in columnas):
+        campos = [('n', '>i2')]
+        for i, (valores, ancho, _) in enumerate(columnas):
+            campos += [(f'l{i}', '>i4'), (f'v{i}', valores.dtype)]
+        bloque = np.empty(n_filas, dtype=campos)
+        bloque['n'] = len(columnas)
+        for i, (valores, ancho, _) in enumerate(columnas):
+            bloque[f'l{i}'] = ancho
+            bloque[f'v{i}'] = valores
+        return bloque.tobytes()
+    
+    # Camino general: se arma cada campo con su longitud
+    celdas = []
+    for valores, ancho, nulos in columnas:
+        if ancho is None:
+            celdas.append([_PGCOPY_NULO if v is None else struct.pack('!i', len(v)) + v for v in valores])
+        else:
+            crudo = valores.tobytes()
+            prefijo = struct.pack('!i', ancho)
+            celdas.append([_PGCOPY_NULO if nulos[i] else prefijo + crudo[i * ancho:(i + 1) * ancho]
+                           for i in range(n_filas)])
+    
+    cantidad = struct.pack('!h', len(columnas))
+    return b''.join(cantidad + b''.join(fila) for fila in zip(*celdas))
+
+def _bloques_binarios(df, tipos, chunk_filas=None):
+    """Genera el flujo COPY binario del DataFrame por bloques de filas"""
+    chunk_filas = chunk_filas or COPY_CHUNK_FILAS
+    yield _PGCOPY_CABECERA
+    for inicio in range(0, len(df), chunk_filas):
+        yield _codificar_bloque_binario(df.iloc[inicio:inicio + chunk_filas], tipos)
+    yield _PGCOPY_FIN
+
+def copiar_dataframe_postgres(cursor, df, tabla, tipos=None, formato=None, chunk_filas=None):
+    """Envía el DataFrame a COPY ... FROM STDIN en streaming por bloques; devuelve el formato usado"""
+    formato = (formato or COPY_FORMATO).lower()
+    columnas = sql.SQL(', ').join(map(sql.Identifier, df.columns))
+    
+    if formato in ('binary', 'auto') and tipos and _admite_copy_binario(df, tipos):
+        numericas = sum(TIPOS_COPY_BINARIO[_tipo_base(tipos[col])] is not None for col in df.columns)
+        if formato == 'binary' or numericas * 2 >= len(df.columns):
+            copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT binary)").format(sql.Identifier(tabla), columnas)
+            flujo = _FlujoCopy(_bloques_binarios(df, tipos, chunk_filas), vacio=b'')
+            cursor.copy_expert(copy_sql.as_string(cursor), flujo, size=COPY_TAMANO_LECTURA)
+            return 'binary'
+    elif formato == 'binary':
+        print(f"⚠️  '{tabla}' tiene tipos no soportados en COPY binario, se usa CSV")
+    
+    copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(sql.Identifier(tabla), columnas)
+    flujo = _FlujoCopy(_bloques_csv(df, chunk_filas, index=False))
+    cursor.copy_expert(copy_sql.as_string(cursor), flujo, size=COPY_TAMANO_LECTURA)
+    return 'csv'
+
+# =============================================================================
+# FUNCIONES DE SINCRONIZACIÓN INCREMENTAL (CAMBIOS POR FILA)
+# =============================================================================
+
+def _normalizar_claves(serie):
+    """Normaliza los valores de clave a texto (los enteros sin decimales: 1.0 -> '1')"""
+    numeros = pd.to_numeric(serie, errors='coerce')
+    if len(serie) > 0 and numeros.notna().all() and (numeros % 1 == 0).all():
+        return numeros.astype('int64').astype(str)
+    return serie.astype(str)
+
+def _hashes_filas(df, columna_clave):
+    """Calcula un hash de contenido por fila indexado por la clave primaria"""
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return pd.Series(hashes, index=pd.Index(_normalizar_claves(df[columna_clave]), name='clave'), name='hash')
+
+def _rutas_estado_sync(tabla):
+    """Rutas del estado de sincronización de una tabla (metadatos y hashes)"""
+    return (os.path.join(DIR_ESTADO_SYNC, f"{tabla}.json"),
+            os.path.join(DIR_ESTADO_SYNC, f"{tabla}.csv"))
+
+def _cargar_estado_sync(tabla):
+    """Carga el último estado sincronizado de una tabla, o None si no existe"""
+    ruta_meta, ruta_hashes = _rutas_estado_sync(tabla)
+    if not (os.path.exists(ruta_meta) and os.path.exists(ruta_hashes)):
+        return None
+    try:
+        with open(ruta_meta, encoding='utf-8') as f:
+            meta = json.load(f)
+        hashes = pd.read_csv(ruta_hashes, dtype={'clave': str, 'hash': 'uint64'}, keep_default_na=False)
+        meta['hashes'] = pd.Series(hashes['hash'].to_numpy(), index=pd.Index(hashes['clave'], name='clave'), name='hash')
+        return meta
+    except Exception as e:
+        print(f"⚠️  Estado de sincronización de {tabla} ilegible, se hará envío completo: {e}")
+        return None
+
+def _guardar_estado_sync(tabla, estado):
+    """Persiste el estado sincronizado (columnas, clave y hash por fila) de una tabla"""
+    os.makedirs(DIR_ESTADO_SYNC, exist_ok=True)
+    ruta_meta, ruta_hashes = _rutas_estado_sync(tabla)
+    estado['hashes'].reset_index().to_csv(ruta_hashes, index=False)
+    with open(ruta_meta, 'w', encoding='utf-8') as f:
+        json.dump({'columnas': estado['columnas'], 'columna_clave': estado['columna_clave'],
+                   'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, f, ensure_ascii=False)
+
+def invalidar_estado_sync(tabla=None):
+    """Borra el estado incremental (de una tabla o de todas) para forzar un envío completo"""
+    for ruta in glob.glob(os.path.join(DIR_ESTADO_SYNC, f"{tabla or '*'}.*")):
+        os.remove(ruta)
+
+def sembrar_estado_sync(tabla, df, columna_clave):
+    """Guarda como último estado sincronizado el contenido de df (por ejemplo, recién descargado de PostgreSQL)"""
+    hashes = _hashes_filas(df, columna_clave)
+    if not hashes.index.is_unique:
+        invalidar_estado_sync(tabla)
+        return
+    _guardar_estado_sync(tabla, {'columnas': df.columns.tolist(), 'columna_clave': columna_clave, 'hashes': hashes})
+
+def calcular_delta(df, tabla, columna_clave, usar_estado=True):
+    """Compara el DataFrame con el último estado sincronizado y devuelve filas nuevas/modificadas y claves eliminadas"""
+    hashes = _hashes_filas(df, columna_clave)
+    delta = {
+        'completo': True, 'columna_clave': columna_clave, 'columnas': df.columns.tolist(),
+        'hashes': hashes, 'cambios': df, 'eliminados': [], 'hashes_eliminados': hashes.iloc[:0],
+        'insertados': len(df), 'actualizados': 0
+    }
+    
+    estado = _cargar_estado_sync(tabla) if usar_estado else None
+    if (estado is None or not hashes.index.is_unique
+            or estado['columnas'] != delta['columnas'] or estado['columna_clave'] != columna_clave):
+        return delta
+    
+    previos = estado['hashes']
+    existentes = hashes.index.isin(previos.index)
+    modificados = np.zeros(len(df), dtype=bool)
+    modificados[existentes] = hashes[existentes].to_numpy() != previos.reindex(hashes.index[existentes]).to_numpy()
+    eliminados = previos[~previos.index.isin(hashes.index)]
+    
+    delta.update({
+        'completo': False,
+        'cambios': df[~existentes | modificados],
+        'eliminados': eliminados.index.tolist(),
+        # Si el servidor no deja borrar alguna, su hash vuelve al estado para reintentarla
+        'hashes_eliminados': eliminados,
+        'insertados': int((~existentes).sum()),
+        'actualizados': int(modificados.sum()),
+    })
+    return delta
+
+def _eliminar_claves_postgres(cursor, tabla, primary_key, tipo_clave, claves):
+    """
+    Elimina en PostgreSQL las filas cuyas claves ya no están en el CSV. Las que todavía referencian
+    filas de otras tablas (violación de FK) no se borran: retorna (eliminadas, claves bloqueadas).
+    """
+    if not claves:
+        return 0, []
+    eliminar_sql = sql.SQL("DELETE FROM {} WHERE {} = ANY(%s::{}[])").format(
+        sql.Identifier(tabla), sql.Identifier(primary_key), sql.SQL(tipo_clave or 'text')
+    )
+    cursor.execute("SAVEPOINT eliminar_claves;")
+    try:
+        cursor.execute(eliminar_sql, (claves,))
+        eliminadas = cursor.rowcount
+        cursor.execute("RELEASE SAVEPOINT eliminar_claves;")
+        return eliminadas, []
+    except psycopg2.errors.ForeignKeyViolation:
+        cursor.execute("ROLLBACK TO SAVEPOINT eliminar_claves;")
+    # Alguna clave sigue referenciada: se borran una por una y se apartan las bloqueadas
+    eliminadas, bloqueadas = 0, []
+    for clave in claves:
+        cursor.execute("SAVEPOINT eliminar_clave;")
+        try:
+            cursor.execute(eliminar_sql, ([clave],))
+            eliminadas += cursor.rowcount
+            cursor.execute("RELEASE SAVEPOINT eliminar_clave;")
+        except psycopg2.errors.ForeignKeyViolation:
+            cursor.execute("ROLLBACK TO SAVEPOINT eliminar_clave;")
+            bloqueadas.append(clave)
+    return eliminadas, bloqueadas
+
+def _reintentar_eliminaciones(bloqueadas, orden):
+    """
+    Reintenta, de las tablas hijas a las padres, las eliminaciones que una FK impidió durante la
+    sincronización (las hijas ya borraron sus filas). Las que siguen bloqueadas se informan aparte.
+    """
+    for tabla in reversed(orden):
+        if tabla not in bloqueadas:
+            continue
+        primary_key, tipo_clave, claves = bloqueadas[tabla]
+        with sesion_postgres() as conn:
+            if not conn:
+                return
+            try:
+                eliminadas, siguen = _eliminar_claves_postgres(conn.cursor(), tabla, primary_key, tipo_clave, claves)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ No se pudieron reintentar las eliminaciones de {tabla}: {e}")
+                continue
+        estado = _cargar_estado_sync(tabla)
+        if estado is not None:
+            estado['hashes'] = estado['hashes'].drop(sorted(set(claves) - set(siguen)), errors='ignore')
+            _guardar_estado_sync(tabla, estado)
+        if eliminadas:
+            print(f"🗑️  {tabla}: {eliminadas} filas eliminadas en PostgreSQL tras eliminar sus referencias")
+        _avisar_eliminaciones_bloqueadas(tabla, siguen)
+
+def _avisar_eliminaciones_bloqueadas(tabla, claves):
+    """Informa las claves borradas en el CSV que PostgreSQL no deja eliminar por estar referenciadas"""
+    if claves:
+        print(f"⚠️  {tabla}: {len(claves)} filas no se eliminaron en PostgreSQL porque otras tablas las referencian "
+              f"(ej: {', '.join(map(str, claves[:MUESTRA_HUERFANAS]))}); se reintentará en la próxima sincronización")
+
+def confirmar_sincronizacion(conn, tabla, estado=None):
+    """Hace commit de la tabla y recién entonces persiste su estado incremental (el 'estado_sync' del reporte)"""
+    conn.commit()
+    if estado is not None:
+        try:
+            _guardar_estado_sync(tabla, estado)
+        except Exception as e:
+            print(f"⚠️  No se pudo guardar el estado incremental de {tabla}: {e}")
+
 # =============================================================================
 # FUNCIONES DE CONEXIÓN Y SINCRONIZACIÓN CON POSTGRESQL
 # =============================================================================
@@ -308,32 +2936,38 @@ def generar_ids_automaticos(df_original, nuevo_registro):
 def test_conexion_postgres():
     """Función para probar la conexión independientemente"""
     print("\n🧪 TEST DE CONEXIÓN A POSTGRESQL")
-    print("="*40)
-    
-    conn = conectar_postgres_persistente()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT version();")
-            version = cursor.fetchone()
-            print(f"✅ PostgreSQL version: {version[0]}")
-            
-            cursor.execute("""
-                SELECT table_name 
-                FROM information_schema.tables 
-                WHERE table_schema = 'public'
-            """)
-            tablas = cursor.fetchall()
-            print(f"📊 Tablas disponibles: {[tabla[0] for tabla in tablas]}")
-            
-            return True
-        except Exception as e:
-            print(f"❌ Error en test: {e}")
-            return False
+    print("="*40)
+    
+    with sesion_postgres() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT version();")
+                version = cursor.fetchone()
+                print(f"✅ PostgreSQL version: {version[0]}")
+                
+                cursor.close()
+                
+                # Recargar el catálogo: el test también sirve para refrescarlo a pedido
+                catalogo = cargar_catalogo(conn)
+                print(f"📊 Tablas disponibles: {list(catalogo.keys())}")
+                print(f"🔌 Pool: {POOL_MIN}-{POOL_MAX} conexiones")
+                
+                return True
+            except Exception as e:
+                print(f"❌ Error en test: {e}")
+                return False
     return False
 
-def actualizar_tabla_postgres(conn, df, tabla):
-    """Actualiza una tabla en PostgreSQL manejando conflictos de duplicados"""
+def actualizar_tabla_postgres(conn, df, tabla, incremental=None, referencias=None, reporte=None, tablas=None):
+    """Actualiza una tabla en PostgreSQL manejando conflictos de duplicados (solo el delta si es incremental)"""
+    if incremental is None:
+        incremental = SYNC_INCREMENTAL
+    if reporte is None:
+        reporte = {}
+    # El estado a persistir tras el commit vuelve en reporte['estado_sync'] (nada compartido entre hilos)
+    reporte.pop('estado_sync', None)
+    
     if len(df) == 0:
         print(f"⚠️  DataFrame vacío para {tabla}, saltando...")
         return True
@@ -341,27 +2975,14 @@ def actualizar_tabla_postgres(conn, df, tabla):
     try:
         cursor = conn.cursor()
         
-        # Verificar si la tabla existe
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                AND table_name = %s
-            );
-        """, (tabla,))
+        # Existencia, columnas y clave primaria salen del catálogo cacheado (sin consultas por guardado)
+        info_tabla = obtener_catalogo(conn).get(tabla)
         
-        if not cursor.fetchone()[0]:
+        if info_tabla is None:
             print(f"❌ La tabla '{tabla}' no existe en PostgreSQL")
             return False
         
-        # Obtener las columnas reales de la tabla en PostgreSQL
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = %s AND table_schema = 'public'
-            ORDER BY ordinal_position;
-        """, (tabla,))
-        columnas_postgres = [row[0] for row in cursor.fetchall()]
+        columnas_postgres = info_tabla.columnas
         
         # Filtrar el DataFrame para que solo contenga columnas que existen en PostgreSQL
         columnas_comunes = [col for col in df.columns if col in columnas_postgres]
@@ -376,31 +2997,83 @@ def actualizar_tabla_postgres(conn, df, tabla):
         if tabla in ['facturas_encabezado', 'facturas_detalle']:
             cursor.execute("SET CONSTRAINTS ALL DEFERRED;")
         
-        # Verificar clave primaria
-        try:
-            cursor.execute("""
-                SELECT a.attname
-                FROM pg_index i
-                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
-                WHERE i.indrelid = %s::regclass AND i.indisprimary
-            """, (tabla,))
-            primary_key_result = cursor.fetchone()
-            primary_key = primary_key_result[0] if primary_key_result else None
-        except Exception as e:
-            primary_key = None
+        primary_key = info_tabla.clave_primaria
         
         if not primary_key or primary_key not in columnas_comunes:
-            return _actualizar_con_truncate(conn, df_filtrado, tabla)
+            # Sin clave primaria no hay delta posible: siempre se recarga completa
+            return _actualizar_con_truncate(conn, df_filtrado, tabla, referencias, reporte)
+        
+        # Un envío completo también calcula los hashes para que el próximo pueda ser incremental
+        delta = calcular_delta(df_filtrado, tabla, primary_key, usar_estado=incremental) if SYNC_INCREMENTAL else None
+        
+        if delta is None or delta['completo']:
+            exito = _actualizar_con_upsert(conn, df_filtrado, tabla, primary_key, reporte, referencias)
+        else:
+            print(f"🧮 Delta de {tabla}: {delta['insertados']} nuevas, {delta['actualizados']} modificadas, "
+                  f"{len(delta['eliminados'])} eliminadas (de {len(df_filtrado)} filas)")
+            tipo_clave = _obtener_tipos_columnas(conn, tabla).get(primary_key)
+            eliminadas, bloqueadas = _eliminar_claves_postgres(cursor, tabla, primary_key, tipo_clave,
+                                                               delta['eliminados'])
+            if bloqueadas:
+                # Siguen en el estado como sincronizadas: la próxima sincronización vuelve a borrarlas
+                delta['hashes'] = pd.concat([delta['hashes'], delta['hashes_eliminados'].loc[bloqueadas]])
+                reporte['eliminaciones_bloqueadas'] = (primary_key, tipo_clave, bloqueadas)
+            if len(delta['cambios']) > 0:
+                exito = _actualizar_con_upsert(conn, delta['cambios'], tabla, primary_key, reporte, referencias)
+            else:
+                exito = True
+                print(f"✅ '{tabla}' sin filas nuevas ni modificadas ({eliminadas} eliminadas en PostgreSQL)")
+        
+        # El estado solo avanza si no quedaron filas rechazadas (se reintentan en la próxima sincronización)
+        if exito and delta is not None and not reporte.get('errores'):
+            if reporte.get('huerfanas'):
+                # Las huérfanas no quedan como sincronizadas: se vuelven a enviar cuando exista el padre
+                enviadas = df_filtrado if delta['completo'] else delta['cambios']
+                claves_huerfanas = _claves_huerfanas_locales(enviadas, primary_key, reporte['huerfanas'], tablas)
+                delta['hashes'] = delta['hashes'].drop(claves_huerfanas, errors='ignore')
+            reporte['estado_sync'] = delta
         
-        return _actualizar_con_upsert(conn, df_filtrado, tabla, primary_key)
+        return exito
         
     except Exception as e:
         print(f"❌ Error actualizando {tabla} en PostgreSQL: {e}")
         conn.rollback()
+        if _es_error_de_esquema(e):
+            # Cambió el esquema (DDL): el catálogo se recarga en el próximo intento
+            invalidar_catalogo()
         return False
 
-def _actualizar_con_upsert(conn, df, tabla, primary_key):
-    """Actualiza tabla usando UPSERT para evitar duplicados"""
+def _obtener_tipos_columnas(conn, tabla):
+    """Obtiene el tipo SQL de cada columna de una tabla en PostgreSQL (desde el catálogo cacheado)"""
+    info = obtener_catalogo(conn).get(tabla)
+    return dict(info.tipos) if info else {}
+
+def _sql_conversion_texto(valor, tipo):
+    """Convierte una expresión de texto del staging al tipo real de la columna destino"""
+    if tipo is None or tipo.startswith(TIPOS_TEXTO_POSTGRES):
+        return valor
+    if tipo in TIPOS_ENTEROS_POSTGRES:
+        return sql.SQL("NULLIF({}, '')::numeric::{}").format(valor, sql.SQL(tipo))
+    return sql.SQL("NULLIF({}, '')::{}").format(valor, sql.SQL(tipo))
+
+def _cargar_staging(cursor, df, staging):
+    """Crea una tabla temporal de texto y vuelca el DataFrame con COPY (la columna _fila guarda el índice)"""
+    columnas = df.columns.tolist()
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(staging)))
+    cursor.execute(sql.SQL("CREATE TEMP TABLE {} (_fila bigint, {}) ON COMMIT DROP;").format(
+        sql.Identifier(staging),
+        sql.SQL(', ').join(sql.SQL("{} text").format(sql.Identifier(col)) for col in columnas)
+    ))
+
+    copy_sql = sql.SQL("COPY {} (_fila, {}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(
+        sql.Identifier(staging),
+        sql.SQL(', ').join(map(sql.Identifier, columnas))
+    )
+    flujo = _FlujoCopy(_bloques_csv(df, index=True, na_rep='\\N'))
+    cursor.copy_expert(copy_sql.as_string(cursor), flujo, size=COPY_TAMANO_LECTURA)
+
+def _actualizar_con_upsert(conn, df, tabla, primary_key, reporte=None, referencias=None):
+    """Actualiza tabla con UPSERT masivo: COPY a un staging temporal y un único INSERT ... SELECT ... ON CONFLICT"""
     try:
         cursor = conn.cursor()
         
@@ -408,46 +3081,108 @@ def _actualizar_con_upsert(conn, df, tabla, primary_key):
         
         # Verificar que la primary key esté en las columnas
         if primary_key not in columnas:
-            return _actualizar_con_truncate(conn, df, tabla)
+            return _actualizar_con_truncate(conn, df, tabla, referencias, reporte)
         
-        placeholders = ', '.join(['%s'] * len(columnas))
-        columnas_str = ', '.join([f'"{col}"' for col in columnas])
+        tipos = _obtener_tipos_columnas(conn, tabla)
+        staging = f"_staging_{tabla}"
+        rechazos = f"_rechazos_{tabla}"
         
-        set_clause = ', '.join([f'"{col}" = EXCLUDED."{col}"' for col in columnas if col != primary_key])
+        # 1. Volcar el DataFrame completo al staging en un solo COPY
+        _cargar_staging(cursor, df, staging)
+        huerfanas = _descartar_huerfanas_staging(conn, cursor, staging, referencias or [])
+        omitidas = sum(item['cantidad'] for item in huerfanas)
         
-        query = f"""
-            INSERT INTO "{tabla}" ({columnas_str}) 
-            VALUES ({placeholders})
-            ON CONFLICT ("{primary_key}") 
-            DO UPDATE SET {set_clause}
-        """
+        # Tabla lateral (persistente, sobrevive al commit) con las filas rechazadas de la última sincronización
+        cursor.execute(sql.SQL(
+            "CREATE TABLE IF NOT EXISTS {} (_fila bigint, clave text, error text, fecha timestamp DEFAULT now());"
+        ).format(sql.Identifier(rechazos)))
+        cursor.execute(sql.SQL("DELETE FROM {};").format(sql.Identifier(rechazos)))
         
-        registros_procesados = 0
-        errores = 0
+        columnas_str = sql.SQL(', ').join(map(sql.Identifier, columnas))
+        set_clause = sql.SQL(', ').join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(col)) for col in columnas if col != primary_key
+        )
+        if any(col != primary_key for col in columnas):
+            conflicto = sql.SQL("ON CONFLICT ({}) DO UPDATE SET {}").format(sql.Identifier(primary_key), set_clause)
+        else:
+            conflicto = sql.SQL("ON CONFLICT ({}) DO NOTHING").format(sql.Identifier(primary_key))
         
-        for idx, row in df.iterrows():
-            try:
-                cursor.execute(query, tuple(row))
-                registros_procesados += 1
-            except Exception as row_error:
-                errores += 1
-                if errores <= 3:
-                    print(f"⚠️  Error en fila {idx} de {tabla}: {row_error}")
-                continue
+        def valores_desde(alias):
+            return sql.SQL(', ').join(
+                _sql_conversion_texto(sql.SQL("{}.{}").format(sql.Identifier(alias), sql.Identifier(col)), tipos.get(col))
+                for col in columnas
+            )
         
+        # 2. Merge set-based: si hay claves repetidas en el CSV gana la última fila (igual que fila a fila)
+        merge_sql = sql.SQL("""
+            INSERT INTO {tabla} ({columnas})
+            SELECT DISTINCT ON (s.{pk}) {valores}
+            FROM {staging} s
+            ORDER BY s.{pk}, s._fila DESC
+            {conflicto}
+        """).format(
+            tabla=sql.Identifier(tabla), columnas=columnas_str, pk=sql.Identifier(primary_key),
+            valores=valores_desde('s'), staging=sql.Identifier(staging), conflicto=conflicto
+        )
+        
+        cursor.execute("SAVEPOINT upsert_masivo;")
+        try:
+            cursor.execute(merge_sql)
+            cursor.execute("RELEASE SAVEPOINT upsert_masivo;")
+        except Exception as merge_error:
+            if _es_error_de_esquema(merge_error):
+                raise
+            # 3. Algún registro es inválido: se reintenta en el servidor fila por fila
+            #    (sin idas y vueltas) y las filas rechazadas pasan a la tabla de cuarentena
+            cursor.execute("ROLLBACK TO SAVEPOINT upsert_masivo;")
+            print(f"⚠️  El UPSERT masivo de {tabla} falló ({str(merge_error).strip()}), aislando filas con error...")
+            cuarentena_sql = sql.SQL("""
+                DO $cuarentena$
+                DECLARE r record;
+                BEGIN
+                    FOR r IN SELECT * FROM {staging} ORDER BY _fila LOOP
+                        BEGIN
+                            INSERT INTO {tabla} ({columnas}) SELECT {valores} {conflicto};
+                        EXCEPTION WHEN others THEN
+                            INSERT INTO {rechazos} (_fila, clave, error) VALUES (r._fila, r.{pk}, SQLERRM);
+                        END;
+                    END LOOP;
+                END
+                $cuarentena$;
+            """).format(
+                staging=sql.Identifier(staging), tabla=sql.Identifier(tabla), columnas=columnas_str,
+                valores=valores_desde('r'), conflicto=conflicto, rechazos=sql.Identifier(rechazos),
+                pk=sql.Identifier(primary_key)
+            )
+            cursor.execute(cuarentena_sql)
+        
+        cursor.execute(sql.SQL("SELECT count(*) FROM {};").format(sql.Identifier(rechazos)))
+        errores = cursor.fetchone()[0]
+        registros_procesados = len(df) - omitidas - errores
+        muestra_rechazos = []
         if errores > 0:
-            print(f"⚠️  '{tabla}': {registros_procesados}/{len(df)} registros procesados, {errores} errores")
+            cursor.execute(sql.SQL("SELECT _fila, clave, error FROM {} ORDER BY _fila LIMIT 3;").format(sql.Identifier(rechazos)))
+            muestra_rechazos = cursor.fetchall()
+            for fila, clave, error in muestra_rechazos:
+                print(f"⚠️  Error en fila {fila} ({primary_key}={clave}) de {tabla}: {error}")
+            print(f"⚠️  '{tabla}': {registros_procesados}/{len(df)} registros procesados, {errores} errores (ver tabla {rechazos})")
         else:
             print(f"✅ '{tabla}' actualizada en PostgreSQL. Registros procesados: {registros_procesados}/{len(df)}")
+        if reporte is not None:
+            reporte.update({'procesados': registros_procesados, 'errores': errores, 'huerfanas': huerfanas,
+                            'rechazos': muestra_rechazos, 'tabla_rechazos': rechazos})
         
-        return registros_procesados > 0
+        # Las filas válidas se confirman aunque haya rechazos; el estado incremental no avanza si los hubo
+        return registros_procesados > 0 or errores == 0
         
     except Exception as e:
         print(f"❌ Error en UPSERT para {tabla}: {e}")
         conn.rollback()
+        if _es_error_de_esquema(e):
+            invalidar_catalogo()
         return False
 
-def _actualizar_con_truncate(conn, df, tabla):
+def _actualizar_con_truncate(conn, df, tabla, referencias=None, reporte=None):
     """Método con TRUNCATE para tablas sin clave primaria clara"""
     try:
         cursor = conn.cursor()
@@ -456,199 +3191,243 @@ def _actualizar_con_truncate(conn, df, tabla):
         cursor.execute(sql.SQL("TRUNCATE TABLE {} RESTART IDENTITY CASCADE;").format(sql.Identifier(tabla)))
         conn.commit()
 
-        temp_path = f"temp_{tabla}.csv"
-        df.to_csv(temp_path, index=False)
-
-        columnas = df.columns.tolist()
-        columnas_str = ', '.join([f'"{col}"' for col in columnas])
-        
-        with open(temp_path, 'r', encoding='utf-8') as f:
-            cursor.copy_expert(sql.SQL(f'COPY "{tabla}" ({columnas_str}) FROM STDIN WITH CSV HEADER DELIMITER \',\''), f)
+        tipos = _obtener_tipos_columnas(conn, tabla)
+        if referencias:
+            # Con validación referencial se pasa por el staging para descartar huérfanas en el servidor
+            staging = f"_staging_{tabla}"
+            _cargar_staging(cursor, df, staging)
+            huerfanas = _descartar_huerfanas_staging(conn, cursor, staging, referencias)
+            cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} s").format(
+                sql.Identifier(tabla),
+                sql.SQL(', ').join(map(sql.Identifier, df.columns)),
+                sql.SQL(', ').join(
+                    _sql_conversion_texto(sql.SQL("s.{}").format(sql.Identifier(col)), tipos.get(col)) for col in df.columns
+                ),
+                sql.Identifier(staging)
+            ))
+            formato = 'csv vía staging'
+            omitidas = sum(item['cantidad'] for item in huerfanas)
+            if reporte is not None:
+                reporte['huerfanas'] = huerfanas
+        else:
+            omitidas = 0
+            # COPY en streaming desde memoria, por bloques (sin archivo temporal en disco)
+            formato = copiar_dataframe_postgres(cursor, df, tabla, tipos=tipos)
         conn.commit()
 
         cursor.execute("SET session_replication_role = 'origin';")
         conn.commit()
 
-        os.remove(temp_path)
-        print(f"📤 '{tabla}' actualizada en PostgreSQL. Registros: {len(df)}")
+        print(f"📤 '{tabla}' actualizada en PostgreSQL (COPY {formato}). Registros: {len(df) - omitidas}")
         return True
         
     except Exception as e:
         print(f"❌ Error en TRUNCATE para {tabla}: {e}")
         conn.rollback()
+        if _es_error_de_esquema(e):
+            invalidar_catalogo()
         return False
 
-def sincronizar_postgresql(tablas):
-    """Sincroniza todas las tablas con PostgreSQL usando conexión persistente"""
-    global postgres_conn
+def obtener_dependencias_tablas(conn, nombres):
+    """Arma el grafo de dependencias (tabla -> tablas padre) desde las FK del catálogo más las conocidas"""
+    dependencias = {nombre: set(DEPENDENCIAS_TABLAS.get(nombre, ())) & set(nombres) for nombre in nombres}
     try:
-        print("\n🔄 Sincronizando con PostgreSQL...")
+        catalogo = obtener_catalogo(conn)
+        for hija in nombres:
+            if hija in catalogo:
+                dependencias[hija] |= (catalogo[hija].padres & set(nombres)) - {hija}
+    except Exception as e:
+        conn.rollback()
+        print(f"⚠️  No se pudieron leer las FK del catálogo, se usan las dependencias conocidas: {e}")
+    return dependencias
+
+def _ejecutar_por_dependencias(nombres, dependencias, trabajo, workers):
+    """Ejecuta trabajo(tabla) respetando el grafo: cada tabla arranca cuando terminaron sus padres"""
+    pendientes = list(nombres)
+    terminadas = set()
+    resultados = {}
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        en_curso = {}
+        while pendientes or en_curso:
+            listas = [t for t in pendientes if dependencias.get(t, set()) <= terminadas]
+            if not listas and not en_curso:
+                # Ciclo en el grafo: se continúa en el orden declarado
+                listas = pendientes[:1]
+            for tabla in listas:
+                pendientes.remove(tabla)
+                en_curso[executor.submit(trabajo, tabla)] = tabla
+            
+            hechas, _ = wait(list(en_curso), return_when=FIRST_COMPLETED)
+            for futuro in hechas:
+                tabla = en_curso.pop(futuro)
+                try:
+                    resultados[tabla] = futuro.result()
+                except Exception as e:
+                    resultados[tabla] = (False, f"❌ '{tabla}' error: {str(e)}")
+                terminadas.add(tabla)
+    
+    return resultados
+
+def _resolver_referencias(conn, df, tabla, tablas):
+    """Arma las referencias (columna hija, tabla padre, columna padre, descripción) a validar en el servidor"""
+    if tabla not in FILTROS_REFERENCIALES:
+        return []
+    fragmento, tabla_padre, descripcion = FILTROS_REFERENCIALES[tabla]
+    info_padre = obtener_catalogo(conn).get(tabla_padre)
+    if tabla_padre not in tablas or info_padre is None or not info_padre.columnas:
+        return []
+    
+    columna_referencia = next((col for col in df.columns if fragmento in col.lower()), None)
+    if not columna_referencia:
+        return []
+    
+    columna_padre = info_padre.clave_primaria or info_padre.columnas[0]
+    return [(columna_referencia, tabla_padre, columna_padre, descripcion)]
+
+def _claves_huerfanas_locales(enviadas, columna_clave, huerfanas, tablas=None):
+    """
+    Claves de las filas enviadas que el servidor descartó por huérfanas, repitiendo el anti-join con las
+    tablas padre locales (el servidor solo devuelve cantidad y ejemplos). Si el resultado local no
+    coincide con la cantidad del servidor se devuelven todas las claves enviadas, que se reintentarán.
+    """
+    descartadas = np.zeros(len(enviadas), dtype=bool)
+    for item in huerfanas:
+        indice = obtener_indice_claves(item['tabla_padre'], tablas, item['columna_padre'])
+        if indice is None or item['columna_hija'] not in enviadas.columns:
+            return _normalizar_claves(enviadas[columna_clave])
+        # Igual que NOT EXISTS en SQL: una FK nula o vacía tampoco encuentra padre
+        faltan = ~indice.contiene_varios(enviadas[item['columna_hija']]) & ~descartadas
+        if int(faltan.sum()) != item['cantidad']:
+            return _normalizar_claves(enviadas[columna_clave])
+        descartadas |= faltan
+    return _normalizar_claves(enviadas[columna_clave])[descartadas]
+
+def _descartar_huerfanas_staging(conn, cursor, staging, referencias):
+    """Anti-join en SQL: borra del staging las filas cuyo padre no existe y devuelve cantidad y valores de ejemplo"""
+    informe = []
+    for columna_hija, tabla_padre, columna_padre, descripcion in referencias:
+        valor_hijo = _sql_conversion_texto(
+            sql.SQL("s.{}").format(sql.Identifier(columna_hija)),
+            _obtener_tipos_columnas(conn, tabla_padre).get(columna_padre)
+        )
+        cursor.execute(sql.SQL("""
+            WITH huerfanas AS (
+                DELETE FROM {staging} s
+                WHERE NOT EXISTS (SELECT 1 FROM {padre} p WHERE p.{columna_padre} = {valor_hijo})
+                RETURNING s.*
+            )
+            SELECT count(*), (array_agg(DISTINCT h.{columna_hija}))[1:{muestra}]
+            FROM huerfanas h
+        """).format(
+            staging=sql.Identifier(staging), padre=sql.Identifier(tabla_padre),
+            columna_padre=sql.Identifier(columna_padre), valor_hijo=valor_hijo,
+            columna_hija=sql.Identifier(columna_hija), muestra=sql.Literal(MUESTRA_HUERFANAS)
+        ))
+        cantidad, muestra = cursor.fetchone()
+        if cantidad:
+            print(f"⚠️  Se omitieron {cantidad} registros por {descripcion} inexistentes "
+                  f"({columna_hija} de ejemplo: {', '.join(map(str, muestra or []))})")
+            informe.append({
+                'relacion': f"{columna_hija} -> {tabla_padre}.{columna_padre}",
+                'columna_hija': columna_hija, 'tabla_padre': tabla_padre, 'columna_padre': columna_padre,
+                'cantidad': cantidad, 'muestra': muestra or []
+            })
+    return informe
+
+def _sincronizar_tabla(conn, tablas, tabla, incremental, reporte=None):
+    """Sincroniza una tabla en su propia transacción; devuelve (exitosa, línea de resumen) y completa reporte"""
+    try:
+        df = tablas[tabla]
+        if len(df) == 0:
+            print(f"⚠️  Tabla {tabla} está vacía, saltando...")
+            return False, None
         
-        conn = conectar_postgres_persistente()
+        print(f"📊 Procesando {tabla} ({len(df)} registros)...")
         
-        if not conn:
-            print("❌ No se pudo conectar a PostgreSQL")
-            return False
+        # Para tablas con dependencias, las filas cuyo padre no existe se descartan en el servidor
+        referencias = _resolver_referencias(conn, df, tabla, tablas)
+        reporte = reporte if reporte is not None else {}
         
-        # Verificar que la conexión es válida
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.close()
+        if actualizar_tabla_postgres(conn, df, tabla, incremental=incremental, referencias=referencias,
+                                     reporte=reporte, tablas=tablas):
+            # Hacer commit explícito después de cada tabla
+            confirmar_sincronizacion(conn, tabla, reporte.get('estado_sync'))
+            print(f"✅ '{tabla}' sincronizada exitosamente")
+            huerfanas = sum(item['cantidad'] for item in reporte.get('huerfanas', []))
+            if reporte.get('errores'):
+                return True, (f"⚠️  '{tabla}' sincronizada con {reporte['errores']} filas rechazadas "
+                              f"(ver tabla {reporte['tabla_rechazos']})")
+            if huerfanas:
+                return True, f"✅ '{tabla}' sincronizada ({huerfanas} registros huérfanos omitidos)"
+            return True, f"✅ '{tabla}' sincronizada"
         
-        # Orden correcto considerando dependencias
-        orden_tablas = [
-            'provincias', 'localidades', 'condicion_iva', 'rubros', 
-            'proveedores', 'sucursales', 'clientes', 'productos', 
-            'facturas_encabezado', 'facturas_detalle', 'ventas'
-        ]
+        conn.rollback()  # Revertir cambios si hay error
+        print(f"❌ Falló la sincronización de {tabla}")
+        return False, f"❌ Falló la sincronización de {tabla}"
+    
+    except Exception as e:
+        print(f"❌ Error actualizando {tabla} en PostgreSQL: {e}")
+        conn.rollback()
+        return False, f"❌ '{tabla}' error: {str(e)}"
+
+def sincronizar_postgresql(tablas, completo=False, workers=None, solo=None):
+    """Sincroniza las tablas (o solo las indicadas) con PostgreSQL; las independientes se procesan en paralelo"""
+    workers = min(workers or SYNC_WORKERS, POOL_MAX)
+    try:
+        print("\n🔄 Sincronizando con PostgreSQL..." + (" (envío completo)" if completo else ""))
+        incremental = SYNC_INCREMENTAL and not completo
         
-        resultados = []
-        exitosas = 0
+        # Tablas conocidas en orden de dependencias y, al final, cualquier tabla nueva
+        nombres = [t for t in ORDEN_TABLAS if t in tablas] + [t for t in tablas if t not in ORDEN_TABLAS]
+        if solo is not None:
+            nombres = [t for t in nombres if t in solo]
         
-        # PRIMERA PASADA: Tablas sin dependencias complejas
-        tablas_primera_pasada = ['provincias', 'localidades', 'condicion_iva', 'rubros', 
-                                'proveedores', 'sucursales', 'clientes', 'productos']
+        with sesion_postgres() as conn:
+            if not conn:
+                print("❌ No se pudo conectar a PostgreSQL")
+                return False
+            dependencias = obtener_dependencias_tablas(conn, nombres)
         
-        for tabla in tablas_primera_pasada:
-            if tabla in tablas:
-                try:
-                    df = tablas[tabla]
-                    if len(df) == 0:
-                        print(f"⚠️  Tabla {tabla} está vacía, saltando...")
-                        continue
-                        
-                    print(f"📊 Procesando {tabla} ({len(df)} registros)...")
-                    
-                    if actualizar_tabla_postgres(conn, df, tabla):
-                        # Hacer commit explícito después de cada tabla
-                        conn.commit()
-                        resultados.append(f"✅ '{tabla}' sincronizada")
-                        exitosas += 1
-                        print(f"✅ '{tabla}' sincronizada exitosamente")
-                    else:
-                        conn.rollback()  # Revertir cambios si hay error
-                        resultados.append(f"❌ Falló la sincronización de {tabla}")
-                        print(f"❌ Falló la sincronización de {tabla}")
-                        
-                except Exception as e:
-                    print(f"❌ Error actualizando {tabla} en PostgreSQL: {e}")
-                    if conn:
-                        conn.rollback()
-                    resultados.append(f"❌ '{tabla}' error: {str(e)}")
+        # Avisar antes de enviar: las filas huérfanas se descartarían en la segunda pasada.
+        # Solo importan las FK de las tablas que se envían, así no se cargan las hijas que no se sincronizan
+        if VERIFICAR_INTEGRIDAD_SYNC:
+            huerfanas = mostrar_integridad(verificar_integridad(tablas, hijas=set(nombres)), solo_problemas=True)
+            if huerfanas:
+                print(f"⚠️  {huerfanas} filas huérfanas no se podrán sincronizar hasta corregir sus referencias")
         
-        # SEGUNDA PASADA: Tablas con dependencias - con verificación de integridad
-        tablas_segunda_pasada = ['facturas_encabezado', 'facturas_detalle', 'ventas']
+        if workers > 1:
+            print(f"⚙️  Sincronizando con hasta {workers} conexiones en paralelo")
         
-        for tabla in tablas_segunda_pasada:
-            if tabla in tablas:
-                try:
-                    df = tablas[tabla]
-                    if len(df) == 0:
-                        print(f"⚠️  Tabla {tabla} está vacía, saltando...")
-                        continue
-                        
-                    print(f"📊 Procesando {tabla} ({len(df)} registros)...")
-                    
-                    # Para facturas_encabezado, verificar que los clientes existan
-                    if tabla == 'facturas_encabezado' and 'clientes' in tablas:
-                        cursor = conn.cursor()
-                        cursor.execute("""
-                            SELECT column_name 
-                            FROM information_schema.columns 
-                            WHERE table_name = 'clientes' 
-                            AND table_schema = 'public'
-                            ORDER BY ordinal_position LIMIT 1;
-                        """)
-                        result = cursor.fetchone()
-                        if result:
-                            id_cliente_col = result[0]
-                            
-                            cursor.execute(f"SELECT {id_cliente_col} FROM clientes")
-                            clientes_existentes = set([row[0] for row in cursor.fetchall()])
-                            
-                            columna_cliente_factura = None
-                            for col in df.columns:
-                                if 'cliente' in col.lower():
-                                    columna_cliente_factura = col
-                                    break
-                            
-                            if columna_cliente_factura:
-                                df_filtrado = df[df[columna_cliente_factura].isin(clientes_existentes)]
-                                
-                                if len(df_filtrado) < len(df):
-                                    perdidos = len(df) - len(df_filtrado)
-                                    print(f"⚠️  Se omitieron {perdidos} registros por clientes inexistentes")
-                                
-                                success = actualizar_tabla_postgres(conn, df_filtrado, tabla)
-                            else:
-                                success = actualizar_tabla_postgres(conn, df, tabla)
-                        else:
-                            success = actualizar_tabla_postgres(conn, df, tabla)
-                        cursor.close()
-                    
-                    # Para facturas_detalle, verificar que las facturas existan
-                    elif tabla == 'facturas_detalle' and 'facturas_encabezado' in tablas:
-                        cursor = conn.cursor()
-                        cursor.execute("""
-                            SELECT column_name 
-                            FROM information_schema.columns 
-                            WHERE table_name = 'facturas_encabezado' 
-                            AND table_schema = 'public'
-                            ORDER BY ordinal_position LIMIT 1;
-                        """)
-                        result = cursor.fetchone()
-                        if result:
-                            id_factura_col = result[0]
-                            
-                            cursor.execute(f"SELECT {id_factura_col} FROM facturas_encabezado")
-                            facturas_existentes = set([row[0] for row in cursor.fetchall()])
-                            
-                            columna_factura_detalle = None
-                            for col in df.columns:
-                                if 'factura' in col.lower():
-                                    columna_factura_detalle = col
-                                    break
-                            
-                            if columna_factura_detalle:
-                                df_filtrado = df[df[columna_factura_detalle].isin(facturas_existentes)]
-                                
-                                if len(df_filtrado) < len(df):
-                                    perdidos = len(df) - len(df_filtrado)
-                                    print(f"⚠️  Se omitieron {perdidos} registros por facturas inexistentes")
-                                
-                                success = actualizar_tabla_postgres(conn, df_filtrado, tabla)
-                            else:
-                                success = actualizar_tabla_postgres(conn, df, tabla)
-                        else:
-                            success = actualizar_tabla_postgres(conn, df, tabla)
-                        cursor.close()
-                    
-                    else:
-                        success = actualizar_tabla_postgres(conn, df, tabla)
-                    
-                    if success:
-                        conn.commit()  # Commit explícito
-                        resultados.append(f"✅ '{tabla}' sincronizada")
-                        exitosas += 1
-                        print(f"✅ '{tabla}' sincronizada exitosamente")
-                    else:
-                        conn.rollback()
-                        resultados.append(f"❌ Falló la sincronización de {tabla}")
-                        print(f"❌ Falló la sincronización de {tabla}")
-                        
-                except Exception as e:
-                    print(f"❌ Error actualizando {tabla} en PostgreSQL: {e}")
-                    if conn:
-                        conn.rollback()
-                    resultados.append(f"❌ '{tabla}' error: {str(e)}")
+        reportes = {}
+        
+        def trabajo(tabla):
+            # Cada tabla usa su propia conexión del pool y su propia transacción (y su propio reporte)
+            reportes[tabla] = {}
+            with sesion_postgres() as conn_tabla:
+                if not conn_tabla:
+                    return False, f"❌ '{tabla}' error: sin conexión a PostgreSQL"
+                return _sincronizar_tabla(conn_tabla, tablas, tabla, incremental, reportes[tabla])
+        
+        resultados = _ejecutar_por_dependencias(nombres, dependencias, trabajo, workers)
+        exitosas = sum(1 for exito, _ in resultados.values() if exito)
+        
+        # Las padres se sincronizan antes que sus hijas: sus bajas que chocaron con una FK se reintentan
+        # ahora, de las hijas a las padres, cuando las hijas ya borraron sus filas
+        bloqueadas = {tabla: reporte['eliminaciones_bloqueadas'] for tabla, reporte in reportes.items()
+                      if 'eliminaciones_bloqueadas' in reporte}
+        if bloqueadas:
+            _reintentar_eliminaciones(bloqueadas, nombres)
         
         print("\n" + "="*50)
         print("📊 RESUMEN DE SINCRONIZACIÓN")
         print("="*50)
-        for resultado in resultados:
-            print(resultado)
+        for tabla in nombres:
+            resultado = resultados.get(tabla, (False, None))[1]
+            if resultado:
+                print(resultado)
         
-        total_tablas_procesar = len([t for t in orden_tablas if t in tablas])
+        total_tablas_procesar = len(nombres)
         print(f"\n✅ Tablas exitosas: {exitosas}/{total_tablas_procesar}")
         
         if exitosas == total_tablas_procesar:
@@ -656,15 +3435,460 @@ def sincronizar_postgresql(tablas):
         else:
             print("⚠️  Algunas tablas tuvieron problemas.")
         
-        # NO cerramos la conexión aquí para mantenerla persistente
         return exitosas > 0
         
     except Exception as e:
         print(f"❌ Error general en sincronización: {e}")
-        if conn:
-            conn.rollback()
         return False
 
+# =============================================================================
+# DESCARGA DESDE POSTGRESQL (POSTGRESQL -> CSV AUXILIARES)
+# =============================================================================
+
+def _dtype_descarga(tipo):
+    """Tipo de pandas para una columna según su tipo en PostgreSQL (None = el valor se escribe como llega)"""
+    base = _tipo_base(tipo)
+    if base in TIPOS_ENTEROS_POSTGRES:
+        return 'Int64'
+    # numeric/decimal no pasan a float: llegan como Decimal y se escriben en el CSV sin perder dígitos
+    if base in ('real', 'double precision'):
+        return 'float64'
+    if base == 'boolean':
+        return 'boolean'
+    return None
+
+def _bloque_descarga(filas, columnas, tipos):
+    """Convierte un bloque de filas del cursor en DataFrame con los tipos del catálogo"""
+    bloque = pd.DataFrame.from_records(filas, columns=columnas)
+    for columna in columnas:
+        dtype = _dtype_descarga(tipos.get(columna))
+        if dtype == 'boolean':
+            bloque[columna] = bloque[columna].astype('boolean')
+        elif dtype:
+            bloque[columna] = pd.to_numeric(bloque[columna], errors='coerce').astype(dtype)
+    return bloque
+
+def descargar_tabla(conn, info, chunk_filas=None):
+    """
+    Descarga una tabla con un cursor con nombre (del lado del servidor) en bloques de chunk_filas y
+    la escribe en su CSV auxiliar a medida que llega: en memoria hay un solo bloque a la vez.
+    El CSV se reemplaza recién al terminar. Retorna la cantidad de filas.
+    """
+    chunk_filas = chunk_filas or DESCARGA_CHUNK_FILAS
+    columnas = list(info.columnas)
+    ruta = os.path.join(BASE_AUXILIAR, f"{info.nombre}.csv")
+    temporal = ruta + ".descarga"
+    consulta = sql.SQL("SELECT {} FROM {}").format(
+        sql.SQL(', ').join(map(sql.Identifier, columnas)), sql.Identifier(info.nombre)
+    )
+    if info.clave_primaria:
+        consulta += sql.SQL(" ORDER BY {}").format(sql.Identifier(info.clave_primaria))
+    
+    filas = 0
+    try:
+        with conn.cursor(name=f"tiendita_descarga_{info.nombre}") as cursor:
+            cursor.itersize = chunk_filas
+            cursor.execute(consulta)
+            with open(temporal, 'w', encoding='utf-8', newline='') as salida:
+                encabezado = True
+                while True:
+                    bloque = cursor.fetchmany(chunk_filas)
+                    if bloque or encabezado:
+                        _bloque_descarga(bloque, columnas, info.tipos).to_csv(salida, index=False, header=encabezado)
+                    encabezado = False
+                    filas += len(bloque)
+                    if len(bloque) < chunk_filas:
+                        break
+        # Solo lectura: se cierra la transacción que mantenía abierto el cursor
+        conn.rollback()
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return filas
+
+def descargar_postgresql(tablas, nombres=None, workers=None):
+    """
+    Descarga de PostgreSQL las tablas locales (o las indicadas) a los CSV auxiliares, cada una con su
+    conexión del pool y en paralelo. Retorna la lista de tablas descargadas.
+    """
+    workers = min(workers or SYNC_WORKERS, POOL_MAX)
+    # Un guardado local todavía encolado pisaría lo descargado
+    vaciar_persistencia()
+    print("\n⬇️  Descargando tablas desde PostgreSQL...")
+    
+    with sesion_postgres() as conn:
+        if not conn:
+            print("❌ No se pudo conectar a PostgreSQL")
+            return []
+        catalogo = obtener_catalogo(conn)
+    
+    if nombres is None:
+        nombres = [t for t in ORDEN_TABLAS if t in tablas] + [t for t in tablas if t not in ORDEN_TABLAS]
+    for tabla in [t for t in nombres if t not in catalogo]:
+        print(f"⚠️  '{tabla}' no existe en PostgreSQL, se omite")
+    nombres = [t for t in nombres if t in catalogo]
+    
+    def trabajo(tabla):
+        with sesion_postgres() as conn_tabla:
+            if not conn_tabla:
+                return False, f"❌ '{tabla}' error: sin conexión a PostgreSQL"
+            filas = descargar_tabla(conn_tabla, catalogo[tabla])
+            return True, f"✅ '{tabla}': {filas} registros descargados"
+    
+    resultados = _ejecutar_por_dependencias(nombres, {}, trabajo, workers)
+    descargadas = []
+    for tabla in nombres:
+        exito, mensaje = resultados.get(tabla, (False, None))
+        if mensaje:
+            print(mensaje)
+        if not exito:
+            continue
+        # El CSV nuevo reemplaza todo lo local: journal, secuencias y versión en memoria
+        descartar_journal(tabla)
+        secuencias_ids.olvidar(tabla)
+        invalidar_indice_busqueda(tabla)
+        if hasattr(tablas, 'recargar'):
+            tablas.recargar(tabla)
+        else:
+            tablas[tabla] = cargar_tabla(os.path.join(BASE_AUXILIAR, f"{tabla}.csv"))
+        # Lo descargado ya está en PostgreSQL: el estado incremental parte de ahí y la próxima
+        # sincronización solo envía lo que se edite después (se hashea la tabla tal como se carga)
+        info = catalogo[tabla]
+        try:
+            if SYNC_INCREMENTAL and info.clave_primaria:
+                sembrar_estado_sync(tabla, tablas[tabla][list(info.columnas)], info.clave_primaria)
+            else:
+                invalidar_estado_sync(tabla)
+        except Exception as e:
+            invalidar_estado_sync(tabla)
+            print(f"⚠️  No se pudo guardar el estado incremental de {tabla}: {e}")
+        descargadas.append(tabla)
+    
+    print(f"\n✅ Tablas descargadas: {len(descargadas)}/{len(nombres)}")
+    return descargadas
+
+# =============================================================================
+# RECONCILIACIÓN CSV / POSTGRESQL (HASH POR RANGOS DE CLAVE)
+# =============================================================================
+
+# Las sumas de hashes por rango se comparan módulo 2^64 (en numpy el uint64 ya da la vuelta solo)
+_MODULO_HASH = 2 ** 64
+_TIPOS_DECIMALES = ('numeric', 'decimal', 'real', 'double precision')
+
+def _expresion_canonica(columna, tipo):
+    """Texto canónico de una columna en SQL: el mismo que arma _texto_canonico del lado local"""
+    base = _tipo_base(tipo)
+    columna_sql = sql.Identifier(columna)
+    if base in _TIPOS_DECIMALES:
+        expresion = sql.SQL("round({}::numeric, 6)::text").format(columna_sql)
+    elif base == 'boolean':
+        expresion = sql.SQL("CASE WHEN {0} THEN 'true' WHEN NOT {0} THEN 'false' END").format(columna_sql)
+    else:
+        expresion = sql.SQL("{}::text").format(columna_sql)
+    return sql.SQL("COALESCE({}, '\\N')").format(expresion)
+
+def _texto_canonico(serie, tipo):
+    """Texto canónico de una columna local según su tipo en PostgreSQL (nulos como \\N)"""
+    base = _tipo_base(tipo)
+    if base in TIPOS_ENTEROS_POSTGRES:
+        numeros = pd.to_numeric(serie, errors='coerce')
+        nulos = numeros.isna().to_numpy()
+        textos = numeros.fillna(0).round().astype(np.int64).astype(str).to_numpy(dtype=object)
+    elif base in _TIPOS_DECIMALES:
+        numeros = pd.to_numeric(serie, errors='coerce')
+        nulos = numeros.isna().to_numpy()
+        textos = np.array([f"{valor:.6f}" for valor in numeros.fillna(0).to_numpy()], dtype=object)
+    elif base == 'boolean':
+        nulos = serie.isna().to_numpy()
+        verdaderos = serie.astype(str).str.strip().str.lower().isin(['true', 't', '1', 'si', 'sí', 'yes'])
+        textos = np.where(verdaderos.to_numpy(), 'true', 'false').astype(object)
+    else:
+        nulos = serie.isna().to_numpy()
+        textos = serie.astype(str).to_numpy(dtype=object)
+    textos[nulos] = '\\N'
+    return pd.Series(textos, index=serie.index, dtype=object)
+
+def _hash_canonico(texto):
+    """Hash de 60 bits de una fila: los primeros 15 dígitos hex del md5 (igual que en SQL)"""
+    return int(hashlib.md5(texto.encode('utf-8')).hexdigest()[:15], 16)
+
+def hashes_locales(df, info, columnas):
+    """Claves ordenadas y hash por fila de la tabla local (se calculan una vez por reconciliación)"""
+    textos = [_texto_canonico(df[columna], info.tipos[columna]) for columna in columnas]
+    filas = textos[0].str.cat(textos[1:], sep='|') if len(textos) > 1 else textos[0]
+    claves = pd.to_numeric(df[info.clave_primaria], errors='coerce').to_numpy(dtype=float)
+    validas = ~np.isnan(claves)
+    hashes = np.fromiter((_hash_canonico(texto) for texto in filas.to_numpy()[validas]),
+                         dtype=np.uint64, count=int(validas.sum()))
+    claves = claves[validas].astype(np.int64)
+    orden = np.argsort(claves, kind='stable')
+    return claves[orden], hashes[orden], int((~validas).sum())
+
+def _consulta_hashes(info, columnas):
+    """Subconsulta (clave, hash de 60 bits) sobre la tabla de PostgreSQL, filtrada por rango de clave"""
+    fila = sql.SQL("concat_ws('|', {})").format(
+        sql.SQL(', ').join(_expresion_canonica(columna, info.tipos[columna]) for columna in columnas)
+    )
+    return sql.SQL(
+        "SELECT {pk}::bigint AS k, ('x' || substr(md5({fila}), 1, 15))::bit(60)::bigint AS h "
+        "FROM {tabla} WHERE {pk} BETWEEN %(desde)s AND %(hasta)s"
+    ).format(pk=sql.Identifier(info.clave_primaria), fila=fila, tabla=sql.Identifier(info.nombre))
+
+def _resumen_local(claves, hashes, desde, hasta, partes):
+    """(cantidad, suma de hashes) por subrango de [desde, hasta], con la misma cuenta que el servidor"""
+    inicio, fin = np.searchsorted(claves, desde, side='left'), np.searchsorted(claves, hasta, side='right')
+    tramo, hashes_tramo = claves[inicio:fin], hashes[inicio:fin]
+    if not len(tramo):
+        return {}
+    cubetas = ((tramo - desde) * partes) // (hasta - desde + 1)
+    cortes = np.flatnonzero(np.r_[True, cubetas[1:] != cubetas[:-1]])
+    sumas = np.add.reduceat(hashes_tramo, cortes)
+    cantidades = np.diff(np.r_[cortes, len(tramo)])
+    return {int(cubetas[i]): (int(c), int(suma)) for i, c, suma in zip(cortes, cantidades, sumas)}
+
+def _resumen_postgres(cursor, subconsulta, desde, hasta, partes):
+    """Mismo resumen por subrango calculado en el servidor: viajan 'partes' filas, no la tabla"""
+    cursor.execute(sql.SQL(
+        "SELECT ((k - %(desde)s) * %(partes)s) / %(ancho)s, count(*), sum(h) %% {modulo} FROM ({sub}) s GROUP BY 1"
+    ).format(modulo=sql.Literal(_MODULO_HASH), sub=subconsulta),
+        {'desde': desde, 'hasta': hasta, 'partes': partes, 'ancho': hasta - desde + 1})
+    return {int(cubeta): (int(cantidad), int(suma)) for cubeta, cantidad, suma in cursor.fetchall()}
+
+def reconciliar_tabla(conn, df, info):
+    """
+    Compara la tabla local con la de PostgreSQL estilo árbol de Merkle: divide la clave primaria en
+    rangos, compara (cantidad, suma de hashes) por rango y baja solo por los que difieren. En las hojas
+    trae los hashes fila a fila. Retorna las claves que faltan de cada lado y las que tienen otro contenido.
+    """
+    columnas = [c for c in info.columnas if c in df.columns]
+    resultado = {'solo_local': [], 'solo_postgres': [], 'distintas': [], 'consultas': 0,
+                 'columnas_omitidas': [c for c in info.columnas if c not in df.columns]
+                                      + [c for c in df.columns if c not in info.columnas]}
+    claves, hashes, sin_clave = hashes_locales(df, info, columnas)
+    resultado['sin_clave'] = sin_clave
+    resultado['duplicadas'] = int(len(claves) - len(np.unique(claves)))
+    
+    cursor = conn.cursor()
+    subconsulta = _consulta_hashes(info, columnas)
+    cursor.execute(sql.SQL("SELECT min({pk}), max({pk}) FROM {tabla}").format(
+        pk=sql.Identifier(info.clave_primaria), tabla=sql.Identifier(info.nombre)))
+    minimo, maximo = cursor.fetchone()
+    extremos = [int(v) for v in (minimo, maximo) if v is not None] + ([int(claves[0]), int(claves[-1])] if len(claves) else [])
+    pendientes = [(min(extremos), max(extremos))] if extremos else []
+    
+    while pendientes:
+        desde, hasta = pendientes.pop()
+        resultado['consultas'] += 1
+        if hasta - desde + 1 <= RECONCILIAR_HOJA:
+            # Hoja: se comparan los hashes fila a fila
+            cursor.execute(subconsulta, {'desde': desde, 'hasta': hasta})
+            remotas = {int(k): int(h) for k, h in cursor.fetchall()}
+            inicio, fin = np.searchsorted(claves, desde, side='left'), np.searchsorted(claves, hasta, side='right')
+            locales = {}
+            for k, h in zip(claves[inicio:fin].tolist(), hashes[inicio:fin].tolist()):
+                locales.setdefault(k, h)
+            resultado['solo_local'] += sorted(set(locales) - set(remotas))
+            resultado['solo_postgres'] += sorted(set(remotas) - set(locales))
+            resultado['distintas'] += sorted(k for k in set(locales) & set(remotas) if locales[k] != remotas[k])
+            continue
+        partes = min(RECONCILIAR_RANGOS, hasta - desde + 1)
+        remoto = _resumen_postgres(cursor, subconsulta, desde, hasta, partes)
+        local = _resumen_local(claves, hashes, desde, hasta, partes)
+        ancho = hasta - desde + 1
+        for cubeta in sorted(set(remoto) | set(local), reverse=True):
+            if remoto.get(cubeta) != local.get(cubeta):
+                # Límites exactos de la cubeta: las claves k con (k - desde) * partes // ancho == cubeta
+                pendientes.append((desde - (-cubeta * ancho // partes), desde - (-(cubeta + 1) * ancho // partes) - 1))
+    
+    conn.rollback()
+    cursor.close()
+    for clave in ('solo_local', 'solo_postgres', 'distintas'):
+        resultado[clave].sort()
+    return resultado
+
+def reconciliar_postgresql(tablas, nombres=None):
+    """Reconciliación de las tablas locales (o las indicadas) con PostgreSQL; retorna {tabla: resultado}"""
+    vaciar_persistencia()
+    print("\n🧮 Reconciliando CSV auxiliares con PostgreSQL...")
+    resultados = {}
+    with sesion_postgres() as conn:
+        if not conn:
+            print("❌ No se pudo conectar a PostgreSQL")
+            return resultados
+        catalogo = obtener_catalogo(conn)
+        if nombres is None:
+            nombres = [t for t in ORDEN_TABLAS if t in tablas] + [t for t in tablas if t not in ORDEN_TABLAS]
+        
+        for tabla in nombres:
+            info = catalogo.get(tabla)
+            if info is None or tabla not in tablas:
+                print(f"⚠️  '{tabla}' no existe de ambos lados, se omite")
+                continue
+            if info.clave_primaria is None or _tipo_base(info.tipos[info.clave_primaria]) not in TIPOS_ENTEROS_POSTGRES:
+                print(f"⚠️  '{tabla}' no tiene clave primaria entera, se omite")
+                continue
+            df = tablas[tabla]
+            if info.clave_primaria not in df.columns:
+                print(f"⚠️  '{tabla}' no tiene la columna {info.clave_primaria} en el CSV, se omite")
+                continue
+            try:
+                resultado = reconciliar_tabla(conn, df, info)
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"❌ '{tabla}' error: {e}")
+                continue
+            resultados[tabla] = resultado
+            mostrar_reconciliacion(tabla, resultado)
+    return resultados
+
+def mostrar_reconciliacion(tabla, resultado):
+    """Imprime las diferencias de una tabla (las primeras claves de cada tipo)"""
+    diferencias = len(resultado['solo_local']) + len(resultado['solo_postgres']) + len(resultado['distintas'])
+    icono = "❌" if diferencias else "✅"
+    print(f"{icono} '{tabla}': {diferencias} filas distintas ({resultado['consultas']} consultas)")
+    for clave, etiqueta in (('solo_local', "solo en el CSV"), ('solo_postgres', "solo en PostgreSQL"),
+                            ('distintas', "con otro contenido")):
+        if resultado[clave]:
+            muestra = ', '.join(map(str, resultado[clave][:RECONCILIAR_MUESTRA]))
+            extra = " ..." if len(resultado[clave]) > RECONCILIAR_MUESTRA else ""
+            print(f"   - {len(resultado[clave])} {etiqueta}: {muestra}{extra}")
+    if resultado['columnas_omitidas']:
+        print(f"   ⚠️  Columnas que no están de ambos lados: {', '.join(resultado['columnas_omitidas'])}")
+    if resultado['sin_clave'] or resultado['duplicadas']:
+        print(f"   ⚠️  En el CSV: {resultado['sin_clave']} filas sin clave, {resultado['duplicadas']} claves repetidas")
+
+# =============================================================================
+# TRANSACCIONES DEL EDITOR (DESHACER, REHACER, DESCARTAR Y CONFIRMAR)
+# =============================================================================
+
+class Paso(NamedTuple):
+    """Una edición del menú: operaciones hacia adelante, sus inversas y las de las tablas hijas"""
+    descripcion: str
+    operaciones: list
+    inversas: list
+    hijas: dict
+
+def _aplicar_inversas(df, inversas):
+    """Deshace un paso: las inversas de cada operación se aplican de la última a la primera"""
+    for inversas_op in reversed(inversas):
+        for op in inversas_op:
+            df = aplicar_operacion(df, op)
+    return df
+
+def _operaciones_inversas(inversas):
+    """Las inversas de un paso en el orden en que _aplicar_inversas las aplica"""
+    return [op for inversas_op in reversed(inversas) for op in inversas_op]
+
+class TransaccionTabla:
+    """
+    Ediciones de una tabla guardadas como deltas (filas o columnas que cambian, nunca copias completas)
+    con deshacer, rehacer, descartar y confirmar. El registro de tablas apunta siempre al estado actual,
+    así el DataFrame anterior se libera y en memoria queda una sola versión más los deltas.
+    """
+
+    def __init__(self, df, nombre_tabla, tablas):
+        self.df = df
+        self.nombre_tabla = nombre_tabla
+        self.tablas = tablas
+        self.hechos = []
+        self.deshechos = []
+
+    def descripciones(self):
+        """Descripciones de las ediciones vigentes (las que se guardarían al confirmar)"""
+        return [paso.descripcion for paso in self.hechos]
+
+    def aplicar(self, operaciones, descripcion, confirmar=None):
+        """Aplica las operaciones con su cascada; retorna False si confirmar(cascada) la rechaza"""
+        inversas = []
+        df, cascada = aplicar_con_cascada(self.df, self.nombre_tabla, operaciones, self.tablas, inversas)
+        if confirmar is not None and not confirmar(cascada):
+            return False
+        self.registrar(df, operaciones, inversas, descripcion, cascada)
+        return True
+
+    def registrar(self, df, operaciones, inversas, descripcion, cascada=None):
+        """Registra como paso un resultado ya calculado, con sus inversas, y aplica la cascada a las hijas"""
+        hijas = {}
+        for hija, (ops, _) in (cascada or {}).items():
+            df_hija = self.tablas[hija]
+            inversas_hija = []
+            for op in ops:
+                nuevo = aplicar_operacion(df_hija, op)
+                inversas_hija.append(inversas_de(df_hija, nuevo, op))
+                df_hija = nuevo
+            fijar_tabla(self.tablas, hija, df_hija, self.tablas[hija], ops)
+            hijas[hija] = (ops, inversas_hija)
+        self._fijar(df, operaciones)
+        self.hechos.append(Paso(descripcion, operaciones, inversas, hijas))
+        self.deshechos.clear()
+
+    def deshacer(self):
+        """Deshace la última edición; retorna su descripción (None si no hay nada)"""
+        if not self.hechos:
+            return None
+        paso = self.hechos.pop()
+        for hija, (_, inversas) in paso.hijas.items():
+            fijar_tabla(self.tablas, hija, _aplicar_inversas(self.tablas[hija], inversas),
+                        self.tablas[hija], _operaciones_inversas(inversas))
+        self._fijar(_aplicar_inversas(self.df, paso.inversas), _operaciones_inversas(paso.inversas))
+        self.deshechos.append(paso)
+        self._tras_historial()
+        return paso.descripcion
+
+    def rehacer(self):
+        """Vuelve a aplicar la última edición deshecha; retorna su descripción (None si no hay nada)"""
+        if not self.deshechos:
+            return None
+        paso = self.deshechos.pop()
+        df = self.df
+        for op in paso.operaciones:
+            df = aplicar_operacion(df, op)
+        for hija, (ops, _) in paso.hijas.items():
+            df_hija = self.tablas[hija]
+            for op in ops:
+                df_hija = aplicar_operacion(df_hija, op)
+            fijar_tabla(self.tablas, hija, df_hija, self.tablas[hija], ops)
+        self._fijar(df, paso.operaciones)
+        self.hechos.append(paso)
+        self._tras_historial()
+        return paso.descripcion
+
+    def descartar(self):
+        """Deshace todas las ediciones vigentes y retorna el DataFrame como estaba al empezar"""
+        while self.hechos:
+            self.deshacer()
+        self.deshechos.clear()
+        return self.df
+
+    def confirmar(self):
+        """Guarda todas las ediciones en un solo guardado por tabla (journal si se puede) y sincroniza una vez"""
+        if not self.hechos:
+            return
+        operaciones = [op for paso in self.hechos for op in paso.operaciones]
+        # La limpieza depende de la configuración de deduplicación: se reescribe el CSV en vez de repetirla
+        if any(op['op'] == 'limpiar' for op in operaciones):
+            operaciones = None
+        hijas = {}
+        for paso in self.hechos:
+            for hija, (ops, _) in paso.hijas.items():
+                hijas.setdefault(hija, []).extend(ops)
+        if hijas:
+            guardar_con_cascada(self.tablas, self.nombre_tabla, self.df, operaciones, hijas)
+        else:
+            guardar_y_sincronizar(self.df, self.nombre_tabla, operaciones)
+        self.hechos.clear()
+        self.deshechos.clear()
+
+    def _fijar(self, df, operaciones):
+        """Deja df como estado actual, también en el registro de tablas, con el índice de claves al día"""
+        anterior, self.df = self.df, df
+        fijar_tabla(self.tablas, self.nombre_tabla, df, anterior, operaciones)
+
+    def _tras_historial(self):
+        """Tras deshacer o rehacer se reconstruye la búsqueda (la secuencia de IDs no retrocede)"""
+        invalidar_indice_busqueda(self.nombre_tabla)
+
 # =============================================================================
 # MENÚ INTERACTIVO COMPLETO - CON GENERACIÓN AUTOMÁTICA DE IDs
 # =============================================================================
@@ -675,9 +3899,9 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
     Retorna: (dataframe_modificado, lista_cambios, volver)
     """
     global tablas_referencia
-    cambios = []
-    # Crear una copia profunda para trabajar SIN limpiar automáticamente
-    df_trabajo = df_original.copy(deep=True)
+    # Las ediciones se acumulan como deltas en una transacción: sin copias completas de la tabla
+    transaccion = TransaccionTabla(df_original, nombre_tabla, todas_las_tablas)
+    df_trabajo = transaccion.df
     
     # NO limpiar automáticamente - mantener datos originales
     df_visible = obtener_vista_usuario(df_trabajo)
@@ -697,8 +3921,15 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
         print(f"📊 Registros: {len(df_visible)} | Columnas: {len(df_visible.columns)}")
         if columna_id_principal:
             print(f"🔑 ID principal: {columna_id_principal}")
-        if cambios:
-            print(f"📝 Cambios pendientes: {len(cambios)}")
+        if transaccion.hechos:
+            print(f"📝 Cambios pendientes: {len(transaccion.hechos)}")
+        if transaccion.deshechos:
+            print(f"↪️  Cambios para rehacer: {len(transaccion.deshechos)}")
+        guardados_pendientes, error_persistencia = estado_persistencia()
+        if guardados_pendientes:
+            print(f"⏳ Guardando en segundo plano: {guardados_pendientes} pendiente(s)")
+        if error_persistencia:
+            print(f"⚠️  Último error de guardado: {error_persistencia}")
         print("\n--- VISUALIZACIÓN ---")
         print("1.  Ver las primeras filas")
         print("2.  Ver información del dataset")
@@ -722,14 +3953,21 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
         print("16. Volver sin guardar cambios")
         print("17. Salir del programa")
 
+        print("\n--- IMPORTACIÓN ---")
+        print("18. Importar registros desde archivo (CSV, JSONL o Excel)")
+
+        print("\n--- HISTORIAL ---")
+        print("19. Deshacer último cambio")
+        print("20. Rehacer cambio deshecho")
+
         print("\n" + "="*50)
         
         try:
-            opcion = input("Selecciona una opción (1-17): ").strip()
+            opcion = input("Selecciona una opción (1-20): ").strip()
             
             if opcion == "1":
-                print(f"\nPrimeras 10 filas de '{nombre_tabla}':")
-                print(df_visible.head(10).to_string())
+                print(f"\nFilas de '{nombre_tabla}':")
+                VisorPaginado(df_visible, nombre_tabla=nombre_tabla).mostrar()
                 
             elif opcion == "2":
                 print(f"\n📊 Información de '{nombre_tabla}':")
@@ -741,7 +3979,7 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                 if columna_id_principal:
                     print(f"\n🔑 Columna ID: {columna_id_principal}")
                     if columna_id_principal in df_trabajo.columns:
-                        siguiente_id = obtener_siguiente_id(df_trabajo, columna_id_principal)
+                        siguiente_id = secuencias_ids.consultar(nombre_tabla, columna_id_principal, df_trabajo)
                         print(f"Siguiente ID disponible: {siguiente_id}")
                 
             elif opcion == "3":
@@ -769,11 +4007,11 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                         except ValueError:
                             # Mantener como string si no se puede convertir
                             pass
-                    df_trabajo[nueva_columna] = valor_default if valor_default else None
+                    op = {'op': 'agregar_columna', 'columna': nueva_columna, 'valor': valor_default if valor_default else None}
+                    transaccion.aplicar([op], f"Agregada columna '{nueva_columna}'")
+                    df_trabajo = transaccion.df
                     df_visible = obtener_vista_usuario(df_trabajo)
-                    cambios.append(f"Agregada columna '{nueva_columna}'")
                     print(f"✅ Columna '{nueva_columna}' agregada")
-                    guardar_y_sincronizar(df_trabajo, nombre_tabla)
                 else:
                     print("❌ Nombre no válido o columna ya existe")
                     
@@ -797,11 +4035,11 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                         if sub_opcion == "1":
                             nuevo_nombre = input("Nuevo nombre: ").strip()
                             if nuevo_nombre and nuevo_nombre not in df_trabajo.columns:
-                                df_trabajo.rename(columns={columna_original: nuevo_nombre}, inplace=True)
+                                op = {'op': 'renombrar_columna', 'de': columna_original, 'a': nuevo_nombre}
+                                transaccion.aplicar([op], f"Renombrada columna '{columna_visible}' a '{nuevo_nombre}'")
+                                df_trabajo = transaccion.df
                                 df_visible = obtener_vista_usuario(df_trabajo)
-                                cambios.append(f"Renombrada columna '{columna_visible}' a '{nuevo_nombre}'")
                                 print("✅ Columna renombrada")
-                                guardar_y_sincronizar(df_trabajo, nombre_tabla)
                             else:
                                 print("❌ Nombre no válido o ya existe")
                                 
@@ -809,20 +4047,16 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                             print("Tipos disponibles: int, float, str")
                             nuevo_tipo = input("Nuevo tipo: ").strip().lower()
                             try:
-                                if nuevo_tipo == 'int':
-                                    df_trabajo[columna_original] = pd.to_numeric(df_trabajo[columna_original], errors='coerce').fillna(0).astype(int)
-                                elif nuevo_tipo == 'float':
-                                    df_trabajo[columna_original] = pd.to_numeric(df_trabajo[columna_original], errors='coerce').fillna(0.0).astype(float)
-                                elif nuevo_tipo == 'str':
-                                    df_trabajo[columna_original] = df_trabajo[columna_original].astype(str)
-                                else:
+                                if nuevo_tipo not in ('int', 'float', 'str'):
                                     print("❌ Tipo no válido")
                                     continue
                                 
+                                op = {'op': 'cambiar_tipo', 'columna': columna_original, 'tipo': nuevo_tipo}
+                                transaccion.aplicar([op], f"Cambiado tipo de '{columna_original}' a {nuevo_tipo}")
+                                df_trabajo = transaccion.df
                                 df_visible = obtener_vista_usuario(df_trabajo)
-                                cambios.append(f"Cambiado tipo de '{columna_original}' a {nuevo_tipo}")
+                                invalidar_indice_busqueda(nombre_tabla)
                                 print("✅ Tipo de columna cambiado")
-                                guardar_y_sincronizar(df_trabajo, nombre_tabla)
                             except Exception as e:
                                 print(f"❌ Error cambiando tipo: {e}")
                         else:
@@ -845,11 +4079,11 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                         
                         confirmar = input(f"¿Estás seguro de eliminar la columna '{columna_original}'? (s/n): ").strip().lower()
                         if confirmar == 's':
-                            df_trabajo.drop(columns=[columna_original], inplace=True)
+                            op = {'op': 'eliminar_columna', 'columna': columna_original}
+                            transaccion.aplicar([op], f"Eliminada columna '{columna_original}'")
+                            df_trabajo = transaccion.df
                             df_visible = obtener_vista_usuario(df_trabajo)
-                            cambios.append(f"Eliminada columna '{columna_original}'")
                             print("✅ Columna eliminada")
-                            guardar_y_sincronizar(df_trabajo, nombre_tabla)
                     else:
                         print("❌ Número de columna no válido")
                 except ValueError:
@@ -868,7 +4102,7 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                 nuevo_registro = {}
                 
                 # Generar IDs automáticos para las columnas ocultas
-                nuevo_registro = generar_ids_automaticos(df_trabajo, nuevo_registro)
+                nuevo_registro = generar_ids_automaticos(df_trabajo, nuevo_registro, nombre_tabla)
                 
                 # Solicitar valores para las columnas visibles
                 columnas_visibles = obtener_columnas_visibles(df_trabajo)
@@ -894,17 +4128,14 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                 for columna in columnas_faltantes:
                     nuevo_registro[columna] = None
                 
-                # Convertir a DataFrame y concatenar
-                nuevo_df = pd.DataFrame([nuevo_registro])
-                df_trabajo = pd.concat([df_trabajo, nuevo_df], ignore_index=True)
-                
-                # Reindexar IDs después de agregar nuevo registro
-                if columna_id_principal and columna_id_principal in df_trabajo.columns:
-                    df_trabajo = reindexar_ids(df_trabajo, columna_id_principal)
+                # El ID viene de la secuencia de la tabla: los IDs existentes no se renumeran
+                operaciones = [{'op': 'insertar', 'registros': [nuevo_registro]}]
+                transaccion.aplicar(operaciones, "Agregado nuevo registro")
+                df_trabajo = transaccion.df
                 
                 df_visible = obtener_vista_usuario(df_trabajo)
+                actualizar_indice_busqueda(nombre_tabla, agregadas=df_visible.iloc[-1:])
                 
-                cambios.append(f"Agregado nuevo registro")
                 print("✅ Nuevo registro agregado")
                 
                 # Mostrar el registro agregado (solo columnas visibles)
@@ -913,8 +4144,6 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                 for k, v in registro_visible.items():
                     print(f"  {k}: {v}")
                 
-                guardar_y_sincronizar(df_trabajo, nombre_tabla)
-                
             elif opcion == "9":
                 print(f"\n🗑️  ELIMINAR REGISTRO DE '{nombre_tabla.upper()}'")
                 print("="*40)
@@ -937,17 +4166,19 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                         
                         confirmar = input("¿Estás seguro de eliminar este registro? (s/n): ").strip().lower()
                         if confirmar == 's':
-                            # Eliminar del DataFrame de trabajo
-                            df_trabajo = df_trabajo.drop(df_trabajo.index[fila_idx]).reset_index(drop=True)
+                            # Eliminar del DataFrame de trabajo (sin renumerar: el ID no se vuelve a usar)
+                            operaciones = [{'op': 'eliminar_filas', 'posiciones': [fila_idx]}]
                             
-                            # Reindexar IDs después de eliminar
-                            if columna_id_principal and columna_id_principal in df_trabajo.columns:
-                                df_trabajo = reindexar_ids(df_trabajo, columna_id_principal)
+                            # Las referencias al ID eliminado en otras tablas se confirman antes de dejarlas en nulo
+                            if not transaccion.aplicar(operaciones, f"Eliminado registro en posición {fila_idx}",
+                                                       confirmar_huerfanas):
+                                print("❌ Eliminación cancelada")
+                                continue
+                            df_trabajo = transaccion.df
                             
                             df_visible = obtener_vista_usuario(df_trabajo)
-                            cambios.append(f"Eliminado registro en posición {fila_idx}")
+                            actualizar_indice_busqueda(nombre_tabla, eliminadas=[fila_idx])
                             print("✅ Registro eliminado")
-                            guardar_y_sincronizar(df_trabajo, nombre_tabla)
                         else:
                             print("❌ Eliminación cancelada")
                     else:
@@ -978,15 +4209,13 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                         
                         if filtro:
                             try:
-                                # Intentar evaluar como expresión
-                                df_filtrado = df_visible.query(f"{columna_filtro} {filtro}")
-                                print(f"\n📊 Resultados del filtro ({len(df_filtrado)} registros):")
-                                print(df_filtrado.to_string())
-                            except:
-                                # Filtro por texto
-                                df_filtrado = df_visible[df_visible[columna_filtro].astype(str).str.contains(filtro, case=False, na=False)]
-                                print(f"\n📊 Resultados del filtro ({len(df_filtrado)} registros):")
-                                print(df_filtrado.to_string())
+                                # Filtro compilado sobre los índices de la columna (con caché de resultados)
+                                posiciones = filtrar_posiciones(df_visible, nombre_tabla, columna_filtro, filtro)
+                            except ValueError as e:
+                                print(f"❌ Filtro no válido: {e}")
+                                continue
+                            print(f"\n📊 Resultados del filtro ({len(posiciones)} registros):")
+                            VisorPaginado(df_visible, posiciones, nombre_tabla).mostrar()
                         else:
                             print("❌ Filtro vacío")
                     else:
@@ -998,17 +4227,13 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                 print(f"\n🔎 BUSCAR VALORES EN '{nombre_tabla.upper()}'")
                 print("="*40)
                 
-                termino = input("Término a buscar: ").strip()
+                termino = input("Término a buscar (termina en * para buscar por prefijo): ").strip()
                 if termino:
-                    # Buscar en todas las columnas
-                    mascara = pd.Series([False] * len(df_visible))
-                    for col in df_visible.columns:
-                        mascara = mascara | df_visible[col].astype(str).str.contains(termino, case=False, na=False)
-                    
-                    resultados = df_visible[mascara]
-                    print(f"\n📊 Resultados de búsqueda ({len(resultados)} registros):")
-                    if len(resultados) > 0:
-                        print(resultados.to_string())
+                    # Buscar en todas las columnas visibles a través del índice de trigramas
+                    posiciones = buscar_posiciones(df_visible, nombre_tabla, termino)
+                    print(f"\n📊 Resultados de búsqueda ({len(posiciones)} registros):")
+                    if len(posiciones) > 0:
+                        VisorPaginado(df_visible, posiciones, nombre_tabla).mostrar()
                     else:
                         print("❌ No se encontraron resultados")
                 else:
@@ -1024,61 +4249,422 @@ def menu_interactivo(df_original, nombre_tabla, todas_las_tablas):
                 
                 confirmar = input("¿Continuar? (s/n): ").strip().lower()
                 if confirmar == 's':
-                    df_original = df_trabajo.copy()
-                    df_trabajo = limpiar_tabla_manual(df_trabajo, nombre_tabla)
+                    df_limpio, mapeo, supervivientes = limpiar_tabla_manual(df_trabajo, nombre_tabla)
+                    cascada = {}
+                    if mapeo is not None and mapeo.cambios:
+                        cascada = preparar_cascada(todas_las_tablas, nombre_tabla, columna_id_principal, mapeo)
+                    if not confirmar_huerfanas(cascada):
+                        print("❌ Limpieza cancelada")
+                        continue
+                    # Para deshacer alcanza con las filas descartadas y las columnas que cambiaron
+                    inversas = inversas_por_diferencia(df_trabajo, df_limpio, supervivientes)
+                    cambios_count = len(df_trabajo) - len(df_limpio)
+                    transaccion.registrar(df_limpio, [{'op': 'limpiar'}], [inversas],
+                                          f"Limpieza: eliminados {cambios_count} registros duplicados", cascada)
+                    df_trabajo = transaccion.df
+                    invalidar_indice_busqueda(nombre_tabla)
+                    if columna_id_principal and columna_id_principal in df_trabajo.columns:
+                        actualizar_indice_tras_reindexar(nombre_tabla, columna_id_principal, len(df_trabajo))
                     df_visible = obtener_vista_usuario(df_trabajo)
                     
-                    cambios_count = len(df_original) - len(df_trabajo)
-                    if cambios_count > 0:
-                        cambios.append(f"Limpieza: eliminados {cambios_count} registros duplicados")
-                    
                     print("✅ Tabla limpiada exitosamente")
-                    guardar_y_sincronizar(df_trabajo, nombre_tabla)
                 else:
                     print("❌ Limpieza cancelada")
                     
             elif opcion == "13":
-                ruta_json = os.path.join(BASE_AUXILIAR, f"{nombre_tabla}.json")
-                df_visible.to_json(ruta_json, orient='records', indent=2, force_ascii=False)
+                formato = 'ndjson' if input("Formato: 1. Arreglo JSON  2. JSON-lines (Enter = 1): ").strip() == "2" else 'json'
+                compresion = {'1': 'gzip', '2': 'zstd'}.get(input("Compresión: 0. Ninguna  1. gzip  2. zstd (Enter = 0): ").strip())
+                ruta_json = ruta_exportacion(nombre_tabla, formato, compresion)
+                exportar_json_stream(df_visible, ruta_json, formato, compresion)
                 print(f"✅ Tabla exportada a: {ruta_json}")
                 
             elif opcion == "14":
-                ruta_excel = os.path.join(BASE_AUXILIAR, f"{nombre_tabla}.xlsx")
-                df_visible.to_excel(ruta_excel, index=False)
+                ruta_excel = ruta_exportacion(nombre_tabla, 'excel')
+                exportar_excel_stream(df_visible, ruta_excel)
                 print(f"✅ Tabla exportada a: {ruta_excel}")
                 
             elif opcion == "15":
+                cambios = transaccion.descripciones()
                 if cambios:
                     print(f"\n💾 Guardando {len(cambios)} cambios...")
+                    transaccion.confirmar()
                     registrar_cambio(nombre_tabla, cambios)
-                return df_trabajo, cambios, False
+                return transaccion.df, cambios, False
                 
             elif opcion == "16":
-                if cambios:
+                if transaccion.hechos:
                     confirmar = input("⚠️  Tienes cambios sin guardar. ¿Seguro que quieres volver? (s/n): ").strip().lower()
                     if confirmar != 's':
                         continue
-                return df_original, [], False
+                return transaccion.descartar(), [], False
                 
             elif opcion == "17":
-                if cambios:
+                if transaccion.hechos:
                     confirmar = input("⚠️  Tienes cambios sin guardar. ¿Seguro que quieres salir? (s/n): ").strip().lower()
                     if confirmar != 's':
                         continue
+                vaciar_persistencia()
                 print("👋 ¡Hasta luego!")
-                return df_original, [], True
+                return transaccion.descartar(), [], True
+                
+            elif opcion == "18":
+                print(f"\n📥 IMPORTAR REGISTROS A '{nombre_tabla.upper()}'")
+                print("="*40)
+                ruta_importacion = input("Ruta del archivo (.csv, .jsonl, .xlsx): ").strip().strip('"')
+                if not os.path.exists(ruta_importacion):
+                    print("❌ El archivo no existe")
+                    continue
+                
+                df_origen = leer_archivo_importacion(ruta_importacion)
+                print(f"📄 {len(df_origen)} registros leídos con columnas: {', '.join(map(str, df_origen.columns))}")
+                mapeo = mapear_columnas_importacion(df_origen.columns, df_trabajo.columns)
+                print("🔗 Mapeo de columnas detectado:")
+                for origen, destino in mapeo.items():
+                    print(f"  {origen} -> {destino}")
+                ajustes = input("Ajustes de mapeo 'origen=destino' separados por coma (Enter para aceptar): ").strip()
+                for par in filter(None, (p.strip() for p in ajustes.split(','))):
+                    origen, _, destino = par.partition('=')
+                    if origen.strip() in df_origen.columns and destino.strip() in df_trabajo.columns:
+                        mapeo[origen.strip()] = destino.strip()
+                    else:
+                        print(f"⚠️  Mapeo ignorado: {par}")
+                
+                validos, rechazados, mapeo = preparar_importacion(df_trabajo, df_origen, nombre_tabla, mapeo, todas_las_tablas)
+                print(f"✅ Registros válidos: {len(validos)} | ❌ Rechazados: {len(rechazados)}")
+                if len(rechazados) > 0:
+                    print(rechazados.head(10).to_string())
+                if validos.empty:
+                    print("❌ No hay registros para importar")
+                    continue
+                
+                confirmar = input(f"¿Importar {len(validos)} registros? (s/n): ").strip().lower()
+                if confirmar == 's':
+                    df_importado, op = aplicar_importacion(df_trabajo, nombre_tabla, validos)
+                    transaccion.registrar(df_importado, [op], [inversas_de(df_trabajo, df_importado, op)],
+                                          f"Importados {len(validos)} registros desde {os.path.basename(ruta_importacion)}")
+                    df_trabajo = transaccion.df
+                    df_visible = obtener_vista_usuario(df_trabajo)
+                    actualizar_indice_busqueda(nombre_tabla, agregadas=df_visible.iloc[-len(validos):])
+                    print(f"✅ {len(validos)} registros importados")
+                else:
+                    print("❌ Importación cancelada")
+                
+            elif opcion in ("19", "20"):
+                descripcion = transaccion.deshacer() if opcion == "19" else transaccion.rehacer()
+                if descripcion is None:
+                    print("❌ No hay cambios para " + ("deshacer" if opcion == "19" else "rehacer"))
+                    continue
+                df_trabajo = transaccion.df
+                df_visible = obtener_vista_usuario(df_trabajo)
+                print(("↩️  Deshecho: " if opcion == "19" else "↪️  Rehecho: ") + descripcion)
                 
             else:
-                print("❌ Opción no válida. Por favor, selecciona 1-17.")
+                print("❌ Opción no válida. Por favor, selecciona 1-20.")
                 
         except KeyboardInterrupt:
             print("\n\n⚠️  Operación interrumpida por el usuario")
-            confirmar = input("¿Quieres salir? (s/n): ").strip().lower()
+            if transaccion.hechos:
+                confirmar = input("⚠️  Tienes cambios sin guardar. ¿Seguro que quieres salir? (s/n): ").strip().lower()
+            else:
+                confirmar = input("¿Quieres salir? (s/n): ").strip().lower()
             if confirmar == 's':
-                return df_original, [], True
+                vaciar_persistencia()
+                return transaccion.descartar(), [], True
         except Exception as e:
             print(f"❌ Error: {e}")
 
+# =============================================================================
+# MODO POR LOTES (SIN MENÚ)
+# =============================================================================
+
+def _parser_lote():
+    """Parser de los subcomandos del modo por lotes (los mismos se usan en los archivos de script)"""
+    parser = argparse.ArgumentParser(
+        prog="TP1_minar_datos.py",
+        description="Gestión de las tablas auxiliares sin menú. Sin argumentos abre el menú interactivo."
+    )
+    parser.add_argument('--sin-sync', action='store_true', help="no sincronizar con PostgreSQL al terminar")
+    parser.add_argument('--continuar', action='store_true', help="seguir con las operaciones siguientes si una falla")
+    parser.add_argument('--huerfanas', choices=['error', 'nulo'], default='error',
+                        help="qué hacer si una reindexación deja referencias a IDs inexistentes en otras tablas")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    
+    p = sub.add_parser('limpiar', help="eliminar duplicados y normalizar IDs (opción 12)")
+    p.add_argument('tabla')
+    p = sub.add_parser('importar', help="importar registros desde CSV, JSONL o Excel (opción 18)")
+    p.add_argument('tabla')
+    p.add_argument('archivo')
+    p.add_argument('--mapeo', nargs='*', default=[], metavar='ORIGEN=DESTINO')
+    p = sub.add_parser('agregar-registro', help="agregar un registro con IDs automáticos (opción 8)")
+    p.add_argument('tabla')
+    p.add_argument('valores', nargs='*', metavar='COLUMNA=VALOR')
+    p = sub.add_parser('eliminar-filas', help="eliminar las filas que cumplen un filtro (opciones 9 y 10)")
+    p.add_argument('tabla')
+    p.add_argument('columna')
+    p.add_argument('filtro')
+    p = sub.add_parser('agregar-columna', help="agregar una columna (opción 5)")
+    p.add_argument('tabla')
+    p.add_argument('columna')
+    p.add_argument('--valor', default=None)
+    p = sub.add_parser('renombrar-columna', help="renombrar una columna (opción 6)")
+    p.add_argument('tabla')
+    p.add_argument('de')
+    p.add_argument('a')
+    p = sub.add_parser('cambiar-tipo', help="cambiar el tipo de una columna (opción 6)")
+    p.add_argument('tabla')
+    p.add_argument('columna')
+    p.add_argument('tipo', choices=['int', 'float', 'str'])
+    p = sub.add_parser('eliminar-columna', help="eliminar una columna (opción 7)")
+    p.add_argument('tabla')
+    p.add_argument('columna')
+    p = sub.add_parser('exportar', help="exportar la vista de la tabla (opciones 13 y 14)")
+    p.add_argument('tabla')
+    p.add_argument('--formato', choices=['json', 'ndjson', 'excel'], default='json')
+    p.add_argument('--compresion', choices=['gzip', 'zstd'], default=None)
+    p.add_argument('--salida', default=None)
+    p = sub.add_parser('sincronizar', help="sincronizar todas las tablas con PostgreSQL al terminar")
+    p.add_argument('--completo', action='store_true', help="reenviar todas las filas")
+    p = sub.add_parser('compactar', help="compactar los journals en los CSV al terminar")
+    p = sub.add_parser('verificar', help="verificar la integridad referencial (falla si hay huérfanas)")
+    p = sub.add_parser('descargar', help="reemplazar los CSV auxiliares con el contenido de PostgreSQL")
+    p.add_argument('tablas', nargs='*', help="tablas a descargar (por defecto, todas las locales)")
+    p = sub.add_parser('reconciliar', help="comparar los CSV con PostgreSQL por hash de rangos (falla si difieren)")
+    p.add_argument('tablas', nargs='*', help="tablas a comparar (por defecto, todas las locales)")
+    p = sub.add_parser('script', help="ejecutar un archivo con un subcomando por línea")
+    p.add_argument('archivo')
+    return parser
+
+def _leer_script(parser, ruta, en_curso=()):
+    """Lee un archivo de script: un subcomando por línea, '#' para comentarios; en_curso detecta inclusiones cíclicas"""
+    real = os.path.realpath(ruta)
+    if real in en_curso:
+        raise ValueError(f"{ruta}: inclusión cíclica de scripts")
+    en_curso = (*en_curso, real)
+    comandos = []
+    with open(ruta, encoding='utf-8') as f:
+        for numero, linea in enumerate(f, 1):
+            partes = shlex.split(linea, comments=True)
+            if not partes:
+                continue
+            try:
+                args = parser.parse_args(partes)
+            except SystemExit:
+                raise ValueError(f"{ruta}:{numero}: comando no válido: {linea.strip()}")
+            if args.comando == 'script':
+                comandos.extend(_leer_script(parser, args.archivo, en_curso))
+            else:
+                comandos.append(args)
+    return comandos
+
+def _valor_cli(valor):
+    """Convierte un valor de la línea de comandos a número si es posible (como la opción 5 del menú)"""
+    if valor is None or valor == '':
+        return None
+    try:
+        return float(valor) if '.' in valor else int(valor)
+    except ValueError:
+        return valor
+
+def _pares_cli(pares):
+    """Convierte una lista 'clave=valor' en diccionario"""
+    resultado = {}
+    for par in pares:
+        clave, separador, valor = par.partition('=')
+        if not separador:
+            raise ValueError(f"Se esperaba CLAVE=VALOR: {par}")
+        resultado[clave.strip()] = valor.strip()
+    return resultado
+
+def _aplicar_comando_lote(args, tablas, pendientes, cambios, huerfanas='error', reservas=None):
+    """Aplica un subcomando en memoria; acumula sus operaciones (y los IDs a reservar) para guardarlas al final"""
+    nombre_tabla = getattr(args, 'tabla', None)
+    if nombre_tabla is not None and nombre_tabla not in tablas:
+        raise ValueError(f"Tabla inexistente: {nombre_tabla}")
+    
+    def acumular(nombre, operaciones, descripcion):
+        if pendientes.get(nombre, []) is not None:
+            pendientes.setdefault(nombre, []).extend(operaciones)
+        cambios.setdefault(nombre, []).append(descripcion)
+    
+    def propagar(cascada):
+        # Referencias a IDs que ya no existen: se cancela el comando salvo que se pidan en nulo
+        perdidas = huerfanas_cascada(cascada)
+        if perdidas and huerfanas == 'error':
+            detalle = ", ".join(f"{hija}: {cantidad}" for hija, cantidad in perdidas.items())
+            raise ValueError(f"Registros que apuntarían a IDs inexistentes ({detalle}); usa --huerfanas nulo")
+        for hija, operaciones in aplicar_cascada(tablas, cascada).items():
+            acumular(hija, operaciones, f"{operaciones[0]['columna']} actualizado por cambios de IDs en '{nombre_tabla}'")
+    
+    def aplicar(operaciones, descripcion):
+        df, cascada = aplicar_con_cascada(tablas[nombre_tabla], nombre_tabla, operaciones, tablas)
+        propagar(cascada)
+        fijar_tabla(tablas, nombre_tabla, df, tablas[nombre_tabla], operaciones)
+        acumular(nombre_tabla, operaciones, descripcion)
+        return df
+    
+    if args.comando == 'limpiar':
+        df, _, mapeo, _ = limpiar_y_convertir_ids(tablas[nombre_tabla], devolver_grupos=True)
+        if mapeo is not None and mapeo.cambios:
+            propagar(preparar_cascada(tablas, nombre_tabla, detectar_columna_id(df), mapeo))
+        tablas[nombre_tabla] = df
+        # Sin representación en el journal: la tabla se reescribe completa al final
+        pendientes[nombre_tabla] = None
+        cambios.setdefault(nombre_tabla, []).append("Limpieza por lotes")
+        columna_id = detectar_columna_id(df)
+        if columna_id:
+            actualizar_indice_tras_reindexar(nombre_tabla, columna_id, len(df))
+    
+    elif args.comando == 'importar':
+        df_origen = leer_archivo_importacion(args.archivo)
+        validos, rechazados, _ = preparar_importacion(tablas[nombre_tabla], df_origen, nombre_tabla, _pares_cli(args.mapeo), tablas)
+        if len(rechazados):
+            print(f"⚠️  {nombre_tabla}: {len(rechazados)} registros rechazados de {args.archivo}")
+            print(rechazados.head(10).to_string())
+        if not validos.empty:
+            # Los IDs se reservan recién al guardar: un lote cancelado no consume la secuencia
+            if reservas is not None:
+                for columna, siguiente in ids_importados(tablas[nombre_tabla], validos).items():
+                    reservas[(nombre_tabla, columna)] = max(siguiente, reservas.get((nombre_tabla, columna), 0))
+            aplicar([operacion_importacion(validos)], f"Importados {len(validos)} registros desde {os.path.basename(args.archivo)}")
+        print(f"📥 {nombre_tabla}: {len(validos)} registros importados")
+    
+    elif args.comando == 'agregar-registro':
+        df = tablas[nombre_tabla]
+        valores = {col: _valor_cli(valor) for col, valor in _pares_cli(args.valores).items()}
+        # Como en importar: el ID se reserva recién al guardar el lote
+        registro = generar_ids_automaticos(df, valores, nombre_tabla, reservas)
+        registro.update({col: None for col in df.columns if col not in registro})
+        aplicar([{'op': 'insertar', 'registros': [registro]}], "Agregado nuevo registro")
+    
+    elif args.comando == 'eliminar-filas':
+        df = tablas[nombre_tabla]
+        if args.columna not in df.columns:
+            raise ValueError(f"Columna inexistente en {nombre_tabla}: {args.columna}")
+        posiciones = filtrar_posiciones(df, nombre_tabla, args.columna, args.filtro)
+        if len(posiciones):
+            # Los IDs no se renumeran: las referencias a las filas eliminadas se informan como huérfanas
+            aplicar([{'op': 'eliminar_filas', 'posiciones': posiciones.tolist()}],
+                    f"Eliminados {len(posiciones)} registros ({args.columna} {args.filtro})")
+        print(f"🗑️  {nombre_tabla}: {len(posiciones)} registros eliminados")
+    
+    elif args.comando == 'agregar-columna':
+        if args.columna in tablas[nombre_tabla].columns:
+            raise ValueError(f"La columna ya existe: {args.columna}")
+        aplicar([{'op': 'agregar_columna', 'columna': args.columna, 'valor': _valor_cli(args.valor)}],
+                f"Agregada columna '{args.columna}'")
+    
+    elif args.comando == 'renombrar-columna':
+        if args.de not in tablas[nombre_tabla].columns or args.a in tablas[nombre_tabla].columns:
+            raise ValueError(f"No se puede renombrar '{args.de}' a '{args.a}'")
+        aplicar([{'op': 'renombrar_columna', 'de': args.de, 'a': args.a}], f"Renombrada columna '{args.de}' a '{args.a}'")
+    
+    elif args.comando == 'cambiar-tipo':
+        if args.columna not in tablas[nombre_tabla].columns:
+            raise ValueError(f"Columna inexistente en {nombre_tabla}: {args.columna}")
+        aplicar([{'op': 'cambiar_tipo', 'columna': args.columna, 'tipo': args.tipo}],
+                f"Cambiado tipo de '{args.columna}' a {args.tipo}")
+    
+    elif args.comando == 'eliminar-columna':
+        if args.columna not in tablas[nombre_tabla].columns:
+            raise ValueError(f"Columna inexistente en {nombre_tabla}: {args.columna}")
+        aplicar([{'op': 'eliminar_columna', 'columna': args.columna}], f"Eliminada columna '{args.columna}'")
+    
+    elif args.comando == 'exportar':
+        vista = obtener_vista_usuario(tablas[nombre_tabla])
+        ruta = args.salida or ruta_exportacion(nombre_tabla, args.formato, args.compresion)
+        if args.formato == 'excel':
+            exportar_excel_stream(vista, ruta)
+        else:
+            exportar_json_stream(vista, ruta, args.formato, args.compresion)
+        print(f"✅ Tabla exportada a: {ruta}")
+    
+    elif args.comando == 'descargar':
+        editadas = [t for t in (args.tablas or pendientes) if t in pendientes]
+        if editadas:
+            raise ValueError(f"Tablas con cambios sin guardar en este lote: {', '.join(editadas)}")
+        descargadas = descargar_postgresql(tablas, args.tablas or None)
+        if not descargadas or (args.tablas and len(descargadas) != len(set(args.tablas))):
+            raise ValueError("No se pudieron descargar todas las tablas pedidas")
+    
+    elif args.comando == 'reconciliar':
+        # Compara lo que hay en disco: las tablas editadas en este lote aún no se guardaron
+        editadas = [t for t in (args.tablas or pendientes) if t in pendientes]
+        if editadas:
+            raise ValueError(f"Tablas con cambios sin guardar en este lote: {', '.join(editadas)}")
+        resultados = reconciliar_postgresql(tablas, args.tablas or None)
+        distintas = sum(len(r['solo_local']) + len(r['solo_postgres']) + len(r['distintas']) for r in resultados.values())
+        if distintas:
+            raise ValueError(f"{distintas} filas difieren entre los CSV y PostgreSQL")
+        if not resultados or (args.tablas and len(resultados) != len(set(args.tablas))):
+            raise ValueError("No se pudieron reconciliar todas las tablas pedidas")
+    
+    elif args.comando == 'verificar':
+        # Sobre las tablas como quedaron tras los comandos anteriores del lote
+        huerfanas_totales = mostrar_integridad(verificar_integridad(tablas))
+        if huerfanas_totales:
+            raise ValueError(f"{huerfanas_totales} filas con referencias a IDs inexistentes")
+
+def ejecutar_lote(comandos, sincronizar=True, continuar=False, huerfanas='error'):
+    """
+    Ejecuta los subcomandos en un solo proceso: cada tabla se carga una vez, las operaciones se aplican
+    en memoria y al final se guarda cada tabla modificada una sola vez y se sincroniza una sola vez.
+    Retorna el código de salida (0 si todo salió bien).
+    """
+    global tablas_referencia
+    tablas = RegistroTablas()
+    tablas_referencia = tablas
+    pendientes = {}
+    cambios = {}
+    reservas = {}
+    fallidos = 0
+    sync_pedida = None
+    compactar = False
+    
+    for numero, args in enumerate(comandos, 1):
+        try:
+            if args.comando == 'sincronizar':
+                sync_pedida = bool(sync_pedida) or args.completo
+            elif args.comando == 'compactar':
+                compactar = True
+            else:
+                _aplicar_comando_lote(args, tablas, pendientes, cambios, huerfanas, reservas)
+        except Exception as e:
+            fallidos += 1
+            print(f"❌ Operación {numero} ({args.comando}): {e}")
+            if not continuar:
+                print("⛔ Lote cancelado: no se guardó ningún cambio")
+                return 1
+    
+    # Un único guardado por tabla (journal con todas sus operaciones, o CSV completo)
+    for nombre_tabla, operaciones in pendientes.items():
+        persistir_tabla(tablas[nombre_tabla], nombre_tabla, operaciones)
+        registrar_cambio(nombre_tabla, cambios.get(nombre_tabla, []))
+    for (nombre_tabla, columna), siguiente in reservas.items():
+        secuencias_ids.avanzar(nombre_tabla, columna, siguiente, tablas[nombre_tabla])
+    
+    # Una única sincronización: las tablas modificadas o, si se pidió, todas
+    if sincronizar and (pendientes or sync_pedida is not None):
+        solo = None if sync_pedida is not None else set(pendientes)
+        if not sincronizar_postgresql(tablas, completo=bool(sync_pedida), solo=solo):
+            fallidos += 1
+    
+    if compactar:
+        print(f"✅ Journals compactados: {compactar_journals(tablas.keys())}")
+    cerrar_conexion_postgres()
+    print(f"\n📋 Lote terminado: {len(comandos) - fallidos}/{len(comandos)} operaciones, {len(pendientes)} tablas guardadas")
+    return 1 if fallidos else 0
+
+def main_lote(argumentos):
+    """Punto de entrada del modo por lotes a partir de los argumentos de la línea de comandos"""
+    parser = _parser_lote()
+    args = parser.parse_args(argumentos)
+    try:
+        comandos = _leer_script(parser, args.archivo) if args.comando == 'script' else [args]
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 2
+    return ejecutar_lote(comandos, sincronizar=not args.sin_sync, continuar=args.continuar, huerfanas=args.huerfanas)
+
 # =============================================================================
 # FUNCIÓN PRINCIPAL
 # =============================================================================
@@ -1090,15 +4676,15 @@ def main():
     print("🚀 INICIANDO SISTEMA DE GESTIÓN DE DATOS")
     print("="*50)
     
-    # Cargar tablas desde la carpeta auxiliar
-    print("\n📂 Cargando tablas desde carpeta auxiliar...")
-    tablas = cargar_tablas_desde_auxiliar()
+    # Registrar las tablas de la carpeta auxiliar (cada una se carga recién al abrirla)
+    print("\n📂 Buscando tablas en carpeta auxiliar...")
+    tablas = RegistroTablas()
     
     if not tablas:
         print("❌ No se encontraron tablas en la carpeta auxiliar")
         return
     
-    print(f"✅ Tablas cargadas: {list(tablas.keys())}")
+    print(f"✅ Tablas disponibles: {list(tablas.keys())}")
     
     # Actualizar referencia global
     tablas_referencia = tablas
@@ -1115,13 +4701,17 @@ def main():
         print("📊 Tablas disponibles:")
         
         for i, nombre_tabla in enumerate(tablas.keys(), 1):
-            df = tablas[nombre_tabla]
-            print(f"  {i}. {nombre_tabla} ({len(df)} registros)")
+            print(f"  {i}. {nombre_tabla} ({tablas.contar_filas(nombre_tabla)} registros)")
         
         print("\n🔧 Herramientas:")
         print(f"  {len(tablas) + 1}. Sincronizar todas las tablas con PostgreSQL")
-        print(f"  {len(tablas) + 2}. Probar conexión PostgreSQL")
-        print(f"  {len(tablas) + 3}. Salir")
+        print(f"  {len(tablas) + 2}. Sincronización completa (reenviar todas las filas)")
+        print(f"  {len(tablas) + 3}. Probar conexión PostgreSQL")
+        print(f"  {len(tablas) + 4}. Compactar journals en los CSV")
+        print(f"  {len(tablas) + 5}. Verificar integridad referencial")
+        print(f"  {len(tablas) + 6}. Descargar tablas desde PostgreSQL (reemplaza los CSV)")
+        print(f"  {len(tablas) + 7}. Reconciliar CSV con PostgreSQL (hash por rangos de clave)")
+        print(f"  {len(tablas) + 8}. Salir")
         
         print("\n" + "="*50)
         
@@ -1147,14 +4737,41 @@ def main():
                         break
                         
                 elif opcion_num == len(tablas) + 1:
-                    # Sincronizar con PostgreSQL
+                    # Sincronizar con PostgreSQL (después de los guardados en segundo plano)
+                    vaciar_persistencia()
                     sincronizar_postgresql(tablas)
                     
                 elif opcion_num == len(tablas) + 2:
+                    # Reenviar todo ignorando el estado incremental
+                    vaciar_persistencia()
+                    sincronizar_postgresql(tablas, completo=True)
+                    
+                elif opcion_num == len(tablas) + 3:
                     # Probar conexión
                     test_conexion_postgres()
                     
-                elif opcion_num == len(tablas) + 3:
+                elif opcion_num == len(tablas) + 4:
+                    # Incorporar las ediciones pendientes del journal a cada CSV
+                    compactadas = compactar_journals(tablas.keys())
+                    print(f"✅ Journals compactados: {compactadas}")
+                    
+                elif opcion_num == len(tablas) + 5:
+                    # Anti-joins de todas las FK (las tablas sin cambios salen de la caché)
+                    vaciar_persistencia()
+                    mostrar_integridad(verificar_integridad(tablas))
+                    
+                elif opcion_num == len(tablas) + 6:
+                    # PostgreSQL como fuente de verdad: los CSV auxiliares se reescriben con su contenido
+                    confirmar = input("⚠️  Se reemplazarán los CSV auxiliares y sus cambios locales. ¿Continuar? (s/n): ").strip().lower()
+                    if confirmar == 's':
+                        descargar_postgresql(tablas)
+                        tablas_referencia = tablas
+                    
+                elif opcion_num == len(tablas) + 7:
+                    # Solo viajan resúmenes por rango; las filas se comparan en los rangos que difieren
+                    reconciliar_postgresql(tablas)
+                    
+                elif opcion_num == len(tablas) + 8:
                     print("👋 ¡Hasta luego!")
                     break
                     
@@ -1171,8 +4788,12 @@ def main():
         except Exception as e:
             print(f"❌ Error: {e}")
     
-    # Cerrar conexión a PostgreSQL al salir
+    # Terminar los guardados en segundo plano, incorporar los journals de las tablas abiertas y cerrar conexiones
+    detener_persistencia()
+    compactar_journals(tablas.cargadas())
     cerrar_conexion_postgres()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main_lote(sys.argv[1:]))
     main()
\ No newline at end of file
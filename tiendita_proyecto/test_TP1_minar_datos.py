@@ -0,0 +1,299 @@
+import pandas as pd
+import pytest
+
+import TP1_minar_datos as minar
+
+
+def _clientes(apellido_segundo):
+    return pd.DataFrame({
+        'id_cliente': ['1', '2'],
+        'nombre': ['Juan', 'Juan'],
+        'apellido': ['Perez', apellido_segundo],
+        'email': ['jp@mail.com', 'jg@otro.com'],
+        'telefono': ['1155550000', '11 5555-0000'],
+    })
+
+
+def test_dedup_no_fusiona_apellidos_distintos(monkeypatch):
+    monkeypatch.setattr(minar, 'DEDUP_DIFUSO', True)
+    # "apellido" contiene "id": la conversión a numérico no debe borrar el apellido antes de comparar
+    df_limpio, grupos, _, supervivientes = minar.limpiar_y_convertir_ids(_clientes('Gomez'), devolver_grupos=True)
+    assert grupos == []
+    assert len(df_limpio) == 2
+    assert supervivientes.tolist() == [0, 1]
+
+
+def test_dedup_fusiona_apellido_con_error_de_tipeo(monkeypatch):
+    monkeypatch.setattr(minar, 'DEDUP_DIFUSO', True)
+    df_limpio, grupos, _, _ = minar.limpiar_y_convertir_ids(_clientes('Peres'), devolver_grupos=True)
+    assert grupos == [[1, 2]]
+    assert len(df_limpio) == 1
+
+
+def test_dedup_difuso_desactivado_por_defecto():
+    df_limpio, grupos, _, _ = minar.limpiar_y_convertir_ids(_clientes('Peres'), devolver_grupos=True)
+    assert grupos == []
+    assert len(df_limpio) == 2
+
+
+def test_filtro_numerico_en_columna_de_texto_con_vacios():
+    # keep_default_na=False: una columna numérica con celdas vacías llega como texto
+    df = pd.DataFrame({'precio': ['100', '9', '', '250']})
+    assert minar.filtrar_posiciones(df, 'productos', 'precio', '>100').tolist() == [3]
+    assert minar.filtrar_posiciones(df, 'productos', 'precio', '<=100').tolist() == [0, 1]
+
+
+def test_huerfanas_ignora_fk_vacias():
+    # Una FK puesta en nulo se guarda vacía y el CSV la vuelve a leer como ''
+    indice = minar.IndiceClaves(pd.Series(['1', '2', '3']))
+    resultado = minar.contar_huerfanas(pd.Series(['1', '', ' ', '99', '3']), indice)
+    assert resultado['huerfanas'] == 1
+    assert resultado['nulos'] == 2
+    assert resultado['ejemplos'] == ['99']
+
+
+def test_claves_huerfanas_sin_traer_claves_del_servidor():
+    tablas = {'clientes': pd.DataFrame({'id_cliente': ['1', '2']})}
+    enviadas = pd.DataFrame({'id_factura': ['10', '11', '12', '13'], 'id_cliente': ['1', '7', '', '2']})
+    huerfanas = [{'columna_hija': 'id_cliente', 'tabla_padre': 'clientes', 'columna_padre': 'id_cliente',
+                  'cantidad': 2, 'muestra': ['7']}]
+    minar.indices_claves.pop('clientes', None)
+    claves = minar._claves_huerfanas_locales(enviadas, 'id_factura', huerfanas, tablas)
+    assert claves.tolist() == ['11', '12']
+    # Si el servidor vio otra cantidad, ninguna fila enviada queda como sincronizada
+    huerfanas[0]['cantidad'] = 3
+    claves = minar._claves_huerfanas_locales(enviadas, 'id_factura', huerfanas, tablas)
+    assert claves.tolist() == ['10', '11', '12', '13']
+    minar.indices_claves.pop('clientes', None)
+
+
+def _asignador(tmp_path, monkeypatch):
+    monkeypatch.setattr(minar, 'DIR_SECUENCIAS', str(tmp_path))
+    monkeypatch.setattr(minar, 'SECUENCIAS_POSTGRES', False)
+    return minar.AsignadorIds()
+
+
+def test_reserva_en_bloque_es_contigua_y_persistente(tmp_path, monkeypatch):
+    asignador = _asignador(tmp_path, monkeypatch)
+    df = pd.DataFrame({'id_rubro': [1, 2, 7]})
+    assert asignador.reservar('rubros', 'id_rubro', 100, df) == 8
+    assert asignador.siguiente('rubros', 'id_rubro', df) == 108
+    # Otro proceso continúa desde lo guardado, no desde el máximo de la tabla
+    assert minar.AsignadorIds().consultar('rubros', 'id_rubro', df) == 109
+
+
+def test_secuencia_no_retrocede(tmp_path, monkeypatch):
+    asignador = _asignador(tmp_path, monkeypatch)
+    asignador.avanzar('rubros', 'id_rubro', 50)
+    asignador.avanzar('rubros', 'id_rubro', 10)
+    assert asignador.consultar('rubros', 'id_rubro') == 50
+
+
+def test_eliminar_no_renumera_y_deja_huerfanas_las_referencias():
+    tablas = {
+        'clientes': pd.DataFrame({'id_cliente': [1, 2, 3], 'nombre': ['a', 'b', 'c']}),
+        'facturas': pd.DataFrame({'id_factura': [1, 2, 3], 'id_cliente': [2, 3, 3]}),
+    }
+    df, cascada = minar.aplicar_con_cascada(tablas['clientes'], 'clientes',
+                                            [{'op': 'eliminar_filas', 'posiciones': [1]}], tablas)
+    assert df['id_cliente'].tolist() == [1, 3]
+    assert minar.huerfanas_cascada(cascada) == {'facturas': 1}
+    minar.aplicar_cascada(tablas, cascada)
+    assert tablas['facturas']['id_cliente'].tolist()[1:] == [3, 3]
+    assert pd.isna(tablas['facturas']['id_cliente'].iloc[0])
+
+
+def test_indice_de_claves_se_mantiene_en_altas_bajas_y_deshacer():
+    tablas = {'clientes': pd.DataFrame({'id_cliente': [1, 2, 3], 'nombre': ['a', 'b', 'c']})}
+    minar.invalidar_indice_claves('clientes')
+    indice = minar.obtener_indice_claves('clientes', tablas)
+    transaccion = minar.TransaccionTabla(tablas['clientes'], 'clientes', tablas)
+    transaccion.aplicar([{'op': 'insertar', 'registros': [{'id_cliente': 4, 'nombre': 'd'}]}], "alta")
+    transaccion.aplicar([{'op': 'eliminar_filas', 'posiciones': [1]}], "baja")
+    # El mismo índice, actualizado en el lugar en vez de descartado
+    assert minar.indices_claves['clientes'] is indice
+    assert indice.contiene_varios([1, 2, 3, 4]).tolist() == [True, False, True, True]
+    transaccion.deshacer()
+    transaccion.deshacer()
+    assert minar.indices_claves['clientes'] is indice
+    assert indice.contiene_varios([1, 2, 3, 4]).tolist() == [True, True, True, False]
+    minar.invalidar_indice_claves('clientes')
+
+
+def test_integridad_de_sync_solo_revisa_las_fk_de_las_tablas_enviadas(tmp_path, monkeypatch):
+    monkeypatch.setattr(minar, 'DIR_CACHE', str(tmp_path))
+    monkeypatch.setattr(minar, '_cache_integridad', None)
+    tablas = {
+        'clientes': pd.DataFrame({'id_cliente': [1, 2]}),
+        'facturas': pd.DataFrame({'id_factura': [1, 2], 'id_cliente': [1, 9]}),
+    }
+    assert minar.verificar_integridad(tablas, hijas={'clientes'}, usar_cache=False) == {}
+    resultados = minar.verificar_integridad(tablas, hijas={'facturas'}, usar_cache=False)
+    assert [resultado['huerfanas'] for resultado in resultados.values()] == [1]
+    minar.invalidar_indice_claves('clientes')
+
+
+def test_deshacer_y_rehacer_vuelven_exactamente_a_cada_estado():
+    original = pd.DataFrame({'id_producto': [1, 2, 3], 'precio': ['10', '20', '30']})
+    tablas = {'productos': original}
+    transaccion = minar.TransaccionTabla(original, 'productos', tablas)
+    transaccion.aplicar([{'op': 'insertar', 'registros': [{'id_producto': 4, 'precio': '40'}]}], "alta")
+    transaccion.aplicar([{'op': 'cambiar_tipo', 'columna': 'precio', 'tipo': 'int'}], "tipo")
+    transaccion.aplicar([{'op': 'agregar_columna', 'columna': 'stock', 'valor': 0}], "columna")
+    transaccion.aplicar([{'op': 'renombrar_columna', 'de': 'stock', 'a': 'existencias'}], "renombre")
+    transaccion.aplicar([{'op': 'eliminar_filas', 'posiciones': [0, 2]}], "baja")
+    final = transaccion.df
+    while transaccion.deshacer():
+        pass
+    pd.testing.assert_frame_equal(transaccion.df, original)
+    assert tablas['productos'] is transaccion.df
+    while transaccion.rehacer():
+        pass
+    pd.testing.assert_frame_equal(transaccion.df, final)
+    assert transaccion.descripciones() == ["alta", "tipo", "columna", "renombre", "baja"]
+
+
+def test_confirmar_con_cascada_encola_un_solo_trabajo_con_la_hija(monkeypatch):
+    cola = minar.queue.Queue()
+    monkeypatch.setattr(minar, '_iniciar_persistencia', lambda: None)
+    monkeypatch.setattr(minar, '_persistencia_cola', cola)
+    monkeypatch.setattr(minar, '_persistencia_pendiente', {})
+    monkeypatch.setattr(minar, 'PERSISTENCIA_SEGUNDO_PLANO', True)
+    monkeypatch.setattr(minar, 'registrar_cambio', lambda *args: None)
+    clientes = pd.DataFrame({'id_cliente': [1, 2]})
+    facturas = pd.DataFrame({'id_factura': [1], 'id_cliente': [2]})
+    # Un guardado suelto de la hija que sigue en cola se suma al trabajo de la cascada
+    minar.encolar_persistencia(facturas, 'facturas', [{'op': 'agregar_columna', 'columna': 'nota', 'valor': ''}])
+    remapeo = [{'op': 'remapear_columna', 'columna': 'id_cliente', 'de': [2], 'a': [5]}]
+    minar.guardar_con_cascada({'clientes': clientes, 'facturas': facturas}, 'clientes', clientes, None,
+                              {'facturas': remapeo})
+    pendientes = minar._persistencia_pendiente
+    assert list(pendientes) == ['clientes']
+    assert pendientes['clientes']['completo']
+    hija = pendientes['clientes']['hijas']['facturas']
+    assert [op['op'] for op in hija['operaciones']] == ['agregar_columna', 'remapear_columna']
+    assert cola.qsize() == 2
+
+
+def test_agregar_registro_en_lote_no_consume_la_secuencia_hasta_guardar(tmp_path, monkeypatch):
+    asignador = _asignador(tmp_path, monkeypatch)
+    monkeypatch.setattr(minar, 'secuencias_ids', asignador)
+    monkeypatch.setattr(minar, 'tablas_referencia', None)
+    parser = minar._parser_lote()
+    tablas = {'rubros': pd.DataFrame({'id_rubro': [1, 2], 'nombre': ['a', 'b']})}
+    pendientes, cambios, reservas = {}, {}, {}
+    for nombre in ('c', 'd'):
+        args = parser.parse_args(['agregar-registro', 'rubros', f'nombre={nombre}'])
+        minar._aplicar_comando_lote(args, tablas, pendientes, cambios, reservas=reservas)
+    assert tablas['rubros']['id_rubro'].tolist() == [1, 2, 3, 4]
+    assert reservas == {('rubros', 'id_rubro'): 5}
+    # Un lote cancelado no deja IDs consumidos
+    assert asignador.consultar('rubros', 'id_rubro', tablas['rubros']) == 3
+
+
+def test_script_que_se_incluye_a_si_mismo_es_un_error(tmp_path):
+    primero, segundo = tmp_path / "a.txt", tmp_path / "b.txt"
+    primero.write_text(f"script {segundo}\n", encoding='utf-8')
+    segundo.write_text(f"compactar\nscript {primero}\n", encoding='utf-8')
+    with pytest.raises(ValueError, match="cíclica"):
+        minar._leer_script(minar._parser_lote(), str(primero))
+
+
+class _CursorConFk:
+    """Cursor falso: borrar una clave referenciada viola la FK"""
+
+    def __init__(self, referenciadas):
+        self.referenciadas = referenciadas
+        self.borradas = []
+        self.rowcount = -1
+
+    def execute(self, consulta, parametros=None):
+        self.rowcount = -1
+        if parametros is None:
+            return
+        claves = parametros[0]
+        if set(claves) & self.referenciadas:
+            raise minar.psycopg2.errors.ForeignKeyViolation("referenciada")
+        self.borradas.extend(claves)
+        self.rowcount = len(claves)
+
+
+def test_eliminar_claves_aparta_las_referenciadas_por_otras_tablas():
+    cursor = _CursorConFk({'2'})
+    eliminadas, bloqueadas = minar._eliminar_claves_postgres(cursor, 'clientes', 'id_cliente', 'integer', ['1', '2', '3'])
+    assert (eliminadas, bloqueadas) == (2, ['2'])
+    assert cursor.borradas == ['1', '3']
+    assert minar._eliminar_claves_postgres(_CursorConFk(set()), 'clientes', 'id_cliente', 'integer', ['4']) == (1, [])
+
+
+def test_descarga_conserva_numeric_exacto():
+    from decimal import Decimal
+    filas = [(1, Decimal('12345678901234567.89'), 0.5), (2, None, None)]
+    tipos = {'id_producto': 'integer', 'precio': 'numeric(20,2)', 'peso': 'double precision'}
+    bloque = minar._bloque_descarga(filas, ['id_producto', 'precio', 'peso'], tipos)
+    assert bloque.to_csv(index=False).splitlines()[1] == "1,12345678901234567.89,0.5"
+
+
+class _ConexionFalsa:
+    closed = 0
+
+    def __init__(self, devuelta, fallida=False):
+        self.devuelta = devuelta
+        self.fallida = fallida
+        self.consultas = 0
+
+    def cursor(self):
+        conexion = self
+
+        class Cursor:
+            def execute(self, consulta):
+                conexion.consultas += 1
+
+            def close(self):
+                pass
+        return Cursor()
+
+    def rollback(self):
+        pass
+
+
+def test_pool_solo_verifica_conexiones_inactivas_o_fallidas():
+    ahora = minar.time.monotonic()
+    reciente = _ConexionFalsa(ahora)
+    inactiva = _ConexionFalsa(ahora - minar.POOL_VERIFICAR_INACTIVA - 1)
+    fallida = _ConexionFalsa(ahora, fallida=True)
+    assert all(minar._conexion_sana(conn) for conn in (reciente, inactiva, fallida))
+    assert [conn.consultas for conn in (reciente, inactiva, fallida)] == [0, 1, 1]
+    assert not fallida.fallida
+
+
+def test_reindexar_remapea_las_fk_de_las_tablas_hijas_y_deshacer_las_restaura():
+    clientes = pd.DataFrame({'id_cliente': [10, 20, 30], 'nombre': ['a', 'b', 'c']})
+    facturas = pd.DataFrame({'id_factura': [1, 2, 3], 'id_cliente': [30, 10, 30]})
+    tablas = {'clientes': clientes, 'facturas': facturas}
+    transaccion = minar.TransaccionTabla(clientes, 'clientes', tablas)
+    transaccion.aplicar([{'op': 'reindexar', 'columna': 'id_cliente'}], "reindexar")
+    assert tablas['clientes']['id_cliente'].tolist() == [1, 2, 3]
+    assert tablas['facturas']['id_cliente'].tolist() == [3, 1, 3]
+    transaccion.deshacer()
+    pd.testing.assert_frame_equal(tablas['facturas'], facturas)
+    pd.testing.assert_frame_equal(tablas['clientes'], clientes)
+
+
+def test_reproducir_el_journal_da_la_tabla_editada_en_memoria(tmp_path, monkeypatch):
+    monkeypatch.setattr(minar, 'BASE_AUXILIAR', str(tmp_path))
+    monkeypatch.setattr(minar, 'DIR_JOURNAL', str(tmp_path / "_journal"))
+    monkeypatch.setattr(minar, 'CACHE_COLUMNAR', False)
+    monkeypatch.setattr(minar, 'JOURNAL_HABILITADO', True)
+    monkeypatch.setattr(minar, '_operaciones_journal', {})
+    ruta = str(tmp_path / "productos.csv")
+    minar.guardar_tabla_individual(pd.DataFrame({'id_producto': [1, 2, 3], 'nombre': ['x', 'y', 'z']}), 'productos')
+    transaccion = minar.TransaccionTabla(minar.cargar_tabla(ruta), 'productos', {})
+    transaccion.aplicar([{'op': 'insertar', 'registros': [{'id_producto': 4, 'nombre': 'w'}]}], "alta")
+    transaccion.aplicar([{'op': 'eliminar_filas', 'posiciones': [1]}], "baja")
+    transaccion.aplicar([{'op': 'agregar_columna', 'columna': 'stock', 'valor': '0'}], "columna")
+    transaccion.aplicar([{'op': 'renombrar_columna', 'de': 'nombre', 'a': 'descripcion'}], "renombre")
+    operaciones = [op for paso in transaccion.hechos for op in paso.operaciones]
+    minar.persistir_tabla(transaccion.df, 'productos', operaciones)
+    assert minar.tiene_journal('productos')
+    pd.testing.assert_frame_equal(minar.cargar_tabla(ruta), transaccion.df)